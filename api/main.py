@@ -2,12 +2,14 @@ from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Dict, Any, Optional
 import logging
+from collections import Counter
 from datetime import datetime
 import json
 
 from database.dynamodb_connection import get_dynamodb_client, verify_existing_tables
 from database.dynamodb_models import DataFetcher
 from services.data_processor import DataProcessor
+from services.email_template_service import EmailTemplateService
 from config.settings import settings
 from database import postgres as pg
 
@@ -31,6 +33,7 @@ app.add_middleware(
 
 data_processor = DataProcessor()
 dynamodb_access = DataFetcher()
+email_template_service = EmailTemplateService()
 
 @app.on_event("startup")
 async def startup_event():
@@ -362,6 +365,26 @@ async def admin_get_features(user_id: Optional[str] = None, email: Optional[str]
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/admin/email_preview")
+def admin_email_preview(template_id: str, email: Optional[str] = None, user_id: Optional[str] = None):
+    """
+    Render (without queueing or sending) the email a template would produce from the
+    user's latest saved features. Sync endpoint: generation blocks on the LLM, so
+    FastAPI runs it in its threadpool.
+    """
+    try:
+        user = _resolve_user(email, user_id)
+        content = email_template_service.generate_email_content_for_user(template_id, user["id"], user.get("email"))
+        if content is None:
+            raise HTTPException(status_code=404, detail="No saved features for user")
+        return {"user": user, "email": content}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("admin_email_preview failed")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/admin/decisions")
 async def admin_get_decisions(user_id: Optional[str] = None, email: Optional[str] = None, run_id: Optional[str] = None, limit: int = 100):
     """
@@ -532,12 +555,11 @@ async def admin_get_tenants():
     """
     try:
         users = dynamodb_access.investor_prod.get_all_users()
-        counts: Dict[str, int] = {}
-        for u in users or []:
-            tn = (u.get("tenantName") or u.get("tenant") or "unknown") or "unknown"
-            counts[tn] = counts.get(tn, 0) + 1
-        tenants = [{"tenantName": k, "count": v} for k, v in counts.items()]
-        tenants.sort(key=lambda x: x["count"], reverse=True)
+        counts = Counter(
+            (u.get("tenantName") or u.get("tenant") or "unknown") or "unknown"
+            for u in users or []
+        )
+        tenants = [{"tenantName": k, "count": v} for k, v in counts.most_common()]
         return {"tenants": tenants, "total_users": len(users or [])}
     except HTTPException:
         raise
@@ -48,6 +48,17 @@ class Settings(BaseSettings):
     # AI/LLM
     OPENAI_API_KEY: Optional[str] = None
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
+    LLM_EMAIL_MODEL: str = "gpt-4"
+    LLM_EMAIL_STRUCTURED_OUTPUT: bool = False  # json_schema response_format; needs a model that supports it (e.g. gpt-4o)
+    LLM_MAX_CONCURRENCY: int = 8  # max in-flight LLM calls for batch email generation
+    LLM_TIMEOUT_SECONDS: float = 15.0  # per-call bound on LLM email generation
+    LLM_MAX_RETRIES: int = 2  # retries (with exponential backoff) on failed LLM calls
+    EMAIL_LLM_CACHE_TTL_SECONDS: int = 86400  # reuse identical-prompt email copy for a day
+    EMAIL_LLM_CACHE_MAX_ENTRIES: int = 4096  # in-process LRU bound for that cache
+    CONVO_ANALYSIS_CACHE_TTL_SECONDS: int = 86400  # reuse the analysis of unchanged conversation text for a day
+    CONVO_ANALYSIS_CACHE_MAX_ENTRIES: int = 4096  # in-process LRU bound for that cache
+    EMAIL_BATCH_MIN_SIZE: int = 1000  # runs at least this large go through the OpenAI Batch API
+    EVENT_PROCESSING_CONCURRENCY: int = 10  # events processed at once by EventProcessor.process_events_async
     
     # Email
     SENDGRID_API_KEY: Optional[str] = None
@@ -99,6 +110,10 @@ class Settings(BaseSettings):
     WEAK_TOPIC_MAX_ACCURACY: float = 0.60
     MAX_WEAK_TOPICS: int = 3
 
+    # Daily feature computation
+    FEATURE_COMPUTE_WORKERS: int = 0  # processes for compute_daily_features; 0 = os.cpu_count(), 1 = in-process
+    FEATURE_USER_THREADS: int = 8  # threads per user batch for the per-user DynamoDB/LLM calls; 1 = sequential
+
     model_config = ConfigDict(
         env_file=".env",
         env_file_encoding='utf-8',
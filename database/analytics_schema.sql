@@ -0,0 +1,120 @@
+-- Behavioural analytics schema: the tables behind database/models.py (FeatureEngine,
+-- DecisionEngine, EventProcessor, ingestor). They live in their own `analytics` schema:
+-- public.events / public.features in supabase_schema.sql are the pipeline audit log.
+-- Apply with: make apply-sql SCHEMA=database/analytics_schema.sql
+-- then, in order:
+--   database/events_denormalized_columns.sql
+--   database/event_rollups.sql
+--   database/feature_indexes.sql
+-- Safe to re-run (IF NOT EXISTS throughout).
+
+CREATE SCHEMA IF NOT EXISTS analytics;
+
+-- ==========================================
+-- app_users (AppUser): platform users, keyed by the platform user_id
+-- ==========================================
+CREATE TABLE IF NOT EXISTS analytics.app_users (
+  user_id text PRIMARY KEY,
+  email text NOT NULL,
+  first_name text,
+  last_name text,
+  tz text NOT NULL DEFAULT 'America/Los_Angeles',
+  plan text,
+  status text,
+  tenant_id text,
+  tenant_name text,
+  consent_email boolean NOT NULL DEFAULT true,
+  created_at timestamptz,
+  last_login_at timestamptz,
+  raw jsonb,
+  updated_at timestamptz
+);
+
+-- ==========================================
+-- content_items (ContentItem)
+-- ==========================================
+CREATE TABLE IF NOT EXISTS analytics.content_items (
+  content_id text PRIMARY KEY,
+  content_type text,          -- presentation|quiz|lesson|section|question
+  title text,
+  subject text,
+  grade_subject text,
+  metadata jsonb,
+  created_at timestamptz,
+  updated_at timestamptz
+);
+
+-- ==========================================
+-- events (Event): behavioural event log (login, convo_msg, test_attempt, ...)
+-- ==========================================
+CREATE TABLE IF NOT EXISTS analytics.events (
+  event_id text PRIMARY KEY,
+  user_id text NOT NULL,
+  ts timestamptz NOT NULL,
+  name text NOT NULL,
+  source text,
+  session_id text,
+  props jsonb,
+  created_at timestamptz DEFAULT now()
+);
+
+-- ==========================================
+-- convo_summaries (ConvoSummary): one row per conversation session
+-- ==========================================
+CREATE TABLE IF NOT EXISTS analytics.convo_summaries (
+  session_id text PRIMARY KEY,
+  user_id text NOT NULL,
+  started_at timestamptz,
+  ended_at timestamptz,
+  summary text,
+  topics jsonb,               -- ["Biology>Cells", ...]
+  sentiment real,             -- -1..+1
+  needs jsonb,
+  embedding double precision[],
+  last_message_count integer,
+  last_summarized_at timestamptz
+);
+
+-- ==========================================
+-- user_daily_features (UserDailyFeatures): FeatureEngine output per user per day
+-- ==========================================
+CREATE TABLE IF NOT EXISTS analytics.user_daily_features (
+  user_id text NOT NULL,
+  as_of date NOT NULL,
+  recency_days integer,
+  frequency_7d integer,
+  minutes_7d integer,
+  tests_7d integer,
+  avg_score_change_30d real,
+  top_topics jsonb,
+  subject_affinity jsonb,     -- {"Biology":0.7,"Algebra":0.3}
+  convo_sentiment_7d_avg real,
+  churn_risk text,            -- low|med|high
+  last_email_ts timestamptz,
+  emails_sent_7d integer NOT NULL DEFAULT 0,
+  unsubscribed boolean NOT NULL DEFAULT false,
+  PRIMARY KEY (user_id, as_of)
+);
+
+-- ==========================================
+-- email_sends (EmailSend)
+-- ==========================================
+CREATE TABLE IF NOT EXISTS analytics.email_sends (
+  send_id text PRIMARY KEY,
+  user_id text NOT NULL,
+  ts timestamptz,
+  template_id text,
+  subject text,
+  provider_id text,
+  status text,                -- queued|sent|bounced|complaint|opened|clicked
+  meta jsonb
+);
+
+-- ==========================================
+-- unsubscribes (Unsubscribe)
+-- ==========================================
+CREATE TABLE IF NOT EXISTS analytics.unsubscribes (
+  user_id text NOT NULL,
+  ts timestamptz,
+  reason text
+);
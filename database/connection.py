@@ -1,5 +1,6 @@
+import json
 import logging
-from typing import Optional, Iterator
+from typing import Any, Optional, Iterator
 
 from config.settings import settings
 
@@ -15,6 +16,25 @@ except Exception:
     sessionmaker = None  # type: ignore
     SQLALCHEMY_AVAILABLE = False
 
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # type: ignore
+
+
+def json_dumps(value: Any) -> str:
+    """
+    JSON for jsonb columns: orjson when installed (C; native datetime/UUID/numpy),
+    stdlib otherwise. Anything else unsupported is stored as str(value).
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            value,
+            default=str,
+            option=orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        ).decode()
+    return json.dumps(value, default=str)
+
 
 engine = None
 SessionLocal: Optional[object] = None  # will be set to a callable/session factory when enabled
@@ -43,7 +63,9 @@ def _init_engine_and_session():
         return
 
     try:
-        engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True, echo=settings.DEBUG)  # type: ignore
+        engine = create_engine(  # type: ignore
+            settings.DATABASE_URL, pool_pre_ping=True, echo=settings.DEBUG, json_serializer=json_dumps
+        )
         SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)  # type: ignore
         logger.info("SQLAlchemy engine initialized.")
     except Exception as e:
@@ -3,6 +3,7 @@ from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
 from config.settings import settings
 import logging
+import threading
 from typing import Dict, List, Optional, Any
 import json
 from datetime import datetime
@@ -46,10 +47,20 @@ class DynamoDBConnection:
 
 # Global DynamoDB connection instance
 dynamodb_conn = DynamoDBConnection()
+_thread_conns = threading.local()
+_main_thread = threading.main_thread()
 
 def get_dynamodb():
-    """Get DynamoDB connection"""
-    return dynamodb_conn
+    """
+    Get DynamoDB connection. boto3 sessions and resources are not thread-safe, so
+    threads other than the main one each get (and keep) their own connection.
+    """
+    if threading.current_thread() is _main_thread:
+        return dynamodb_conn
+    conn = getattr(_thread_conns, 'conn', None)
+    if conn is None:
+        conn = _thread_conns.conn = DynamoDBConnection()
+    return conn
 
 def get_dynamodb_client():
     """Get DynamoDB client - alias for get_dynamodb for compatibility"""
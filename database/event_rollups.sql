@@ -0,0 +1,39 @@
+-- Rollups of analytics.events read by FeatureEngine instead of rescanning the raw log.
+-- Apply after database/analytics_schema.sql:
+--   make apply-sql SCHEMA=database/event_rollups.sql
+-- FeatureEngine.compute_daily_features only refreshes/fills these; it does not create them.
+
+-- ==========================================
+-- mv_user_day_event_stats: per-(user, day, event name) counts and first/last ts.
+-- Recency, frequency_7d and tests_7d are summed from here. Refreshed with
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY at the start of each daily run, which
+-- needs the unique index below.
+-- ==========================================
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics.mv_user_day_event_stats AS
+SELECT
+  user_id,
+  ts::date AS day,
+  name,
+  count(*) AS cnt,
+  min(ts) AS first_ts,
+  max(ts) AS last_ts
+FROM analytics.events
+GROUP BY user_id, ts::date, name;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mv_user_day_event_stats_key
+  ON analytics.mv_user_day_event_stats (user_id, day, name);
+
+-- ==========================================
+-- daily_user_ir: per-(user, day) intermediate aggregates behind the 30-day features
+-- (score trend, subject affinity). FeatureEngine.rollup_daily_ir folds each day in
+-- once, and re-folds the trailing days every run to pick up late-arriving events.
+-- ==========================================
+CREATE TABLE IF NOT EXISTS analytics.daily_user_ir (
+  user_id text NOT NULL,
+  day date NOT NULL,
+  tests_correct_cnt integer NOT NULL,
+  tests_total_cnt integer NOT NULL,
+  subject_counts jsonb NOT NULL,  -- {subject: events that day}
+  computed_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (user_id, day)
+);
@@ -0,0 +1,33 @@
+-- Denormalized hot props keys on the behavioural events table, analytics.events
+-- (Event model; created by database/analytics_schema.sql), used by FeatureEngine's
+-- SQL aggregates. Not public.events, the pipeline audit log.
+-- Apply with: make apply-sql SCHEMA=database/events_denormalized_columns.sql
+--
+-- Both columns are generated from props, so PostgreSQL backfills existing rows
+-- when they are added and keeps them current on every insert/update; writers
+-- do not need to change.
+
+-- ==========================================
+-- subject: same precedence as the old Python extraction
+--   subject | Subject | course_subject | course
+--   | "Biology>Cells" topic prefix | subject_tag
+-- ==========================================
+ALTER TABLE analytics.events ADD COLUMN IF NOT EXISTS subject text GENERATED ALWAYS AS (
+  NULLIF(btrim(COALESCE(
+    NULLIF(props->>'subject', ''),
+    NULLIF(props->>'Subject', ''),
+    NULLIF(props->>'course_subject', ''),
+    NULLIF(props->>'course', ''),
+    NULLIF(btrim(CASE
+      WHEN strpos(COALESCE(NULLIF(props->>'topic', ''), props->>'Topic'), '>') > 0
+      THEN split_part(COALESCE(NULLIF(props->>'topic', ''), props->>'Topic'), '>', 1)
+    END), ''),
+    props->>'subject_tag'
+  )), '')
+) STORED;
+
+ALTER TABLE analytics.events ADD COLUMN IF NOT EXISTS presentation_id text
+  GENERATED ALWAYS AS (props->>'presentation_id') STORED;
+
+CREATE INDEX IF NOT EXISTS idx_events_subject_user_ts ON analytics.events (user_id, ts) WHERE subject IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_events_presentation_user_ts ON analytics.events (user_id, ts) WHERE presentation_id IS NOT NULL;
@@ -0,0 +1,16 @@
+-- Composite indexes behind FeatureEngine's per-user reads on the analytics tables.
+-- Equality columns lead and the ts range comes last, so each read is one index range scan.
+-- Apply after database/events_denormalized_columns.sql (the events index INCLUDEs its columns):
+--   make apply-sql SCHEMA=database/feature_indexes.sql
+-- apply_sql runs the file in one transaction, so these are plain CREATE INDEX (writes to
+-- the table wait while it builds). On a large live table, run each statement by hand as
+-- CREATE INDEX CONCURRENTLY instead.
+
+-- (user_id, name IN ..., ts range) reads; INCLUDE the small denormalized columns for
+-- index-only scans (not props: large jsonb would overflow btree tuples)
+CREATE INDEX IF NOT EXISTS idx_events_user_name_ts
+  ON analytics.events (user_id, name, ts) INCLUDE (subject, presentation_id);
+
+CREATE INDEX IF NOT EXISTS idx_convo_summary_user_started ON analytics.convo_summaries (user_id, started_at);
+CREATE INDEX IF NOT EXISTS idx_email_send_user_ts ON analytics.email_sends (user_id, ts);
+CREATE INDEX IF NOT EXISTS idx_unsubscribe_user ON analytics.unsubscribes (user_id);
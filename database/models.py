@@ -1,3 +1,6 @@
+# Behavioural analytics records. Their Postgres tables live in the `analytics` schema
+# (database/analytics_schema.sql and the migrations listed there), separate from the
+# public.* pipeline audit tables in database/supabase_schema.sql.
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime, date
@@ -37,6 +40,8 @@ class Event(BaseModel):
     source: Optional[str] = None
     session_id: Optional[str] = None
     props: Optional[Dict[str, Any]] = None
+    subject: Optional[str] = None  # generated column on analytics.events (database/events_denormalized_columns.sql)
+    presentation_id: Optional[str] = None  # generated column from props['presentation_id'] (same migration)
     created_at: Optional[datetime] = None
 
 class ConvoSummary(BaseModel):
@@ -49,6 +54,8 @@ class ConvoSummary(BaseModel):
     sentiment: Optional[float] = None  # -1..+1
     needs: Optional[List[str]] = None
     embedding: Optional[List[float]] = None  # OpenAI embedding
+    last_message_count: Optional[int] = None  # messages covered by the latest summary
+    last_summarized_at: Optional[datetime] = None
 
 class UserDailyFeatures(BaseModel):
     user_id: str
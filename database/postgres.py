@@ -1,14 +1,21 @@
 import logging
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from datetime import datetime
 from uuid import UUID
 import json
-from psycopg2.extras import Json
+from psycopg2.errors import UndefinedTable
+from psycopg2.extras import Json, execute_values
 from sqlalchemy import text
-from database.connection import engine
+from database.connection import engine, json_dumps
 
 logger = logging.getLogger(__name__)
 
+_BULK_PAGE_SIZE = 500  # rows per multi-row INSERT statement
+
+
+def _json(value: Any) -> Json:
+    return Json(value, dumps=json_dumps)
+
 
 def _ensure_engine():
     if engine is None:
@@ -74,7 +81,7 @@ def upsert_user_by_email(email: str, first_name: Optional[str] = None, last_name
                 VALUES (:email, :first_name, :last_name, :metadata)
                 RETURNING id
             """),
-            {"email": email, "first_name": first_name, "last_name": last_name, "metadata": Json(meta)},
+            {"email": email, "first_name": first_name, "last_name": last_name, "metadata": _json(meta)},
         ).mappings().first()
         return row["id"]  # type: ignore
 
@@ -88,7 +95,7 @@ def start_run(user_id: UUID, context: Optional[Dict[str, Any]] = None) -> UUID:
                 VALUES (:user_id, 'started', :context)
                 RETURNING id
             """),
-            {"user_id": user_id, "context": Json(context or {})},
+            {"user_id": user_id, "context": _json(context or {})},
         ).mappings().first()
         return row["id"]  # type: ignore
 
@@ -127,7 +134,7 @@ def log_event(
                     ON CONFLICT (dedupe_key) DO NOTHING
                     RETURNING id
                 """),
-                {"run_id": run_id, "user_id": user_id, "event_type": event_type, "payload": Json(payload or {}), "dedupe_key": dedupe_key},
+                {"run_id": run_id, "user_id": user_id, "event_type": event_type, "payload": _json(payload or {}), "dedupe_key": dedupe_key},
             ).mappings().first()
             return row["id"] if row else None
         else:
@@ -137,36 +144,170 @@ def log_event(
                     VALUES (:run_id, :user_id, :event_type, :payload)
                     RETURNING id
                 """),
-                {"run_id": run_id, "user_id": user_id, "event_type": event_type, "payload": Json(payload or {})},
+                {"run_id": run_id, "user_id": user_id, "event_type": event_type, "payload": _json(payload or {})},
             ).mappings().first()
             return row["id"]  # type: ignore
 
 
+def _execute_values(conn, sql: str, rows: List[Tuple[Any, ...]], template: Optional[str] = None,
+                    fetch: bool = False) -> List[Tuple[Any, ...]]:
+    """
+    One multi-row statement per page (psycopg2 execute_values) instead of a round-trip per row.
+    `sql` must contain a single `VALUES %s` placeholder. With `fetch`, returns the
+    RETURNING rows of every page.
+    """
+    if not rows:
+        return []
+    cur = conn.connection.cursor()
+    try:
+        return execute_values(cur, sql, rows, template=template, page_size=_BULK_PAGE_SIZE, fetch=fetch) or []
+    finally:
+        cur.close()
+
+
 def insert_features(user_id: UUID, run_id: Optional[UUID], features: Dict[str, Any]) -> None:
     """
-    Upsert per (user_id, name, run_id). Values stored as jsonb.
+    Upsert per (user_id, name, run_id). Values stored as jsonb; the day's
+    daily_feature_snapshots row is refreshed in the same transaction.
+    """
+    insert_features_many([(user_id, run_id, features)])
+
+
+def insert_features_many(items: List[Tuple[UUID, Optional[UUID], Dict[str, Any]]]) -> None:
+    """
+    Bulk form of insert_features: items are (user_id, run_id, features) tuples.
     """
     _ensure_engine()
-    now = datetime.utcnow().isoformat()
-    with engine.begin() as conn:  # type: ignore
+    # One row per (user_id, name, run_id): ON CONFLICT cannot update the same row twice
+    # in one statement, so later items for a key replace earlier ones
+    latest: Dict[Tuple[Any, str, Any], Tuple[Any, ...]] = {}
+    for user_id, run_id, features in items:
         for name, value in (features or {}).items():
-            conn.execute(
-                text("""
-                    INSERT INTO public.features (user_id, run_id, name, value, computed_at)
-                    VALUES (:user_id, :run_id, :name, :value, now())
-                    ON CONFLICT (user_id, name, run_id)
-                    DO UPDATE SET value = EXCLUDED.value, computed_at = EXCLUDED.computed_at
-                """),
-                {"user_id": user_id, "run_id": run_id, "name": str(name), "value": Json(value)},
+            latest[(user_id, str(name), run_id)] = (user_id, run_id, str(name), _json(value))
+    rows = list(latest.values())
+    with engine.begin() as conn:  # type: ignore
+        _execute_values(
+            conn,
+            """
+            INSERT INTO public.features (user_id, run_id, name, value, computed_at)
+            VALUES %s
+            ON CONFLICT (user_id, name, run_id)
+            DO UPDATE SET value = EXCLUDED.value, computed_at = EXCLUDED.computed_at
+            """,
+            rows,
+            template="(%s, %s, %s, %s, now())",
+        )
+        _upsert_daily_features(conn, items)
+
+
+def _text_array(values: Any) -> List[str]:
+    # A bare string is one topic, not a sequence of characters
+    return [str(v) for v in ([values] if isinstance(values, str) else values)]
+
+
+# Features promoted to typed daily_feature_snapshots columns (name -> Python coercion);
+# everything else lands in its `extra` jsonb
+_DAILY_FEATURE_COLUMNS: Dict[str, Callable[[Any], Any]] = {
+    "conversations_7d": int,
+    "tests_7d": int,
+    "minutes_7d": int,
+    "recency_days": int,
+    "frequency_7d": int,
+    "test_accuracy": float,
+    "icp_completion_rate": float,
+    "itp_improvement_trend": float,
+    "top_topics": _text_array,
+}
+
+# Set once the snapshot table turns out not to exist (migration not applied yet)
+_daily_features_missing = False
+
+
+def _daily_feature_column(name: str, value: Any) -> Any:
+    if value is None:
+        return None
+    try:
+        return _DAILY_FEATURE_COLUMNS[name](value)
+    except (TypeError, ValueError):
+        logger.warning(f"Feature {name}={value!r} does not fit its column; storing NULL")
+        return None
+
+
+def _upsert_daily_features(conn, items: List[Tuple[UUID, Optional[UUID], Dict[str, Any]]]) -> None:
+    """
+    Split each features dict into the hot typed columns and the `extra` blob and
+    upsert today's daily_feature_snapshots row (the latest run of the day wins).
+    Runs in a savepoint: without the table, the per-run feature rows still commit.
+    """
+    global _daily_features_missing
+    if _daily_features_missing:
+        return
+    # One row per user per day; later items for the same user replace earlier ones
+    latest: Dict[Any, Tuple[Any, ...]] = {}
+    for user_id, run_id, features in items:
+        features = features or {}
+        hot = [_daily_feature_column(name, features.get(name)) for name in _DAILY_FEATURE_COLUMNS]
+        extra = {k: v for k, v in features.items() if k not in _DAILY_FEATURE_COLUMNS}
+        latest[user_id] = (user_id, run_id, *hot, _json(extra))
+    columns = ", ".join(_DAILY_FEATURE_COLUMNS)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in ("run_id", *_DAILY_FEATURE_COLUMNS, "extra"))
+    try:
+        with conn.begin_nested():
+            _execute_values(
+                conn,
+                f"""
+                INSERT INTO public.daily_feature_snapshots (user_id, run_id, {columns}, extra, computed_at)
+                VALUES %s
+                ON CONFLICT (user_id, day)
+                DO UPDATE SET {updates}, computed_at = EXCLUDED.computed_at
+                """,
+                list(latest.values()),
+                template="(" + ", ".join(["%s"] * (len(_DAILY_FEATURE_COLUMNS) + 3)) + ", now())",
             )
+    except UndefinedTable:
+        _daily_features_missing = True
+        logger.warning(
+            "public.daily_feature_snapshots does not exist (apply database/supabase_schema.sql); "
+            "skipping typed feature snapshots"
+        )
+
+
+def fetch_latest_daily_features(user_id: UUID, include_extra: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Most recent daily_feature_snapshots row as a flat features dict, or None.
+    With include_extra=False only the typed columns are read (no jsonb decode).
+    """
+    columns = ", ".join(_DAILY_FEATURE_COLUMNS) + (", extra" if include_extra else "")
+    row = fetch_one(
+        f"""
+        SELECT {columns}
+        FROM public.daily_feature_snapshots
+        WHERE user_id = :uid
+        ORDER BY day DESC
+        LIMIT 1
+        """,
+        {"uid": user_id},
+    )
+    if row is None:
+        return None
+    extra = row.pop("extra", None) or {}
+    return {**extra, **row}
 
 
 def insert_decisions(user_id: UUID, run_id: Optional[UUID], decisions: List[Dict[str, Any]]) -> None:
     """
     Each decision: {rule_id|rule, decision, rationale?}
     """
+    insert_decisions_many([(user_id, run_id, decisions)])
+
+
+def insert_decisions_many(items: List[Tuple[UUID, Optional[UUID], List[Dict[str, Any]]]]) -> None:
+    """
+    Bulk form of insert_decisions: items are (user_id, run_id, decisions) tuples.
+    """
     _ensure_engine()
-    with engine.begin() as conn:  # type: ignore
+    rows = []
+    for user_id, run_id, decisions in items:
         for d in decisions or []:
             rule = d.get("rule_id") or d.get("rule") or "unknown_rule"
             decision_text = d.get("decision") or ("send_email" if d.get("template_id") else "skip")
@@ -175,13 +316,39 @@ def insert_decisions(user_id: UUID, run_id: Optional[UUID], decisions: List[Dict
                 "features": d.get("features"),
                 "raw": d,
             }
-            conn.execute(
-                text("""
-                    INSERT INTO public.decisions (user_id, run_id, rule, decision, rationale, decided_at)
-                    VALUES (:user_id, :run_id, :rule, :decision, :rationale, now())
-                """),
-                {"user_id": user_id, "run_id": run_id, "rule": rule, "decision": decision_text, "rationale": Json(rationale)},
-            )
+            rows.append((user_id, run_id, rule, decision_text, _json(rationale)))
+    with engine.begin() as conn:  # type: ignore
+        _execute_values(
+            conn,
+            """
+            INSERT INTO public.decisions (user_id, run_id, rule, decision, rationale, decided_at)
+            VALUES %s
+            """,
+            rows,
+            template="(%s, %s, %s, %s, %s, now())",
+        )
+
+
+def insert_events_many(events: List[Dict[str, Any]]) -> None:
+    """
+    Bulk form of log_event: each item has event_type and optional payload, user_id, run_id,
+    dedupe_key. Rows whose dedupe_key already exists are skipped. Ids are not returned.
+    """
+    _ensure_engine()
+    rows = [
+        (e.get("run_id"), e.get("user_id"), e["event_type"], _json(e.get("payload") or {}), e.get("dedupe_key"))
+        for e in events
+    ]
+    with engine.begin() as conn:  # type: ignore
+        _execute_values(
+            conn,
+            """
+            INSERT INTO public.events (run_id, user_id, event_type, payload, dedupe_key)
+            VALUES %s
+            ON CONFLICT (dedupe_key) DO NOTHING
+            """,
+            rows,
+        )
 
 
 def ensure_email_template(key: str, subject: str, body_html: str) -> None:
@@ -242,12 +409,70 @@ def create_email_attempt(
                 "unique_key": unique_key,
                 "scheduled_at": scheduled_at,
                 "sent_at": sent_at,
-                "metadata": Json(metadata or {}),
+                "metadata": _json(metadata or {}),
             },
         ).mappings().first()
         return (row["id"] if row else None, unique_key)
 
 
+def queue_email_attempts_many(items: List[Tuple[str, str, str, Dict[str, Any]]]) -> List[Optional[str]]:
+    """
+    Bulk form of upsert_user_by_email + ensure_email_template + create_email_attempt for
+    queued attempts: items are (email, template_key, stage, metadata) tuples, written in one
+    transaction. Returns, per item, the unique_key of the attempt it queued, or None if that
+    attempt already existed (or an earlier item queued it).
+    """
+    _ensure_engine()
+    if not items:
+        return []
+    emails = list({email.lower(): email for email, _, _, _ in items}.values())  # citext: one spelling each
+    template_keys = sorted({template_key for _, template_key, _, _ in items})
+    with engine.begin() as conn:  # type: ignore
+        _execute_values(
+            conn,
+            "INSERT INTO public.users (email) VALUES %s ON CONFLICT (email) DO NOTHING",
+            [(email,) for email in emails],
+        )
+        # Match the stored spelling case-insensitively
+        user_ids = {
+            row["email"].lower(): row["id"]
+            for row in conn.execute(
+                text("SELECT id, email FROM public.users WHERE email = ANY(:emails)"),
+                {"emails": emails},
+            ).mappings().all()
+        }
+        _execute_values(
+            conn,
+            "INSERT INTO public.email_templates (key, subject, body_html) VALUES %s ON CONFLICT (key) DO NOTHING",
+            [(key, key, f"<p>{key}</p>") for key in template_keys],
+        )
+        keys: List[Optional[str]] = []
+        rows: Dict[str, Tuple[Any, ...]] = {}
+        for email, template_key, stage, metadata in items:
+            user_id = user_ids[email.lower()]
+            unique_key = f"{user_id}:{template_key}:{stage}"
+            if unique_key in rows:
+                keys.append(None)
+                continue
+            rows[unique_key] = (user_id, template_key, stage, unique_key, _json(metadata or {}))
+            keys.append(unique_key)
+        inserted = {
+            row[0] for row in _execute_values(
+                conn,
+                """
+                INSERT INTO public.email_attempts (user_id, template_key, stage, status, unique_key, metadata)
+                VALUES %s
+                ON CONFLICT (unique_key) DO NOTHING
+                RETURNING unique_key
+                """,
+                list(rows.values()),
+                template="(%s, %s, %s, 'queued', %s, %s)",
+                fetch=True,
+            )
+        }
+    return [key if key in inserted else None for key in keys]
+
+
 def update_email_attempt_status(
     unique_key: Optional[str] = None,
     attempt_id: Optional[UUID] = None,
@@ -283,3 +508,94 @@ def update_email_attempt_status(
                 """),
                 {"status": status, "reason": reason, "id": attempt_id},
             )
+
+
+def fetch_email_attempts(unique_keys: List[str]) -> List[Dict[str, Any]]:
+    """
+    email_attempts rows (unique_key, template_key, status, metadata) for the given unique_keys.
+    """
+    if not unique_keys:
+        return []
+    return fetch_all(
+        """
+        SELECT unique_key, template_key, status, metadata
+        FROM public.email_attempts
+        WHERE unique_key = ANY(:keys)
+        """,
+        {"keys": list(unique_keys)},
+    )
+
+
+def save_email_attempt_copy(copies: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Merge generated copy ({unique_key: {"subject", "content", ...}}) into each attempt's metadata.
+    """
+    if not copies:
+        return
+    _ensure_engine()
+    with engine.begin() as conn:  # type: ignore
+        conn.execute(
+            text("""
+                UPDATE public.email_attempts
+                SET metadata = metadata || :copy
+                WHERE unique_key = :unique_key
+            """),
+            [{"unique_key": k, "copy": _json({"copy": v})} for k, v in copies.items()],
+        )
+
+
+def create_email_batch(
+    provider_batch_id: str,
+    status: str,
+    input_file_id: Optional[str],
+    custom_ids: List[str],
+) -> UUID:
+    """
+    Record a submitted Batch API job. custom_ids are the email_attempts unique_keys it covers.
+    """
+    _ensure_engine()
+    with engine.begin() as conn:  # type: ignore
+        row = conn.execute(
+            text("""
+                INSERT INTO public.email_batches (provider_batch_id, status, input_file_id, request_count, custom_ids)
+                VALUES (:provider_batch_id, :status, :input_file_id, :request_count, :custom_ids)
+                RETURNING id
+            """),
+            {
+                "provider_batch_id": provider_batch_id,
+                "status": status,
+                "input_file_id": input_file_id,
+                "request_count": len(custom_ids),
+                "custom_ids": _json(list(custom_ids)),
+            },
+        ).mappings().first()
+        return row["id"]  # type: ignore
+
+
+def update_email_batch(provider_batch_id: str, status: str, output_file_id: Optional[str] = None) -> None:
+    _ensure_engine()
+    with engine.begin() as conn:  # type: ignore
+        conn.execute(
+            text("""
+                UPDATE public.email_batches
+                SET status = :status,
+                    output_file_id = COALESCE(:output_file_id, output_file_id),
+                    completed_at = CASE WHEN :status = 'completed' THEN now() ELSE completed_at END
+                WHERE provider_batch_id = :provider_batch_id
+            """),
+            {"provider_batch_id": provider_batch_id, "status": status, "output_file_id": output_file_id},
+        )
+
+
+def fetch_pending_email_batches() -> List[Dict[str, Any]]:
+    """
+    Batches that have not reached a terminal provider status yet.
+    """
+    return fetch_all(
+        """
+        SELECT provider_batch_id, status, custom_ids, created_at
+        FROM public.email_batches
+        WHERE status NOT IN ('completed', 'failed', 'expired', 'cancelled')
+        ORDER BY created_at
+        """
+    )
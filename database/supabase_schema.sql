@@ -68,6 +68,29 @@ CREATE TABLE IF NOT EXISTS public.features (
 
 CREATE INDEX IF NOT EXISTS idx_features_user_name ON public.features (user_id, name);
 
+-- ==========================================
+-- daily_feature_snapshots: latest features per user per day, hot scalars as typed columns
+-- scoring/email reads select columns directly; the long tail stays in extra
+-- (not FeatureEngine's UserDailyFeatures, which is keyed by platform user_id + as_of)
+-- ==========================================
+CREATE TABLE IF NOT EXISTS public.daily_feature_snapshots (
+  user_id uuid NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+  day date NOT NULL DEFAULT CURRENT_DATE,
+  run_id uuid REFERENCES public.runs(id) ON DELETE SET NULL,
+  conversations_7d integer,
+  tests_7d integer,
+  minutes_7d integer,
+  recency_days integer,
+  frequency_7d integer,
+  test_accuracy real,
+  icp_completion_rate real,
+  itp_improvement_trend real,
+  top_topics text[],
+  extra jsonb NOT NULL DEFAULT '{}'::jsonb,  -- all other features
+  computed_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (user_id, day)
+);
+
 -- ==========================================
 -- decisions: rule engine outcomes
 -- ==========================================
@@ -146,6 +169,24 @@ CREATE TABLE IF NOT EXISTS public.email_suppression (
   UNIQUE (user_id, template_key)
 );
 
+-- ==========================================
+-- email_batches: OpenAI Batch API jobs for bulk email generation
+-- custom_ids are email_attempts.unique_key values, one per request line
+-- ==========================================
+CREATE TABLE IF NOT EXISTS public.email_batches (
+  id uuid PRIMARY KEY DEFAULT uuid_generate_v4(),
+  provider_batch_id text NOT NULL UNIQUE,  -- OpenAI batch id
+  status text NOT NULL,                    -- provider status: validating, in_progress, completed, failed, expired, ...
+  input_file_id text,
+  output_file_id text,
+  request_count integer NOT NULL DEFAULT 0,
+  custom_ids jsonb NOT NULL DEFAULT '[]'::jsonb,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  completed_at timestamptz
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_batches_status ON public.email_batches (status);
+
 -- ==========================================
 -- Helper views (optional): latest features per user
 -- ==========================================
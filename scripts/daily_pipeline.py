@@ -46,18 +46,38 @@ def _orm_enabled() -> bool:
         return False
 
 
+def _email_batch_service():
+    """EmailBatchService when an OpenAI client is configured, else None."""
+    try:
+        from services.email_batch_service import EmailBatchService
+        service = EmailBatchService()
+    except Exception as e:
+        logger.warning("Email Batch API path unavailable: %s", e)
+        return None
+    return service if service.client else None
+
+
 async def _run_pipeline_orm():
     """
     ORM-backed pipeline:
+      - Collect email copy from completed Batch API jobs of earlier runs
       - Compute daily features for all users (FeatureEngine.compute_daily_features)
       - Evaluate rule matches (DecisionEngine.evaluate_users_for_emails)
+      - Unless DRY_RUN, runs with at least settings.EMAIL_BATCH_MIN_SIZE candidates:
+        queue their email attempts and submit the copy as one Batch API job
       - DRY RUN: print decisions; do not send
     """
     # Late import types only used in ORM path
     from sqlalchemy.orm import Session  # noqa: F401
+    from database.models import AppUser
 
     db = SessionLocal()
+    batch_service = _email_batch_service()
     try:
+        if batch_service is not None:
+            collected = batch_service.collect_pending()
+            logger.info("Collected %s emails from completed Batch API jobs", len(collected))
+
         logger.info("Computing daily features (ORM mode)...")
         feat = FeatureEngine()
         users_processed = feat.compute_daily_features(db)
@@ -77,6 +97,16 @@ async def _run_pipeline_orm():
                 c.get("rule_id"),
             )
 
+        # Queued attempts block later sends of the same template and the job is billed
+        if not DRY_RUN and batch_service is not None and batch_service.should_use_batch(len(candidates)):
+            emails = dict(
+                db.query(AppUser.user_id, AppUser.email)
+                .filter(AppUser.user_id.in_([c["user_id"] for c in candidates]))
+                .all()
+            )
+            batch_id = batch_service.submit_candidates(candidates, emails)
+            logger.info("Submitted email copy for %s candidates as Batch API job %s", len(candidates), batch_id)
+
         if not DRY_RUN:
             logger.info("Email sending disabled by configuration. No emails will be sent.")
         logger.info("Daily pipeline (ORM mode) completed.")
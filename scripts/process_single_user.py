@@ -12,7 +12,7 @@ from services.data_processor import DataProcessor
 from services.feature_engine import FeatureEngine
 from services.decision_engine import DecisionEngine
 from services.email_template_service import EmailTemplateService
-from services.event_logger import EventLogger
+from services.event_logger import EventBatch, EventLogger
 from database.connection import engine
 from config.settings import settings
 
@@ -24,9 +24,16 @@ logger = logging.getLogger(__name__)
 
 def process_single_user(email: str, skip_email: bool = False, send_email: bool = False):
     """Process the complete AI pipeline for a single user"""
+    event_logger = EventLogger()
+    # Run events are buffered and inserted in bulk (flushed before finish_run and on exit)
+    with event_logger.batch() as run_events:
+        return _process_single_user(email, skip_email, send_email, event_logger, run_events)
+
+
+def _process_single_user(email: str, skip_email: bool, send_email: bool,
+                         event_logger: EventLogger, run_events: EventBatch):
     try:
         logger.info(f"🚀 Starting AI engine processing for user: {email}")
-        event_logger = EventLogger()
         db_enabled = engine is not None
         user_id = None
         run_id = None
@@ -37,7 +44,7 @@ def process_single_user(email: str, skip_email: bool = False, send_email: bool =
                     user_id,
                     context={"script": "process_single_user", "send_email": send_email, "skip_email": skip_email},
                 )
-                event_logger.event("ingestion_started", {"email": email}, user_id=user_id, run_id=run_id)
+                run_events.event("ingestion_started", {"email": email}, user_id=user_id, run_id=run_id)
             except Exception as e:
                 logger.warning(f"DB logging disabled due to error: {e}")
                 db_enabled = False
@@ -67,12 +74,13 @@ def process_single_user(email: str, skip_email: bool = False, send_email: bool =
             logger.error(f"❌ User {email} not found in database")
             try:
                 if db_enabled and user_id and run_id:
-                    event_logger.event(
+                    run_events.event(
                         "error",
                         {"message": "user_not_found", "email": email},
                         user_id=user_id,
                         run_id=run_id,
                     )
+                    run_events.flush()
                     event_logger.finish_run(run_id, success=False)
             except Exception:
                 pass
@@ -82,7 +90,7 @@ def process_single_user(email: str, skip_email: bool = False, send_email: bool =
         logger.info(f"✅ Found user data with {data_sources} data sources")
         try:
             if db_enabled and user_id and run_id:
-                event_logger.event(
+                run_events.event(
                     "ingestion_completed",
                     {"data_sources": data_sources},
                     user_id=user_id,
@@ -97,7 +105,7 @@ def process_single_user(email: str, skip_email: bool = False, send_email: bool =
         logger.info(f"✅ Generated {len(events)} normalized events")
         try:
             if db_enabled and user_id and run_id:
-                event_logger.event(
+                run_events.event(
                     "normalized_events_generated",
                     {"count": len(events)},
                     user_id=user_id,
@@ -112,8 +120,8 @@ def process_single_user(email: str, skip_email: bool = False, send_email: bool =
         logger.info(f"✅ Computed features: {list(features.keys())}")
         try:
             if db_enabled and user_id and run_id:
-                event_logger.save_features(user_id, run_id, features)
-                event_logger.event(
+                event_logger.save_features_many([(user_id, run_id, features)])
+                run_events.event(
                     "features_computed",
                     {"count": len(features)},
                     user_id=user_id,
@@ -135,8 +143,8 @@ def process_single_user(email: str, skip_email: bool = False, send_email: bool =
         logger.info(f"✅ Generated {len(decisions)} email decisions")
         try:
             if db_enabled and user_id and run_id:
-                event_logger.save_decisions(user_id, run_id, decisions)
-                event_logger.event(
+                event_logger.save_decisions_many([(user_id, run_id, decisions)])
+                run_events.event(
                     "decisions_made",
                     {"count": len(decisions)},
                     user_id=user_id,
@@ -152,7 +160,7 @@ def process_single_user(email: str, skip_email: bool = False, send_email: bool =
                         attempt_id, unique_key = event_logger.queue_email(
                             user_id, run_id, template_key=tpl, stage="initial", metadata={"rule_id": d.get("rule_id"), "features": d.get("features")}
                         )
-                        event_logger.event(
+                        run_events.event(
                             "email_queued",
                             {"template_key": tpl, "unique_key": unique_key},
                             user_id=user_id,
@@ -190,7 +198,7 @@ def process_single_user(email: str, skip_email: bool = False, send_email: bool =
                     if db_enabled and user_id and run_id:
                         unique_key = f"{user_id}:{decision['template_id']}:initial"
                         event_logger.mark_email_sent(unique_key=unique_key)
-                        event_logger.event(
+                        run_events.event(
                             "email_sent",
                             {"template_key": decision['template_id'], "result": result},
                             user_id=user_id,
@@ -200,21 +208,18 @@ def process_single_user(email: str, skip_email: bool = False, send_email: bool =
                     pass
         elif decisions and not email_service:
             logger.info("📧 Email campaigns generated (but not sent - email service unavailable):")
-            for decision in decisions:
+            # Generate every decision's copy in one concurrent batch rather than one LLM round-trip at a time
+            ai_triggers = features.get('ai_email_triggers', [])
+            generated = template_service.generate_email_content_many(
+                [(decision['template_id'], features, ai_triggers) for decision in decisions]
+            )
+            for decision, email_content in zip(decisions, generated):
                 logger.info(f"  - Rule ID: {decision['rule_id']}")
                 logger.info(f"  - Template ID: {decision['template_id']}")
                 logger.info(f"  - Priority: {decision['priority']}")
                 logger.info(f"  - User Email: {decision['user_email']}")
                 logger.info(f"  - Timestamp: {decision['timestamp']}")
                 
-                # Generate and display actual email content
-                ai_triggers = features.get('ai_email_triggers', [])
-                email_content = template_service.generate_email_content(
-                    decision['template_id'], 
-                    features, 
-                    ai_triggers
-                )
-                
                 if email_content:
                     logger.info(f"\n📧 Generated Email Content:")
                     logger.info(f"Subject: {email_content['subject']}")
@@ -227,7 +232,7 @@ def process_single_user(email: str, skip_email: bool = False, send_email: bool =
                                 email_content.get('subject') or decision['template_id'],
                                 email_content.get('content') or f"<p>{decision['template_id']}</p>"
                             )
-                            event_logger.event(
+                            run_events.event(
                                 "email_rendered",
                                 {"template_key": decision['template_id']},
                                 user_id=user_id,
@@ -243,6 +248,7 @@ def process_single_user(email: str, skip_email: bool = False, send_email: bool =
         logger.info(f"🎉 Successfully processed user: {email}")
         try:
             if db_enabled and run_id:
+                run_events.flush()
                 event_logger.finish_run(run_id, success=True)
         except Exception:
             pass
@@ -254,12 +260,13 @@ def process_single_user(email: str, skip_email: bool = False, send_email: bool =
         logger.error(f"Full traceback: {traceback.format_exc()}")
         try:
             if 'event_logger' in locals() and 'run_id' in locals() and run_id:
-                event_logger.event(
+                run_events.event(
                     "error",
                     {"message": str(e)},
                     user_id=(user_id if 'user_id' in locals() else None),
                     run_id=run_id,
                 )
+                run_events.flush()
                 event_logger.finish_run(run_id, success=False)
         except Exception:
             pass
@@ -0,0 +1,85 @@
+# services/_async_runtime.py
+"""
+Process-wide background asyncio loop for driving coroutines from sync code.
+
+The loop runs forever in a daemon thread that is started lazily on first use,
+so callers can submit coroutines with a timeout instead of creating and
+driving an event loop per call. It is a uvloop loop when uvloop is installed;
+the process-wide event loop policy is left alone.
+
+A forked child inherits `_loop` but not the thread running it, so the loop
+is dropped after fork and the child starts its own on first use.
+"""
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+try:
+    import uvloop  # type: ignore
+except Exception:
+    uvloop = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared background loop, starting its thread if needed."""
+    global _loop
+    loop = _loop
+    if loop is not None and not loop.is_closed():
+        return loop
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever,
+                name="async-runtime",
+                daemon=True,
+            ).start()
+            logger.debug("Started background asyncio loop (%s).", type(_loop).__name__)
+        return _loop
+
+
+def _reset_after_fork() -> None:
+    global _loop, _lock
+    _loop = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def submit(coro: Coroutine[Any, Any, Any]) -> Future:
+    """Schedule `coro` on the shared loop; returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro: Coroutine[Any, Any, Any], timeout: Optional[float] = None) -> Any:
+    """
+    Run `coro` on the shared loop and block for its result, from sync code or
+    from a coroutine running on any other loop. On timeout the coroutine is
+    cancelled and TimeoutError is raised.
+
+    Blocking from the shared loop's own thread would deadlock, so that case
+    raises RuntimeError; await the coroutine directly there instead.
+    """
+    loop = get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("_async_runtime.run() called on the shared loop; await the coroutine instead")
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
@@ -1,9 +1,10 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import func, select
 from database.models import UserDailyFeatures, EmailSend, AppUser
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import yaml
 import logging
-from datetime import datetime, timedelta, time
+from datetime import datetime, timedelta, time, timezone
 import pytz
 
 logger = logging.getLogger(__name__)
@@ -196,16 +197,35 @@ class DecisionEngine:
         """
         from datetime import date
         
-        # Get today's features for all users
-        features = db.query(UserDailyFeatures).filter(
-            UserDailyFeatures.as_of == date.today()
+        # Get today's features for all users, as plain rows (attribute access like the model):
+        # a Core select keeps thousands of UserDailyFeatures out of the session identity map
+        features = db.execute(
+            select(UserDailyFeatures.__table__).where(UserDailyFeatures.as_of == date.today())
         ).all()
         
+        # Consenting users (user_id, tz) for the whole batch: one query instead of an
+        # AppUser lookup per candidate
+        consenting = {
+            user.user_id: user
+            for user in db.query(AppUser.user_id, AppUser.tz).filter(AppUser.consent_email.is_(True))
+        }
+        
+        # Today's sent/queued emails per user, also for the whole batch
+        today_start = datetime.combine(date.today(), time.min)
+        today_end = datetime.combine(date.today(), time.max)
+        sent_today = dict(
+            db.query(EmailSend.user_id, func.count(EmailSend.send_id)).filter(
+                EmailSend.ts >= today_start,
+                EmailSend.ts <= today_end,
+                EmailSend.status.in_(['sent', 'queued'])
+            ).group_by(EmailSend.user_id).all()
+        )
+        
         email_candidates = []
         
         for user_features in features:
             # Check email eligibility
-            if not self._is_email_eligible(user_features, db):
+            if not self._is_email_eligible(user_features, db, consenting=consenting, sent_today=sent_today):
                 continue
             
             # Evaluate rules for this user
@@ -264,16 +284,28 @@ class DecisionEngine:
         logger.info(f"Selected rule '{best_rule['id']}' for user {email} (priority: {best_rule['action']['priority']})")
         return [decision]
     
-    def _is_email_eligible(self, user_features: UserDailyFeatures, db: Session) -> bool:
-        """Check if user is eligible for emails"""
+    def _is_email_eligible(self, user_features: UserDailyFeatures, db: Session,
+                           consenting: Optional[Dict[str, Any]] = None,
+                           sent_today: Optional[Dict[str, int]] = None) -> bool:
+        """
+        Check if user is eligible for emails
+        `consenting` maps user_id -> (user_id, tz) row for every user with email consent,
+        and `sent_today` user_id -> emails sent/queued on the as-of day, both prefetched
+        once per batch; without them the user is looked up individually.
+        """
         
         # Check unsubscribe status
         if user_features.unsubscribed:
             return False
         
         # Check email consent
-        user = db.query(AppUser).filter(AppUser.user_id == user_features.user_id).first()
-        if not user or not user.consent_email:
+        if consenting is not None:
+            user = consenting.get(user_features.user_id)
+        else:
+            user = db.query(AppUser).filter(AppUser.user_id == user_features.user_id).first()
+            if user and not user.consent_email:
+                user = None
+        if not user:
             return False
         
         # Check daily email limit
@@ -282,15 +314,18 @@ class DecisionEngine:
             return False
         
         # Check if already sent email today
-        today_start = datetime.combine(user_features.as_of, time.min)
-        today_end = datetime.combine(user_features.as_of, time.max)
-        
-        today_emails = db.query(EmailSend).filter(
-            EmailSend.user_id == user_features.user_id,
-            EmailSend.ts >= today_start,
-            EmailSend.ts <= today_end,
-            EmailSend.status.in_(['sent', 'queued'])
-        ).count()
+        if sent_today is not None:
+            today_emails = sent_today.get(user_features.user_id, 0)
+        else:
+            today_start = datetime.combine(user_features.as_of, time.min)
+            today_end = datetime.combine(user_features.as_of, time.max)
+            
+            today_emails = db.query(func.count(EmailSend.send_id)).filter(
+                EmailSend.user_id == user_features.user_id,
+                EmailSend.ts >= today_start,
+                EmailSend.ts <= today_end,
+                EmailSend.status.in_(['sent', 'queued'])
+            ).scalar() or 0
         
         if today_emails >= settings.MAX_EMAILS_PER_DAY:
             return False
@@ -516,42 +551,76 @@ class DecisionEngine:
     def _apply_daily_limits(self, candidates: List[Dict[str, Any]], db: Session) -> List[Dict[str, Any]]:
         """Apply daily sending limits and cooldowns"""
         filtered_candidates = []
+        last_sent = self._load_last_rule_sends([c['user_id'] for c in candidates], db)
         
         for candidate in candidates:
             user_id = candidate['user_id']
             rule_id = candidate['rule_id']
             
             # Check rule cooldown
-            if self._is_rule_in_cooldown(user_id, rule_id, db):
+            if self._is_rule_in_cooldown(user_id, rule_id, db, last_sent=last_sent):
                 continue
             
             filtered_candidates.append(candidate)
         
         return filtered_candidates
     
-    def _is_rule_in_cooldown(self, user_id: str, rule_id: str, db: Session) -> bool:
-        """Check if rule is in cooldown period for user."""
+    def _load_last_rule_sends(self, user_ids: List[str], db: Session) -> Optional[Dict[Tuple[str, str], datetime]]:
+        """
+        Latest send per (user_id, rule_id) for `user_ids` within the longest rule cooldown,
+        in one query; None if it cannot be read (callers then check per user).
+        The query runs in a savepoint, so a failure leaves `db`'s transaction usable.
+        """
+        if not user_ids:
+            return {}
+        longest = max((r['action'].get('cooldown_days', 1) for r in self.rules), default=1)
+        cutoff = datetime.now(timezone.utc) - timedelta(days=longest)
+        try:
+            rule_id_col = EmailSend.meta['rule_id'].astext
+            with db.begin_nested():
+                return {
+                    (user_id, rule_id): ts
+                    for user_id, rule_id, ts in db.query(
+                        EmailSend.user_id, rule_id_col, func.max(EmailSend.ts)
+                    ).filter(
+                        EmailSend.user_id.in_(user_ids),
+                        EmailSend.ts >= cutoff,
+                        rule_id_col.isnot(None)
+                    ).group_by(EmailSend.user_id, rule_id_col).all()
+                }
+        except Exception:
+            return None
+    
+    def _is_rule_in_cooldown(self, user_id: str, rule_id: str, db: Session,
+                             last_sent: Optional[Dict[Tuple[str, str], datetime]] = None) -> bool:
+        """
+        Check if rule is in cooldown period for user.
+        `last_sent` is the _load_last_rule_sends() result for the batch, if available.
+        """
         rule = next((r for r in self.rules if r['id'] == rule_id), None)
         if not rule:
             return True
         cooldown_days = rule['action'].get('cooldown_days', 1)
-        cutoff = datetime.utcnow() - timedelta(days=cooldown_days)
+        cutoff = datetime.now(timezone.utc) - timedelta(days=cooldown_days)
+        
+        if last_sent is not None:
+            sent_at = last_sent.get((user_id, rule_id))
+            return sent_at is not None and sent_at >= cutoff
 
         try:
-            recent = db.query(EmailSend).filter(
+            recent = db.query(EmailSend.send_id).filter(
                 EmailSend.user_id == user_id,
                 EmailSend.ts >= cutoff,
                 EmailSend.meta['rule_id'].astext == rule_id
             ).first()
             return recent is not None
         except Exception:
-            # Fallback: fetch a handful and check in Python
-            recent_list = db.query(EmailSend).filter(
+            # Fallback: fetch a handful of metas and check in Python
+            recent_metas = db.query(EmailSend.meta).filter(
                 EmailSend.user_id == user_id,
                 EmailSend.ts >= cutoff
             ).order_by(EmailSend.ts.desc()).limit(25).all()
-            for e in recent_list:
-                meta = getattr(e, 'meta', {}) or {}
+            for (meta,) in recent_metas:
                 if isinstance(meta, dict) and meta.get('rule_id') == rule_id:
                     return True
             return False
@@ -0,0 +1,185 @@
+# services/email_batch_service.py
+"""
+Bulk email generation through the OpenAI Batch API.
+
+Large scheduled runs (see settings.EMAIL_BATCH_MIN_SIZE) trade the online
+per-call path for a 24h batch job at roughly half the token cost and with its
+own rate-limit quota. Each request line's custom_id is the email attempt's
+unique_key (user_id:template_key:stage), so results reconcile directly with
+public.email_attempts once the batch completes. The attempt's metadata carries
+the candidate's features, which is what lets collected copy go through the same
+EmailTemplateService review as online copy.
+"""
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.settings import settings
+from database import postgres as pg
+from services.email_template_service import EmailTemplateService
+from services.event_logger import EventLogger
+from services.llm_service import email_completion_request, parse_email_completion
+
+logger = logging.getLogger(__name__)
+
+_ENDPOINT = "/v1/chat/completions"
+_COMPLETION_WINDOW = "24h"
+
+
+class EmailBatchService:
+    """
+    submit_batch(items) -> batch_id, then collect_batch(batch_id) (or
+    collect_pending() from a poller) once OpenAI reports it completed.
+    """
+
+    def __init__(self,
+                 template_service: Optional[EmailTemplateService] = None,
+                 event_logger: Optional[EventLogger] = None):
+        self.template_service = template_service or EmailTemplateService()
+        self.client = self.template_service.llm_service.client
+        self.event_logger = event_logger or EventLogger()
+
+    @staticmethod
+    def should_use_batch(n_emails: int) -> bool:
+        """Small/interactive runs stay on the online path."""
+        return n_emails >= settings.EMAIL_BATCH_MIN_SIZE
+
+    def submit_candidates(self, candidates: List[Dict[str, Any]], emails: Dict[str, str]) -> Optional[str]:
+        """
+        Queue an initial email attempt per DecisionEngine candidate and submit the
+        newly queued ones as one batch. `emails` maps candidate user_id -> address.
+        Returns the batch id, or None when every attempt was already queued.
+        Users, templates and attempts are written in bulk, in one transaction.
+        """
+        queued = []
+        for c in candidates:
+            features = dict(c.get("features") or {})
+            features["email"] = features.get("email") or emails.get(c["user_id"])
+            if features["email"]:
+                queued.append((c, features))
+        unique_keys = self.event_logger.queue_emails_many([
+            (features["email"], c["template_id"], "initial", {"rule_id": c.get("rule_id"), "features": features})
+            for c, features in queued
+        ])
+        items = [
+            (unique_key, c["template_id"], features, features.get("ai_email_triggers", []))
+            for (c, features), unique_key in zip(queued, unique_keys)
+            if unique_key is not None  # None: queued (and generated) by an earlier run
+        ]
+        return self.submit_batch(items) if items else None
+
+    def submit_batch(self, items: List[Tuple[str, str, Dict[str, Any], Optional[List[Dict[str, Any]]]]]) -> str:
+        """
+        Submit (unique_key, template_id, features, ai_triggers) items as one batch job.
+        Each unique_key must belong to a queued email attempt whose metadata holds the
+        same `features`. Returns the provider batch id (also persisted to public.email_batches).
+        """
+        if not self.client:
+            raise RuntimeError("OpenAI client is not configured; cannot submit an email batch.")
+
+        lines: List[str] = []
+        custom_ids: List[str] = []
+        for unique_key, template_id, features, ai_triggers in items:
+            try:
+                prompt = self.template_service.build_llm_prompt(template_id, features, ai_triggers)
+            except Exception as e:
+                logger.error(f"Failed to build batch prompt for {unique_key}: {e}")
+                self.event_logger.mark_email_failed(f"batch prompt error: {e}", unique_key=unique_key)
+                continue
+            lines.append(json.dumps({
+                "custom_id": unique_key,
+                "method": "POST",
+                "url": _ENDPOINT,
+                "body": email_completion_request(prompt),
+            }))
+            custom_ids.append(unique_key)
+
+        if not lines:
+            raise ValueError("No batch requests could be built.")
+
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+        input_file = self.client.files.create(file=("email_batch.jsonl", payload), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=_ENDPOINT,
+            completion_window=_COMPLETION_WINDOW,
+        )
+        pg.create_email_batch(batch.id, batch.status, input_file.id, custom_ids)
+        logger.info(f"Submitted email batch {batch.id} with {len(custom_ids)} requests")
+        return batch.id
+
+    def collect_batch(self, batch_id: str) -> Optional[Dict[str, Dict[str, str]]]:
+        """
+        Returns {unique_key: email} once the batch has completed, or None while it
+        is still running. Every line is finalized by EmailTemplateService exactly like
+        online copy (sanitized, CTA footer, alignment check); lines that errored or
+        could not be parsed get the deterministic fallback copy. The final copy is
+        also saved on each email attempt's metadata under "copy". A completed batch is
+        only recorded as completed after its copy is saved, so a failure on the way
+        leaves it for the next collect_pending().
+        """
+        if not self.client:
+            raise RuntimeError("OpenAI client is not configured; cannot collect an email batch.")
+
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status != "completed":
+            pg.update_email_batch(batch_id, batch.status, getattr(batch, "output_file_id", None))
+            logger.info(f"Email batch {batch_id} is {batch.status}")
+            return None
+
+        # unique_key -> parsed {"subject", "content"} or the exception explaining why not
+        outcomes: Dict[str, Any] = {}
+        if batch.output_file_id:
+            for line in self.client.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                unique_key = record.get("custom_id")
+                if not unique_key:
+                    continue
+                try:
+                    if record.get("error"):
+                        raise ValueError(record["error"])
+                    body = (record.get("response") or {}).get("body") or {}
+                    outcomes[unique_key] = parse_email_completion(body["choices"][0]["message"]["content"])
+                except Exception as e:
+                    outcomes[unique_key] = ValueError(f"batch result error: {e}")
+
+        # Requests the API rejected outright land in the error file instead
+        error_file_id = getattr(batch, "error_file_id", None)
+        if error_file_id:
+            for line in self.client.files.content(error_file_id).text.splitlines():
+                record = json.loads(line) if line.strip() else {}
+                if record.get("custom_id"):
+                    outcomes[record["custom_id"]] = ValueError(
+                        f"batch request error: {record.get('error') or record.get('response')}"
+                    )
+
+        results: Dict[str, Dict[str, str]] = {}
+        for attempt in pg.fetch_email_attempts(list(outcomes)):
+            unique_key = attempt["unique_key"]
+            outcome = outcomes[unique_key]
+            features = (attempt.get("metadata") or {}).get("features") or {}
+            error = outcome if isinstance(outcome, Exception) else None
+            results[unique_key] = self.template_service.finalize_llm_email(
+                attempt["template_key"],
+                features,
+                features.get("ai_email_triggers", []),
+                None if error else outcome,
+                error=error,
+            )
+        pg.save_email_attempt_copy(results)
+        pg.update_email_batch(batch_id, batch.status, batch.output_file_id)
+
+        logger.info(f"Collected {len(results)} emails from batch {batch_id}")
+        return results
+
+    def collect_pending(self) -> Dict[str, Dict[str, str]]:
+        """Poll every unfinished batch; returns the merged results of those that completed."""
+        collected: Dict[str, Dict[str, str]] = {}
+        for row in pg.fetch_pending_email_batches():
+            try:
+                collected.update(self.collect_batch(row["provider_batch_id"]) or {})
+            except Exception as e:
+                logger.error(f"Failed to collect email batch {row['provider_batch_id']}: {e}")
+        return collected
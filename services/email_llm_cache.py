@@ -0,0 +1,95 @@
+# services/email_llm_cache.py
+"""
+Exact-match cache for LLM-generated email copy (and, with its own Redis
+prefix, other JSON completions such as conversation analyses).
+
+Keys are SHA-256 digests of everything that shapes the completion (model,
+sampling params and the fully rendered prompt), so a hit is only served when
+the LLM would have been asked the very same question. Entries live in a
+bounded in-process LRU with a TTL and, when REDIS_ENABLED is set, are also
+shared through Redis so other workers can reuse them.
+"""
+try:
+    import redis  # type: ignore
+except Exception:
+    redis = None  # type: ignore
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_REDIS_PREFIX = "email_llm:"
+
+
+def make_key(**parts: Any) -> str:
+    """Stable digest of the keyword parts (order-insensitive, JSON-canonicalized)."""
+    blob = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class EmailLLMCache:
+    """
+    get(key) / put(key, value) for {"subject": ..., "content": ...} dicts (any
+    JSON-serializable dict works; give other uses their own `redis_prefix`).
+    Safe to share across threads; Redis failures degrade to memory-only.
+    """
+
+    def __init__(self, ttl_seconds: Optional[int] = None, max_entries: Optional[int] = None,
+                 redis_prefix: str = _REDIS_PREFIX):
+        self.ttl_seconds = ttl_seconds or settings.EMAIL_LLM_CACHE_TTL_SECONDS
+        self.max_entries = max_entries or settings.EMAIL_LLM_CACHE_MAX_ENTRIES
+        self.redis_prefix = redis_prefix
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._redis = None
+        if settings.REDIS_ENABLED and redis is not None:
+            try:
+                self._redis = redis.Redis.from_url(settings.REDIS_URL)
+            except Exception as e:
+                logger.warning(f"Email LLM cache: Redis unavailable, using memory only: {e}")
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        now = time.monotonic()
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                expires_at, value = hit
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    return dict(value)
+                del self._entries[key]
+
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(self.redis_prefix + key)
+            except Exception as e:
+                logger.debug("Email LLM cache: Redis get failed: %s", e)
+                raw = None
+            if raw:
+                value = json.loads(raw)
+                self._remember(key, value, now)
+                return dict(value)
+        return None
+
+    def put(self, key: str, value: Dict[str, str]) -> None:
+        self._remember(key, dict(value), time.monotonic())
+        if self._redis is not None:
+            try:
+                self._redis.setex(self.redis_prefix + key, self.ttl_seconds, json.dumps(value))
+            except Exception as e:
+                logger.debug("Email LLM cache: Redis set failed: %s", e)
+
+    def _remember(self, key: str, value: Dict[str, str], now: float) -> None:
+        with self._lock:
+            self._entries[key] = (now + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -3,13 +3,474 @@ from typing import Dict, Any, Optional, List, Tuple
 import logging
 from datetime import datetime
 import asyncio
+import functools
 import re
-from services.llm_service import LLMService
+from services import _async_runtime
+from services.llm_service import get_llm_service
 from config.settings import settings
 from urllib.parse import urlencode
 
 logger = logging.getLogger(__name__)
 
+# Trigger / event classification (values are stored pre-lowercased)
+_EXAM_PREP_TRIGGER_TYPES = frozenset({'exam_prep', 'pre_exam'})
+_EXAM_FOLLOWUP_TRIGGER_TYPES = frozenset({'exam_followup', 'post_exam'})
+_EXAM_FOLLOWUP_STAGES = frozenset({'how_did_it_go', 'post_exam'})
+_APPT_FOLLOWUP_STAGES = frozenset({'session_feedback', 'post_appointment'})
+_EXAM_EVENT_TYPES = frozenset({'exam', 'test', 'quiz', 'assessment'})
+_RESUME_RULES = frozenset({'resume_icp', 'resume_itp'})
+
+# Deterministic fallback copy, one (subject, body) template pair per purpose.
+# Slots are filled with str.format_map in _compose_subject_content.
+_TPL_EXAM_LAST_MINUTE_PREP_SUBJECT = "{day_title}’s {subject_area} exam: 45-minute crash plan ✅"
+_TPL_EXAM_LAST_MINUTE_PREP_BODY = """{greet}
+
+Your {subject_area} exam is {day_hint}. Here’s a focused, high-yield plan:
+
+⏱️ **45-minute sprint**
+• 15 min — Quick review: key formulas/definitions you’ve missed recently  
+• 15 min — 10 mixed practice Qs (no notes)  
+• 10 min — Check answers + fix 2 weakest patterns  
+• 5  min — One-page cheat sheet (from memory → then fill the gaps)
+
+🧠 **Hit these targets**
+• 2 concepts you tripped on this week  
+• 1 typical trap (timing or careless error)  
+• 1 confidence topic to warm up
+
+⚙️ **Setup**
+• Timer on, notifications off  
+• Close-book first pass, open-book second pass  
+• If a question takes >90s, mark & move — keep momentum
+
+Start a 10‑question mini-quiz now: {quiz_url} Good luck — you’ve got this!"""
+
+_TPL_EXAM_FOLLOWUP_SUBJECT = "How did the {subject_area} exam go? 📚"
+_TPL_EXAM_FOLLOWUP_BODY = """{greet}
+
+How did your {subject_area} exam go? A 3-minute reflection now will boost retention:
+
+📝 **Reflect**
+• One concept that felt solid  
+• One that surprised you  
+• One you want to master next week
+
+Want a quick debrief quiz from your tricky areas? Start Debrief: {debrief_url}"""
+
+_TPL_APPOINTMENT_REMINDER_SUBJECT = "Reminder: your appointment {when} 🕒"
+_TPL_APPOINTMENT_REMINDER_BODY = """{greet}
+
+Quick reminder: your appointment is {when}. A 10-minute prep helps it go smoothly:
+
+✅ **Prep checklist**
+• Confirm time/location & any materials  
+• Write 2–3 questions you want answered  
+• Plan travel time + a buffer
+
+You’ve got this!"""
+
+_TPL_APPOINTMENT_FOLLOWUP_SUBJECT = "How did your session go? 📝"
+_TPL_APPOINTMENT_FOLLOWUP_BODY = """{greet}
+
+Hope your session went well. Capture value while it’s fresh:
+
+🔁 **Post-session notes**
+• Most helpful insight (1–2 lines)  
+• Any action items + deadlines  
+• What needs clarification?
+
+Capture your notes here: {dashboard_url}"""
+
+_TPL_RESUME_ICP_SUBJECT = "Pick up your course: {title} — quick 15‑min restart"
+_TPL_RESUME_ICP_BODY = """{greet}
+
+It looks like your course “{title}” paused {when}. Let’s make a small restart:
+
+🔁 **Quick restart**
+• 10 min — skim last completed section  
+• 5  min — do 3 practice Qs  
+• Then continue to the next section
+
+Resume course: {resume_url}"""
+
+_TPL_RESUME_ITP_SUBJECT = "Resume your test: {title} — {cur}/{total} done"
+_TPL_RESUME_ITP_BODY = """{greet}
+
+You left this test {when}. Try a 5‑question warmup, then continue:
+
+🎯 **Plan**
+• 5 quick Qs to warm up  
+• Mark anything over 90s  
+• Finish the remaining set
+
+Resume test: {resume_url}"""
+
+_TPL_COMPLETION_CELEBRATION_SUBJECT = "🎉 You finished {course_name}! Ready for what’s next?"
+_TPL_COMPLETION_CELEBRATION_BODY = """{greet}
+
+Congratulations on completing <b>{course_name}</b>! That’s a big milestone.
+
+🎓 **Lock it in**
+• 5 review Qs now, 5 tomorrow (spaced)  
+• Summarize the 3 biggest takeaways  
+• Teach one idea to a friend — best retention hack
+
+Want me to queue your next lesson in {next_subject}?"""
+
+_TPL_ENGAGEMENT_REWARD_SUBJECT = "Amazing progress in {subject_area}! 🌟"
+_TPL_ENGAGEMENT_REWARD_BODY = """{greet}
+
+Your consistency in {subject_area} is outstanding. Let’s channel it:
+
+🌟 **Next step**
+• One stretch goal for this week  
+• One 20-minute focused block (book it now)  
+• One timed mini-set to measure improvement
+
+Keep going — momentum is your superpower!"""
+
+_TPL_LEARNING_SUPPORT_SUBJECT = "Boost your {subject_area} understanding 🚀"
+_TPL_LEARNING_SUPPORT_BODY = """{greet}
+
+I saw you’ve been digging into {subject_area}. Want a targeted explainer + practice set?
+Pick a topic here: {dashboard_url}"""
+
+_TPL_WINBACK_SUBJECT = "Ready to continue your {subject_area} journey? 🎯"
+_TPL_WINBACK_BODY = """{greet}
+
+Let’s ease back in: 10 minutes, one concept, one quick win. Open the app to continue: {dashboard_url}"""
+
+_TPL_PERFORMANCE_PRAISE_SUBJECT = "Excellent {subject_area} performance! 📈"
+_TPL_PERFORMANCE_PRAISE_BODY = """{greet}
+
+You’re crushing {subject_area}. Want an advanced challenge set to push further?"""
+
+_TPL_LEARNING_ENCOURAGEMENT_SUBJECT = "Your {subject_area} learning continues! 💪"
+_TPL_LEARNING_ENCOURAGEMENT_BODY = """{greet}
+
+Small, consistent steps compound. Start a 10-minute set now: {quiz_url}"""
+
+_PURPOSE_TEMPLATES: Dict[str, Tuple[str, str]] = {
+    'exam_last_minute_prep': (_TPL_EXAM_LAST_MINUTE_PREP_SUBJECT, _TPL_EXAM_LAST_MINUTE_PREP_BODY),
+    'exam_followup': (_TPL_EXAM_FOLLOWUP_SUBJECT, _TPL_EXAM_FOLLOWUP_BODY),
+    'appointment_reminder': (_TPL_APPOINTMENT_REMINDER_SUBJECT, _TPL_APPOINTMENT_REMINDER_BODY),
+    'appointment_followup': (_TPL_APPOINTMENT_FOLLOWUP_SUBJECT, _TPL_APPOINTMENT_FOLLOWUP_BODY),
+    'resume_icp': (_TPL_RESUME_ICP_SUBJECT, _TPL_RESUME_ICP_BODY),
+    'resume_itp': (_TPL_RESUME_ITP_SUBJECT, _TPL_RESUME_ITP_BODY),
+    'completion_celebration': (_TPL_COMPLETION_CELEBRATION_SUBJECT, _TPL_COMPLETION_CELEBRATION_BODY),
+    'engagement_reward': (_TPL_ENGAGEMENT_REWARD_SUBJECT, _TPL_ENGAGEMENT_REWARD_BODY),
+    'learning_support': (_TPL_LEARNING_SUPPORT_SUBJECT, _TPL_LEARNING_SUPPORT_BODY),
+    'winback': (_TPL_WINBACK_SUBJECT, _TPL_WINBACK_BODY),
+    'performance_praise': (_TPL_PERFORMANCE_PRAISE_SUBJECT, _TPL_PERFORMANCE_PRAISE_BODY),
+    'learning_encouragement': (_TPL_LEARNING_ENCOURAGEMENT_SUBJECT, _TPL_LEARNING_ENCOURAGEMENT_BODY),
+}
+
+
+# Free-text timeframe parsing used to rank exam urgency
+_RE_IN_MINUTES = re.compile(r'in\s+(\d+)\s*(?:minutes|min|m)\b')
+_RE_IN_HOURS = re.compile(r'in\s+(\d+)\s*(?:hours|hour|h)\b')
+_TONIGHT_KWS = ('tonight', 'this evening', 'evening')
+_TODAY_KWS = ('today', 'this afternoon', 'this morning', 'later today')
+_HINT_URGENCY_BONUS = {'tonight': 50, 'today': 40, 'tomorrow': 20}
+
+
+def _normalize_time_hint_from_lower(txt: str) -> Tuple[str, int, int]:
+    """
+    Map free-text timeframes to (hint, days, hours). Expects `txt` already lowercased.
+    'minutes' is treated as ultra-urgent: today with negative hours to boost score.
+    """
+    # minutes: "in 5 minutes", "in 30 min", "in 15m"
+    if _RE_IN_MINUTES.search(txt):
+        return ('today', 0, -10)  # negative hours => higher urgency in scoring
+
+    # hours: "in 2 hours", "in 5h"
+    m = _RE_IN_HOURS.search(txt)
+    if m:
+        hours = int(m.group(1))
+        return ('today', 0, max(0, hours))
+
+    if any(k in txt for k in _TONIGHT_KWS):
+        return ('tonight', 0, 6)
+    if any(k in txt for k in _TODAY_KWS):
+        return ('today', 0, 12)
+    if 'tomorrow' in txt or 'tmrw' in txt:
+        return ('tomorrow', 1, 24)
+    if 'next week' in txt:
+        return ('soon', 7, 0)
+    return ('soon', 3, 0)
+
+
+def _normalize_time_hint_from_trigger(t: Dict[str, Any]) -> Tuple[str, int, int]:
+    tf = str(t.get('timeframe', '') or '').lower()
+    days_before = t.get('days_before')
+    if days_before is not None:
+        try:
+            d = int(days_before)
+        except Exception:
+            d = 3
+        if d <= 0:
+            # If 0 and we can infer evening, call it 'tonight'
+            return ('tonight', 0, 6) if 'night' in tf or 'evening' in tf else ('today', 0, 6)
+        if d == 1:
+            return ('tomorrow', 1, 24)
+        return ('soon', d, d * 24)
+    # Fall back to parsing the timeframe string
+    return _normalize_time_hint_from_lower(tf)
+
+
+def _urgency_score(days: int, hours: int, hint: str, subject: Optional[str],
+                   first_topic_subject: Optional[str]) -> int:
+    # Lower days/hours = higher urgency
+    score = 10_000 - (days * 300 + hours * 5) + _HINT_URGENCY_BONUS.get(hint, 0)
+    # Tiny tie-breaker if this subject is also first in topics
+    if subject and first_topic_subject and subject.lower() == first_topic_subject.lower():
+        score += 3
+    return score
+
+
+# Alignment guard vocabulary (lowercase; plain substring semantics)
+_PURPOSE_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    'exam_last_minute_prep': ('exam', 'test', 'quiz', 'assessment', 'prep', 'plan', 'crash', 'review'),
+    'exam_followup': ('exam', 'test', 'quiz', 'assessment', 'how did', 'went', 'score', 'debrief'),
+    'appointment_reminder': ('appointment', 'reminder', 'tomorrow', 'today', 'tonight'),
+    'appointment_followup': ('appointment', 'session', 'follow-up', 'follow up', 'went'),
+    'completion_celebration': ('congrats', 'congratulations', 'completed', 'finish', 'finished'),
+}
+_DAY_SYNONYMS: Dict[str, Tuple[str, ...]] = {
+    'tonight': ('tonight', 'this evening', 'evening', 'later this evening'),
+    'today': ('today', 'this afternoon', 'this morning', 'later today', 'in a few hours'),
+    'tomorrow': ('tomorrow', 'tmrw'),
+    'soon': ('soon', 'coming up', 'upcoming'),
+}
+
+
+@functools.lru_cache(maxsize=512)
+def _alignment_pattern(purpose: str, subject: str, day_hint: str) -> "Optional[re.Pattern[str]]":
+    """
+    One regex that requires the subject, a day-hint synonym and a purpose
+    keyword to each appear somewhere in the text. Empty slots are omitted;
+    returns None when there is nothing to check. Use with .match() so the
+    lookaheads are evaluated once from the start of the string.
+    """
+    alternations: List[str] = []
+    if subject:
+        alternations.append(re.escape(subject))
+    if day_hint:
+        alternations.append("|".join(map(re.escape, _DAY_SYNONYMS.get(day_hint, (day_hint,)))))
+    keywords = _PURPOSE_KEYWORDS.get(purpose)
+    if keywords:
+        alternations.append("|".join(map(re.escape, keywords)))
+    if not alternations:
+        return None
+    return re.compile("".join(f"(?=.*?(?:{alt}))" for alt in alternations), re.S)
+
+
+# (conversations_7d >, frequency_7d >, level), checked in order; anything below is 'low'
+_ENGAGEMENT_LEVELS = (
+    (50, 100, 'very_high'),
+    (20, 50, 'high'),
+    (5, 10, 'moderate'),
+)
+
+
+@functools.lru_cache(maxsize=1024)
+def _engagement_level_for(conversations: int, frequency: int) -> str:
+    for min_conversations, min_frequency, level in _ENGAGEMENT_LEVELS:
+        if conversations > min_conversations and frequency > min_frequency:
+            return level
+    return 'low'
+
+
+# _determine_email_purpose rules, first match wins.
+# Per trigger: predicate(trigger_type, message_type) -> purpose.
+_TRIGGER_PURPOSE_RULES = (
+    # Exams
+    (lambda t_type, stage: stage == 'last_minute_prep' or t_type in _EXAM_PREP_TRIGGER_TYPES,
+     'exam_last_minute_prep'),
+    (lambda t_type, stage: stage in _EXAM_FOLLOWUP_STAGES or t_type in _EXAM_FOLLOWUP_TRIGGER_TYPES,
+     'exam_followup'),
+    # Appointments
+    (lambda t_type, stage: t_type == 'appointment_reminder' or stage == 'reminder',
+     'appointment_reminder'),
+    (lambda t_type, stage: t_type == 'appointment_followup' or stage in _APPT_FOLLOWUP_STAGES,
+     'appointment_followup'),
+    # Learning support
+    (lambda t_type, stage: t_type == 'learning_support' or stage == 'learning_support_offer',
+     'learning_support'),
+)
+# When no trigger matched: predicate(features) -> purpose.
+_STATE_PURPOSE_RULES = (
+    (lambda f: f.get('recency_days', 0) > 7, 'winback'),
+    (lambda f: _engagement_level_for(f.get('conversations_7d', 0), f.get('frequency_7d', 0)) == 'very_high',
+     'engagement_reward'),
+    (lambda f: f.get('completed_courses', 0) > 0, 'completion_celebration'),
+    (lambda f: f.get('test_accuracy', 0) > 0.8, 'performance_praise'),
+)
+
+
+# Substring indicators, one alternation each so a single search replaces the any() scans
+_ADVANCED_LEVEL_INDICATORS = ('USMLE', 'Medicine', 'Pharmacology', 'Immunology', 'Pathology', 'IELTS')
+_INTERMEDIATE_LEVEL_INDICATORS = ('Biology', 'Chemistry', 'Physics', 'History', 'Algebra')
+_RE_ADVANCED_LEVEL = re.compile('|'.join(map(re.escape, _ADVANCED_LEVEL_INDICATORS)))
+_RE_INTERMEDIATE_LEVEL = re.compile('|'.join(map(re.escape, _INTERMEDIATE_LEVEL_INDICATORS)))
+
+
+@functools.lru_cache(maxsize=1024)
+def _learning_level_for_topics(topics: Tuple[str, ...]) -> str:
+    # Per-topic search: no joined copy, stops at the first hit. Indicators contain no
+    # spaces, so this matches exactly what a search over ' '.join(topics) would.
+    if any(_RE_ADVANCED_LEVEL.search(t) for t in topics):
+        return 'graduate_medical'
+    if any(_RE_INTERMEDIATE_LEVEL.search(t) for t in topics):
+        return 'high_school_college'
+    return 'middle_school'
+
+
+def _collect_triggers(
+    ai_triggers: Optional[List[Dict[str, Any]]],
+    features: Dict[str, Any]
+) -> Tuple[Dict[str, Any], ...]:
+    """Explicit triggers win over feature triggers; non-dict entries are dropped once here."""
+    return tuple(t for t in (ai_triggers or features.get('ai_email_triggers') or []) if isinstance(t, dict))
+
+
+@functools.lru_cache(maxsize=512)
+def _ordered_subjects(topics: Tuple[str, ...]) -> Tuple[str, ...]:
+    # partition() returns the whole topic when it has no '>'
+    return tuple(dict.fromkeys(
+        subj for subj in (t.partition('>')[0] for t in topics) if subj
+    ))
+
+
+# ---- LLM output post-processing -------------------------------------------
+
+# Subject-specific metrics availability (you can wire this up later;
+# for now we assume you DON'T have per-subject metrics, so set False)
+_SUBJECT_METRICS_AVAILABLE = False
+
+_RE_PERCENT_NUMBER = re.compile(r"\b\d{1,3}\s?%\b", flags=re.IGNORECASE)
+_RE_SENTENCE_SPLIT = re.compile(r'(?<=[\.\!\?])\s+')
+
+# Keywords that usually bind numbers to performance/progress claims
+_PERF_KEYWORDS = (
+    "progress", "completion", "complete", "accuracy", "score",
+    "performance", "percent", "percentage", "rate"
+)
+_REPLY_CTA_KEYWORDS = ('reply', 'respond', 'email back', 'write back', 'hit reply')
+
+
+def _has_percent_number(text: str) -> bool:
+    return bool(_RE_PERCENT_NUMBER.search(text or ""))
+
+
+def _sentence_split(text: str) -> List[str]:
+    # Simple sentence split (avoid heavy libs)
+    # Keeps punctuation; good enough for post-editing
+    return _RE_SENTENCE_SPLIT.split(text.strip()) if text else []
+
+
+def _join_sentences(sents: List[str]) -> str:
+    return " ".join(s.strip() for s in sents if s and s.strip())
+
+
+def _sanitize_subject_specific_metrics(subject: str, body: str, subject_scope_has_metrics: bool) -> str:
+    """
+    Remove any sentences that present percentages/accuracy/progress as if
+    they belong to the specific subject when we don't have subject metrics.
+    """
+    if subject_scope_has_metrics or not body:
+        return body
+
+    sents = _sentence_split(body)
+    cleaned: List[str] = []
+    subj_l = (subject or "").lower()
+
+    for s in sents:
+        s_l = s.lower()
+
+        # If the sentence contains a % AND mentions performance-ish words,
+        # AND also mentions the chosen subject, drop it.
+        mentions_percent = _has_percent_number(s)
+        mentions_perf_kw = any(k in s_l for k in _PERF_KEYWORDS)
+        mentions_subject = subj_l and subj_l in s_l
+
+        if mentions_percent and mentions_perf_kw and mentions_subject:
+            # Drop the sentence to avoid misattribution.
+            continue
+
+        cleaned.append(s)
+
+    # If we dropped everything (rare), keep the original body to avoid empty emails
+    return _join_sentences(cleaned) or body
+
+
+# --- No-reply email helpers ---------------------------------------------------
+def _strip_reply_ctas(text: str) -> str:
+    """
+    Remove sentences that tell the user to reply/respond to the email.
+    We send from a no-reply address, so remove those instructions.
+    """
+    if not text:
+        return text
+    sents = _sentence_split(text)
+    cleaned: List[str] = []
+    for s in sents:
+        sl = (s or '').lower()
+        if any(b in sl for b in _REPLY_CTA_KEYWORDS):
+            continue
+        cleaned.append(s)
+    return _join_sentences(cleaned)
+
+
+def _build_url(path: str, params: Optional[Dict[str, Any]] = None) -> str:
+    base = (settings.APP_BASE_URL or '').rstrip('/')
+    url = f"{base}/{(path or '').lstrip('/')}"
+    if params:
+        try:
+            qs = urlencode(params, doseq=True)
+            if qs:
+                url = f"{url}?{qs}"
+        except Exception:
+            pass
+    return url
+
+
+def _append_cta_footer(ctx: Dict[str, Any], body: str) -> str:
+    purpose = ctx.get('email_purpose')
+    subject_area = ctx.get('subject_area') or 'your studies'
+    det = ctx.get('resume_details') or {}
+    title = det.get('title') or subject_area
+
+    cta_label = None
+    cta_url = None
+
+    if purpose == 'exam_followup':
+        cta_label = "Start Debrief"
+        cta_url = _build_url(settings.CTA_DEBRIEF_PATH, {"subject": subject_area})
+    elif purpose == 'exam_last_minute_prep':
+        cta_label = "Start 10-question Mini-Quiz"
+        cta_url = _build_url(settings.CTA_MINI_QUIZ_PATH, {"subject": subject_area})
+    elif purpose == 'resume_icp':
+        cta_label = "Resume Course"
+        cta_url = _build_url(settings.CTA_RESUME_COURSE_PATH, {"title": title})
+    elif purpose == 'resume_itp':
+        cta_label = "Resume Test"
+        cta_url = _build_url(settings.CTA_RESUME_TEST_PATH, {"title": title})
+    elif purpose == 'appointment_followup':
+        cta_label = "Capture Notes"
+        cta_url = _build_url(settings.CTA_OPEN_DASHBOARD_PATH)
+    elif purpose == 'learning_support':
+        cta_label = "Pick a Topic"
+        cta_url = _build_url(settings.CTA_OPEN_DASHBOARD_PATH)
+    else:
+        cta_label = "Open App"
+        cta_url = _build_url(settings.CTA_OPEN_DASHBOARD_PATH)
+
+    if cta_label and cta_url:
+        return f"{body}\n\n➡️ {cta_label}: {cta_url}"
+    return body
+
+
 class EmailTemplateService:
     """
     Service for generating dynamic educational email content using OpenAI.
@@ -46,7 +507,9 @@ class EmailTemplateService:
     }
 
     def __init__(self):
-        self.llm_service = LLMService()
+        self.llm_service = get_llm_service()
+        self.max_concurrency = settings.LLM_MAX_CONCURRENCY
+        self.llm_timeout_s = settings.LLM_TIMEOUT_SECONDS
 
     # ---- Public API ---------------------------------------------------------
 
@@ -66,222 +529,275 @@ class EmailTemplateService:
         per-subject metrics.
         """
         try:
-            # --- Helpers (scoped to this call) ---------------------------------
-            import re
-
-            def _has_percent_number(text: str) -> bool:
-                return bool(re.search(r"\b\d{1,3}\s?%\b", text or "", flags=re.IGNORECASE))
-
-            def _sentence_split(text: str) -> List[str]:
-                # Simple sentence split (avoid heavy libs)
-                # Keeps punctuation; good enough for post-editing
-                return re.split(r'(?<=[\.\!\?])\s+', text.strip()) if text else []
-
-            def _join_sentences(sents: List[str]) -> str:
-                return " ".join(s.strip() for s in sents if s and s.strip())
-
-            def _sanitize_subject_specific_metrics(subject: str, body: str, subject_scope_has_metrics: bool) -> str:
-                """
-                Remove any sentences that present percentages/accuracy/progress as if
-                they belong to the specific subject when we don't have subject metrics.
-                """
-                if subject_scope_has_metrics or not body:
-                    return body
-
-                sents = _sentence_split(body)
-                cleaned: List[str] = []
-                subj_l = (subject or "").lower()
-
-                # Keywords that usually bind numbers to performance/progress claims
-                perf_keywords = [
-                    "progress", "completion", "complete", "accuracy", "score",
-                    "performance", "percent", "percentage", "rate"
-                ]
-
-                for s in sents:
-                    s_l = s.lower()
-
-                    # If the sentence contains a % AND mentions performance-ish words,
-                    # AND also mentions the chosen subject, drop it.
-                    mentions_percent = _has_percent_number(s)
-                    mentions_perf_kw = any(k in s_l for k in perf_keywords)
-                    mentions_subject = subj_l and subj_l in s_l
-
-                    if mentions_percent and mentions_perf_kw and mentions_subject:
-                        # Drop the sentence to avoid misattribution.
-                        continue
-
-                    cleaned.append(s)
-
-                # If we dropped everything (rare), keep the original body to avoid empty emails
-                return _join_sentences(cleaned) or body
-
-            # Subject-specific metrics availability (you can wire this up later;
-            # for now we assume you DON'T have per-subject metrics, so set False)
-            SUBJECT_METRICS_AVAILABLE = False
-
-            # --- No-reply email helpers ---------------------------------------
-            def _strip_reply_ctas(text: str) -> str:
-                """
-                Remove sentences that tell the user to reply/respond to the email.
-                We send from a no-reply address, so remove those instructions.
-                """
-                if not text:
-                    return text
-                sents = _sentence_split(text)
-                blocked = ['reply', 'respond', 'email back', 'write back', 'hit reply']
-                cleaned: List[str] = []
-                for s in sents:
-                    sl = (s or '').lower()
-                    if any(b in sl for b in blocked):
-                        continue
-                    cleaned.append(s)
-                return _join_sentences(cleaned)
-
-            def _build_url(path: str, params: Optional[Dict[str, Any]] = None) -> str:
-                base = (settings.APP_BASE_URL or '').rstrip('/')
-                url = f"{base}/{(path or '').lstrip('/')}"
-                if params:
-                    try:
-                        qs = urlencode(params, doseq=True)
-                        if qs:
-                            url = f"{url}?{qs}"
-                    except Exception:
-                        pass
-                return url
-
-            def _append_cta_footer(ctx: Dict[str, Any], body: str) -> str:
-                purpose = ctx.get('email_purpose')
-                subject_area = ctx.get('subject_area') or 'your studies'
-                det = ctx.get('resume_details') or {}
-                title = det.get('title') or subject_area
-
-                cta_label = None
-                cta_url = None
-
-                if purpose == 'exam_followup':
-                    cta_label = "Start Debrief"
-                    cta_url = _build_url(settings.CTA_DEBRIEF_PATH, {"subject": subject_area})
-                elif purpose == 'exam_last_minute_prep':
-                    cta_label = "Start 10-question Mini-Quiz"
-                    cta_url = _build_url(settings.CTA_MINI_QUIZ_PATH, {"subject": subject_area})
-                elif purpose == 'resume_icp':
-                    cta_label = "Resume Course"
-                    cta_url = _build_url(settings.CTA_RESUME_COURSE_PATH, {"title": title})
-                elif purpose == 'resume_itp':
-                    cta_label = "Resume Test"
-                    cta_url = _build_url(settings.CTA_RESUME_TEST_PATH, {"title": title})
-                elif purpose == 'appointment_followup':
-                    cta_label = "Capture Notes"
-                    cta_url = _build_url(settings.CTA_OPEN_DASHBOARD_PATH)
-                elif purpose == 'learning_support':
-                    cta_label = "Pick a Topic"
-                    cta_url = _build_url(settings.CTA_OPEN_DASHBOARD_PATH)
-                else:
-                    cta_label = "Open App"
-                    cta_url = _build_url(settings.CTA_OPEN_DASHBOARD_PATH)
-
-                if cta_label and cta_url:
-                    return f"{body}\n\n➡️ {cta_label}: {cta_url}"
-                return body
-
-            # --- Resolve mapping & context --------------------------------------
-            rule_id = self._template_to_rule(template_id)
-            user_email = features.get('email', 'student@example.com')
-
-            purpose = self._determine_email_purpose(template_id, features, ai_triggers)
-            email_context = self._build_email_context(features, ai_triggers, purpose)
-
-            # Build purpose-specific subject/body (deterministic fallback)
-            fallback_subject, fallback_body = self._compose_subject_content(email_context)
-
-            # --- Call LLM --------------------------------------------------------
-            try:
-                # Reuse or create an event loop safely
-                try:
-                    loop = asyncio.get_event_loop()
-                except RuntimeError:
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-
-                # Preferred subject/day passed for steering
-                preferred_subject = email_context.get('subject_area')
-                day_hint = email_context.get('day_hint')
-
-                # Also pass a nudge that metrics are OVERALL unless you wire per-subject later
-                # Many LLM wrappers simply ignore extra kwargs; this is harmless if unsupported.
-                email_result = loop.run_until_complete(
-                    self.llm_service.generate_educational_email(
-                        rule_id,
-                        features,
-                        user_email,
-                        preferred_subject=preferred_subject,
-                        day_hint=day_hint,
-                        metrics_scope="overall",  # <-- IMPORTANT NUDGE
-                        instructions_extra=(
-                            "If you mention progress or accuracy, make clear they are overall metrics. "
-                            "Do NOT attach percentages to a specific subject or exam unless explicitly given per-subject."
-                        )
-                    )
-                )
+            prepared = self._prepare_email(template_id, features, ai_triggers)
+        except Exception as e:
+            logger.exception("Failed to generate email content for %s: %s", template_id, str(e))
+            return self._hard_fallback(template_id)
 
-                llm_subject = (email_result or {}).get('subject') or ''
-                llm_body = (email_result or {}).get('content') or ''
+        # Run on the shared background loop so a hung provider cannot stall
+        # this worker past llm_timeout_s.
+        try:
+            email_result = _async_runtime.run(self._request_llm_email(prepared), timeout=self.llm_timeout_s)
+        except TimeoutError:
+            return self._finalize_email(
+                prepared, None, error=TimeoutError(f"LLM call exceeded {self.llm_timeout_s}s")
+            )
+        except Exception as e:
+            return self._finalize_email(prepared, None, error=e)
+        return self._finalize_email(prepared, email_result)
 
-                # --- Sanitize cross-subject metric claims -----------------------
-                llm_body_sanitized = _sanitize_subject_specific_metrics(
-                    subject=preferred_subject or '',
-                    body=llm_body,
-                    subject_scope_has_metrics=SUBJECT_METRICS_AVAILABLE
-                )
-                # If subject line contains a percent & the subject name, strip it too
-                if (preferred_subject and not SUBJECT_METRICS_AVAILABLE
-                    and _has_percent_number(llm_subject)
-                    and (preferred_subject.lower() in llm_subject.lower())):
-                    # Remove the % number fragments in subject (simple scrub)
-                    llm_subject = re.sub(r"\b\d{1,3}\s?%\b", "", llm_subject).replace("  ", " ").strip(" -,:;")
-
-                # --- Remove reply CTAs and append proper link-based CTA --------
-                llm_body_final = _append_cta_footer(
-                    email_context,
-                    _strip_reply_ctas(llm_body_sanitized)
-                )
+    async def agenerate_email_content_many(
+        self,
+        items: List[Tuple[str, Dict[str, Any], Optional[List[Dict[str, Any]]]]],
+        max_concurrency: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Generate emails for many users concurrently.
+
+        `items` are (template_id, features, ai_triggers) tuples, i.e. the
+        arguments of generate_email_content. At most `max_concurrency` LLM
+        calls are in flight at once (default settings.LLM_MAX_CONCURRENCY).
+        A failed item falls back to its deterministic copy without affecting
+        the rest. Results are returned in input order and share a single
+        `generated_at` timestamp sampled when the batch starts.
+        """
+        sem = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+        generated_at = datetime.now().isoformat()
+        results = await asyncio.gather(
+            *(self._agenerate_one(item, sem, generated_at) for item in items),
+            return_exceptions=True
+        )
+        return [
+            self._hard_fallback(item[0], generated_at) if isinstance(res, BaseException) else res
+            for item, res in zip(items, results)
+        ]
 
-                # --- Final alignment check --------------------------------------
-                if not self._is_alignment_ok(purpose, llm_subject, llm_body_final, email_context):
-                    logger.debug(
-                        "LLM output misaligned with purpose '%s' — using fallback. "
-                        "(rule_id=%s, template_id=%s, subject='%s')",
-                        purpose, rule_id, template_id, llm_subject
-                    )
-                    subject = fallback_subject
-                    content = _append_cta_footer(email_context, _strip_reply_ctas(fallback_body))
-                else:
-                    subject, content = llm_subject, llm_body_final
+    def generate_email_content_for_user(
+        self,
+        template_id: str,
+        user_id: Any,
+        user_email: Optional[str] = None,
+        ai_triggers: Optional[List[Dict[str, Any]]] = None
+    ) -> Optional[Dict[str, str]]:
+        """
+        generate_email_content from the user's latest saved features, read from the
+        typed daily_feature_snapshots columns (plus `extra`). `user_id` is the
+        public.users id. Returns None when nothing has been saved for the user yet.
+        """
+        from services.event_logger import EventLogger  # Postgres is optional for the online path
+        features = EventLogger().latest_features(user_id)
+        if features is None:
+            return None
+        if user_email:
+            features.setdefault('email', user_email)
+        return self.generate_email_content(template_id, features, ai_triggers)
+
+    def generate_email_content_many(
+        self,
+        items: List[Tuple[str, Dict[str, Any], Optional[List[Dict[str, Any]]]]],
+        max_concurrency: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        """Synchronous entry point for agenerate_email_content_many."""
+        return _async_runtime.run(self.agenerate_email_content_many(items, max_concurrency))
 
-            except Exception as e:
-                logger.warning("OpenAI generation failed, using fallback: %s", str(e))
-                subject = fallback_subject
-                content = _append_cta_footer(email_context, _strip_reply_ctas(fallback_body))
-
-            return {
-                'subject': (subject or "").strip(),
-                'content': (content or "").strip(),
-                'template_id': template_id,
-                'generated_at': datetime.now().isoformat(),
-                'rule_id': rule_id,  # helpful for observability
-            }
+    def build_llm_prompt(
+        self,
+        template_id: str,
+        features: Dict[str, Any],
+        ai_triggers: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """Render the exact LLM prompt generate_email_content would send (used for Batch API jobs)."""
+        prepared = self._prepare_email(template_id, features, ai_triggers)
+        return self.llm_service.build_email_prompt(
+            prepared['rule_id'],
+            prepared['features'],
+            prepared['user_email'],
+            **self._llm_email_hints(prepared)
+        )
+
+    def finalize_llm_email(
+        self,
+        template_id: str,
+        features: Dict[str, Any],
+        ai_triggers: Optional[List[Dict[str, Any]]],
+        email_result: Optional[Dict[str, str]],
+        error: Optional[BaseException] = None
+    ) -> Dict[str, str]:
+        """
+        Review copy generated outside generate_email_content (Batch API results)
+        the same way as online copy: sanitize, alignment-check, fall back if needed.
+        """
+        try:
+            prepared = self._prepare_email(template_id, features, ai_triggers)
+        except Exception as e:
+            logger.exception("Failed to generate email content for %s: %s", template_id, str(e))
+            return self._hard_fallback(template_id)
+        return self._finalize_email(prepared, email_result, error=error)
+
+    # ---- Generation pipeline ----------------------------------------------
 
+    def _prepare_email(
+        self,
+        template_id: str,
+        features: Dict[str, Any],
+        ai_triggers: Optional[List[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """Resolve rule, purpose, context and the deterministic fallback copy."""
+        triggers = _collect_triggers(ai_triggers, features)
+        purpose = self._determine_email_purpose(template_id, features, triggers)
+        email_context = self._build_email_context(features, triggers, purpose)
+
+        # Build purpose-specific subject/body (deterministic fallback)
+        fallback_subject, fallback_body = self._compose_subject_content(email_context)
+        return {
+            'template_id': template_id,
+            'rule_id': self._template_to_rule(template_id),
+            'features': features,
+            'user_email': features.get('email', 'student@example.com'),
+            'purpose': purpose,
+            'context': email_context,
+            'fallback_subject': fallback_subject,
+            'fallback_body': fallback_body,
+        }
+
+    @staticmethod
+    def _llm_email_hints(prepared: Dict[str, Any]) -> Dict[str, Any]:
+        """Steering kwargs for LLMService email generation (online and batch)."""
+        ctx = prepared['context']
+        # Preferred subject/day passed for steering.
+        # Also pass a nudge that metrics are OVERALL unless you wire per-subject later
+        # Many LLM wrappers simply ignore extra kwargs; this is harmless if unsupported.
+        return {
+            'preferred_subject': ctx.get('subject_area'),
+            'day_hint': ctx.get('day_hint'),
+            'metrics_scope': "overall",  # <-- IMPORTANT NUDGE
+            'instructions_extra': (
+                "If you mention progress or accuracy, make clear they are overall metrics. "
+                "Do NOT attach percentages to a specific subject or exam unless explicitly given per-subject."
+            ),
+            # Same (purpose, level) cohort -> same provider prompt-cache slot
+            'prompt_cache_key': f"edu-email:{ctx['email_purpose']}:{ctx.get('learning_level')}",
+        }
+
+    async def _request_llm_email(self, prepared: Dict[str, Any]) -> Dict[str, str]:
+        """Call the LLM (LLMService retries transient provider errors itself)."""
+        return await self.llm_service.generate_educational_email(
+            prepared['rule_id'],
+            prepared['features'],
+            prepared['user_email'],
+            **self._llm_email_hints(prepared)
+        )
+
+    async def _agenerate_one(
+        self,
+        item: Tuple[str, Dict[str, Any], Optional[List[Dict[str, Any]]]],
+        sem: asyncio.Semaphore,
+        generated_at: str
+    ) -> Dict[str, str]:
+        template_id, features, ai_triggers = item
+        try:
+            prepared = self._prepare_email(template_id, features, ai_triggers)
         except Exception as e:
             logger.exception("Failed to generate email content for %s: %s", template_id, str(e))
-            # Hard fallback if something unexpected happens early
-            return {
-                'subject': "Keep going — you’ve got this! 🎓",
-                'content': "Quick nudge: take a short review today and try 5 practice questions. Small steps compound fast.",
-                'template_id': template_id,
-                'generated_at': datetime.now().isoformat(),
-                'rule_id': self._template_to_rule(template_id),
-            }
+            return self._hard_fallback(template_id, generated_at)
+
+        async with sem:
+            try:
+                email_result = await asyncio.wait_for(self._request_llm_email(prepared), self.llm_timeout_s)
+            except asyncio.TimeoutError:
+                return self._finalize_email(
+                    prepared, None, error=TimeoutError(f"LLM call exceeded {self.llm_timeout_s}s"),
+                    generated_at=generated_at
+                )
+            except Exception as e:
+                return self._finalize_email(prepared, None, error=e, generated_at=generated_at)
+        return self._finalize_email(prepared, email_result, generated_at=generated_at)
+
+    def _finalize_email(
+        self,
+        prepared: Dict[str, Any],
+        email_result: Optional[Dict[str, str]],
+        error: Optional[BaseException] = None,
+        generated_at: Optional[str] = None
+    ) -> Dict[str, str]:
+        """
+        Sanitize and alignment-check the LLM copy, falling back when needed.
+        Batch callers pass a shared `generated_at`; solo calls read the clock.
+        """
+        email_context = prepared['context']
+        subject = content = None
+
+        if error is None:
+            try:
+                subject, content = self._align_llm_output(prepared, email_result)
+            except Exception as e:
+                error = e
+        if error is not None:
+            logger.warning("OpenAI generation failed, using fallback: %s", str(error))
+
+        if subject is None:
+            subject = prepared['fallback_subject']
+            content = _append_cta_footer(email_context, _strip_reply_ctas(prepared['fallback_body']))
+
+        return {
+            'subject': (subject or "").strip(),
+            'content': (content or "").strip(),
+            'template_id': prepared['template_id'],
+            'generated_at': generated_at or datetime.now().isoformat(),
+            'rule_id': prepared['rule_id'],  # helpful for observability
+        }
+
+    def _align_llm_output(
+        self,
+        prepared: Dict[str, Any],
+        email_result: Optional[Dict[str, str]]
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """Return the cleaned LLM (subject, body), or (None, None) if misaligned."""
+        purpose = prepared['purpose']
+        email_context = prepared['context']
+        preferred_subject = email_context.get('subject_area')
+
+        llm_subject = (email_result or {}).get('subject') or ''
+        llm_body = (email_result or {}).get('content') or ''
+
+        # --- Sanitize cross-subject metric claims -----------------------
+        llm_body_sanitized = _sanitize_subject_specific_metrics(
+            subject=preferred_subject or '',
+            body=llm_body,
+            subject_scope_has_metrics=_SUBJECT_METRICS_AVAILABLE
+        )
+        # If subject line contains a percent & the subject name, strip it too
+        if (preferred_subject and not _SUBJECT_METRICS_AVAILABLE
+            and _has_percent_number(llm_subject)
+            and (preferred_subject.lower() in llm_subject.lower())):
+            # Remove the % number fragments in subject (simple scrub)
+            llm_subject = _RE_PERCENT_NUMBER.sub("", llm_subject).replace("  ", " ").strip(" -,:;")
+
+        # --- Remove reply CTAs and append proper link-based CTA --------
+        llm_body_final = _append_cta_footer(
+            email_context,
+            _strip_reply_ctas(llm_body_sanitized)
+        )
+
+        # --- Final alignment check --------------------------------------
+        if not self._is_alignment_ok(purpose, llm_subject, llm_body_final, email_context):
+            logger.debug(
+                "LLM output misaligned with purpose '%s' — using fallback. "
+                "(rule_id=%s, template_id=%s, subject='%s')",
+                purpose, prepared['rule_id'], prepared['template_id'], llm_subject
+            )
+            return None, None
+        return llm_subject, llm_body_final
+
+    def _hard_fallback(self, template_id: str, generated_at: Optional[str] = None) -> Dict[str, str]:
+        # Hard fallback if something unexpected happens early
+        return {
+            'subject': "Keep going — you’ve got this! 🎓",
+            'content': "Quick nudge: take a short review today and try 5 practice questions. Small steps compound fast.",
+            'template_id': template_id,
+            'generated_at': generated_at or datetime.now().isoformat(),
+            'rule_id': self._template_to_rule(template_id),
+        }
 
     def get_available_templates(self) -> list:
         """Return empty list since we no longer use predefined templates."""
@@ -293,125 +809,89 @@ class EmailTemplateService:
 
     # ---- Context / Purpose helpers -----------------------------------------
 
-    def _template_to_rule(self, template_id: str) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _template_to_rule(template_id: str) -> str:
         """
         Normalize a template_id (e.g. 'exam_last_minute_prep_v1') to its rule_id
         (e.g. 'exam_last_minute_prep'). Falls back to stripping a trailing _vN.
+        Template ids come from a small fixed vocabulary, so results are memoized.
         """
         if not template_id:
             return "learning_support_trigger"
-        if template_id in self.TPL_TO_RULE:
-            return self.TPL_TO_RULE[template_id]
+        rule_id = EmailTemplateService.TPL_TO_RULE.get(template_id)
+        if rule_id:
+            return rule_id
         stripped = re.sub(r"_v\d+$", "", template_id)
         return stripped or "learning_support_trigger"
 
     def _build_email_context(
         self,
         features: Dict[str, Any],
-        ai_triggers: Optional[List[Dict[str, Any]]],
+        triggers: Tuple[Dict[str, Any], ...],
         purpose: str
     ) -> Dict[str, Any]:
-        """Collect everything we might want for composition."""
-        triggers = ai_triggers or features.get('ai_email_triggers', []) or []
+        """
+        Collect only what composition, the alignment guard and the CTA footer
+        read. The LLM prompt is built from `features` directly, so the richer
+        profile/insight/personalization sections are not assembled here.
+        """
         topics = features.get('top_topics', [])
         primary_subjects = self._extract_subjects_from_topics_ordered(topics)
+        conversation_insights = features.get('conversation_insights', {}) or {}
+        upcoming = conversation_insights.get('upcoming_events', []) if isinstance(conversation_insights, dict) else []
+        upcoming_events = [e for e in (upcoming or []) if isinstance(e, dict)]
 
         # Prefer the most-urgent exam trigger to pick subject + day hint
         subject_area, day_hint, chosen_trigger = self._choose_primary_subject_area(
             purpose=purpose,
             triggers=triggers,
             topics=topics,
-            conversation_insights=features.get('conversation_insights', {}) or {}
+            upcoming_events=upcoming_events,
+            primary_subjects=primary_subjects
         )
 
         # If nothing urgent selected, fall back to topics or generic
         if not subject_area:
             subject_area = primary_subjects[0] if primary_subjects else self._guess_subject_from_topics(topics)
 
-        context = {
+        return {
             'email_purpose': purpose,
-            'user_profile': {
-                'learning_level': self._determine_learning_level(features),
-                'primary_subjects': primary_subjects,
-                'engagement_level': self._assess_engagement_level(features),
-                'recent_activity': {
-                    'conversations': features.get('conversations_7d', 0),
-                    'tests_taken': features.get('tests_7d', 0),
-                    'minutes_studied': features.get('minutes_7d', 0),
-                    'courses_active': features.get('active_courses', 0),
-                }
-            },
-            'learning_insights': {
-                'top_topics': topics,
-                'strong_subjects': features.get('strong_subjects', []),
-                'weak_subjects': features.get('weak_subjects', []),
-                'test_accuracy': features.get('test_accuracy', 0.0),
-                'course_completion': features.get('icp_completion_rate', 0.0),
-                'completed_course_titles': features.get('completed_course_titles', []),
-                'conversation_insights': features.get('conversation_insights', {}),
-            },
-            'ai_triggers': triggers,
-            'personalization': {
-                'recency_days': features.get('recency_days', 0),
-                'frequency': features.get('frequency_7d', 0),
-                'improvement_trend': features.get('itp_improvement_trend', 0),
-            },
             'subject_area': subject_area,
             'day_hint': day_hint,              # <- "tonight" | "today" | "tomorrow" | "soon"
             'chosen_trigger': chosen_trigger,  # <- the trigger we prioritized (if any)
+            'learning_level': self._determine_learning_level(features),
+            'primary_subjects': primary_subjects,
+            'upcoming_events': upcoming_events,
+            'completed_course_titles': features.get('completed_course_titles', []),
             'resume_target': features.get('resume_target'),
             'resume_details': features.get('resume_details', {}),
         }
-        return context
 
     def _determine_email_purpose(
         self,
         template_id: str,
         features: Dict[str, Any],
-        ai_triggers: Optional[List[Dict[str, Any]]]
+        triggers: Tuple[Dict[str, Any], ...]
     ) -> str:
-        """Determine the main purpose of the email from triggers/state."""
+        """Determine the main purpose of the email from (pre-filtered) triggers/state."""
         # Explicitly honor resume templates if selected by rules
         rid = self._template_to_rule(template_id)
-        if rid in ("resume_icp", "resume_itp"):
+        if rid in _RESUME_RULES:
             return rid
 
-        recency = features.get('recency_days', 0)
-        engagement = self._assess_engagement_level(features)
-
-        triggers = ai_triggers or features.get('ai_email_triggers', []) or []
         for t in triggers:
-            if not isinstance(t, dict):
-                continue
             t_type = t.get('trigger') or t.get('trigger_type')
             stage = t.get('message_type')
-
-            # Exams
-            if stage == 'last_minute_prep' or t_type in ('exam_prep', 'pre_exam'):
-                return 'exam_last_minute_prep'
-            if stage in ('how_did_it_go', 'post_exam') or t_type in ('exam_followup', 'post_exam'):
-                return 'exam_followup'
-
-            # Appointments
-            if t_type == 'appointment_reminder' or stage == 'reminder':
-                return 'appointment_reminder'
-            if t_type == 'appointment_followup' or stage in ('session_feedback', 'post_appointment'):
-                return 'appointment_followup'
-
-            # Learning support
-            if t_type == 'learning_support' or stage == 'learning_support_offer':
-                return 'learning_support'
-
-        # Fallbacks by state
-        if recency > 7:
-            return 'winback'
-        if engagement == 'very_high':
-            return 'engagement_reward'
-        if features.get('completed_courses', 0) > 0:
-            return 'completion_celebration'
-        if features.get('test_accuracy', 0) > 0.8:
-            return 'performance_praise'
-        return 'learning_encouragement'
+            for matches, purpose in _TRIGGER_PURPOSE_RULES:
+                if matches(t_type, stage):
+                    return purpose
+
+        # Fallbacks by state (engagement is only assessed when no trigger matched)
+        return next(
+            (purpose for matches, purpose in _STATE_PURPOSE_RULES if matches(features)),
+            'learning_encouragement'
+        )
 
     # ---- Subject/Body composition ------------------------------------------
 
@@ -419,14 +899,18 @@ class EmailTemplateService:
         """Deterministic subject/body for each purpose."""
         purpose = ctx['email_purpose']
         subject_area = ctx.get('subject_area') or 'your studies'
-        level = ctx['user_profile']['learning_level']
-        greet = "Hi there!" if level == 'middle_school' else "Hello!"
+        greet = "Hi there!" if ctx.get('learning_level') == 'middle_school' else "Hello!"
 
         # Helpful context
-        conv = ctx['learning_insights'].get('conversation_insights', {}) or {}
-        upcoming = conv.get('upcoming_events', []) if isinstance(conv, dict) else []
-        has_exam_tomorrow = any(e.get('type') == 'exam' and 'tomorrow' in str(e.get('timeframe', '')).lower() for e in upcoming)
-        has_appt_tomorrow = any(e.get('type') == 'appointment' and 'tomorrow' in str(e.get('timeframe', '')).lower() for e in upcoming)
+        has_exam_tomorrow = has_appt_tomorrow = False
+        for e in ctx.get('upcoming_events') or ():
+            if 'tomorrow' not in str(e.get('timeframe') or '').lower():
+                continue
+            e_type = e.get('type')
+            has_exam_tomorrow = has_exam_tomorrow or e_type == 'exam'
+            has_appt_tomorrow = has_appt_tomorrow or e_type == 'appointment'
+            if has_exam_tomorrow and has_appt_tomorrow:
+                break
 
         # Day hint coming from chosen trigger (preferred)
         day_hint = ctx.get('day_hint')
@@ -434,215 +918,60 @@ class EmailTemplateService:
             # Fallback to insights if we didn't get it from the trigger
             day_hint = "tomorrow" if has_exam_tomorrow else "soon"
 
+        slots: Dict[str, Any] = {'greet': greet, 'subject_area': subject_area}
         if purpose == 'exam_last_minute_prep':
-            subject = f"{(day_hint or 'soon').title()}’s {subject_area} exam: 45-minute crash plan ✅"
-            body = f"""{greet}
-
-Your {subject_area} exam is {(day_hint or 'soon')}. Here’s a focused, high-yield plan:
-
-⏱️ **45-minute sprint**
-• 15 min — Quick review: key formulas/definitions you’ve missed recently  
-• 15 min — 10 mixed practice Qs (no notes)  
-• 10 min — Check answers + fix 2 weakest patterns  
-• 5  min — One-page cheat sheet (from memory → then fill the gaps)
-
-🧠 **Hit these targets**
-• 2 concepts you tripped on this week  
-• 1 typical trap (timing or careless error)  
-• 1 confidence topic to warm up
-
-⚙️ **Setup**
-• Timer on, notifications off  
-• Close-book first pass, open-book second pass  
-• If a question takes >90s, mark & move — keep momentum
-
-Start a 10‑question mini-quiz now: {settings.APP_BASE_URL.rstrip('/')}{settings.CTA_MINI_QUIZ_PATH}?{urlencode({'subject': subject_area})} Good luck — you’ve got this!"""
-            return subject, body
-
-        if purpose == 'exam_followup':
-            subject = f"How did the {subject_area} exam go? 📚"
-            body = f"""{greet}
-
-How did your {subject_area} exam go? A 3-minute reflection now will boost retention:
-
-📝 **Reflect**
-• One concept that felt solid  
-• One that surprised you  
-• One you want to master next week
-
-Want a quick debrief quiz from your tricky areas? Start Debrief: {settings.APP_BASE_URL.rstrip('/')}{settings.CTA_DEBRIEF_PATH}?{urlencode({'subject': subject_area})}"""
-            return subject, body
-
-        if purpose == 'appointment_reminder':
-            when = "tomorrow" if has_appt_tomorrow else "soon"
-            subject = f"Reminder: your appointment {when} 🕒"
-            body = f"""{greet}
-
-Quick reminder: your appointment is {when}. A 10-minute prep helps it go smoothly:
-
-✅ **Prep checklist**
-• Confirm time/location & any materials  
-• Write 2–3 questions you want answered  
-• Plan travel time + a buffer
-
-You’ve got this!"""
-            return subject, body
-
-        if purpose == 'appointment_followup':
-            subject = "How did your session go? 📝"
-            body = f"""{greet}
-
-Hope your session went well. Capture value while it’s fresh:
-
-🔁 **Post-session notes**
-• Most helpful insight (1–2 lines)  
-• Any action items + deadlines  
-• What needs clarification?
-
-Capture your notes here: {settings.APP_BASE_URL.rstrip('/')}{settings.CTA_OPEN_DASHBOARD_PATH}"""
-            return subject, body
-
-        if purpose == 'resume_icp':
-            det = ctx.get('resume_details') or {}
-            title = det.get('title') or subject_area
-            days = det.get('days_since_last_activity', None)
-            when = f"{days} days ago" if isinstance(days, int) else "a while ago"
-            subject = f"Pick up your course: {title} — quick 15‑min restart"
-            body = f"""{greet}
-
-It looks like your course “{title}” paused {when}. Let’s make a small restart:
-
-🔁 **Quick restart**
-• 10 min — skim last completed section  
-• 5  min — do 3 practice Qs  
-• Then continue to the next section
-
-Resume course: {settings.APP_BASE_URL.rstrip('/')}{settings.CTA_RESUME_COURSE_PATH}?{urlencode({'title': title})}"""
-            return subject, body
-
-        if purpose == 'resume_itp':
+            when = day_hint or 'soon'
+            slots['day_hint'] = when
+            slots['day_title'] = when.title()
+            slots['quiz_url'] = _build_url(settings.CTA_MINI_QUIZ_PATH, {'subject': subject_area})
+        elif purpose == 'exam_followup':
+            slots['debrief_url'] = _build_url(settings.CTA_DEBRIEF_PATH, {'subject': subject_area})
+        elif purpose == 'appointment_reminder':
+            slots['when'] = "tomorrow" if has_appt_tomorrow else "soon"
+        elif purpose in ('appointment_followup', 'learning_support', 'winback'):
+            slots['dashboard_url'] = _build_url(settings.CTA_OPEN_DASHBOARD_PATH)
+        elif purpose in _RESUME_RULES:
             det = ctx.get('resume_details') or {}
             title = det.get('title') or subject_area
-            cur = det.get('current_position', 0)
-            total = det.get('total_questions', 0)
             days = det.get('days_since_last_activity', None)
-            when = f"{days} days ago" if isinstance(days, int) else "a while ago"
-            subject = f"Resume your test: {title} — {cur}/{total} done"
-            body = f"""{greet}
-
-You left this test {when}. Try a 5‑question warmup, then continue:
-
-🎯 **Plan**
-• 5 quick Qs to warm up  
-• Mark anything over 90s  
-• Finish the remaining set
-
-Resume test: {settings.APP_BASE_URL.rstrip('/')}{settings.CTA_RESUME_TEST_PATH}?{urlencode({'title': title})}"""
-            return subject, body
-
-        if purpose == 'completion_celebration':
-            completed_titles = ctx['learning_insights'].get('completed_course_titles', []) or []
-            course_name = completed_titles[0] if completed_titles else subject_area
-            subject = f"🎉 You finished {course_name}! Ready for what’s next?"
-            body = f"""{greet}
-
-Congratulations on completing <b>{course_name}</b>! That’s a big milestone.
-
-🎓 **Lock it in**
-• 5 review Qs now, 5 tomorrow (spaced)  
-• Summarize the 3 biggest takeaways  
-• Teach one idea to a friend — best retention hack
-
-Want me to queue your next lesson in {ctx.get('subject_area') or 'your subject'}?"""
-            return subject, body
-
-        if purpose == 'engagement_reward':
-            subject = f"Amazing progress in {subject_area}! 🌟"
-            body = f"""{greet}
-
-Your consistency in {subject_area} is outstanding. Let’s channel it:
-
-🌟 **Next step**
-• One stretch goal for this week  
-• One 20-minute focused block (book it now)  
-• One timed mini-set to measure improvement
-
-Keep going — momentum is your superpower!"""
-            return subject, body
-
-        if purpose == 'learning_support':
-            subject = f"Boost your {subject_area} understanding 🚀"
-            body = f"""{greet}
-
-I saw you’ve been digging into {subject_area}. Want a targeted explainer + practice set?
-Pick a topic here: {settings.APP_BASE_URL.rstrip('/')}{settings.CTA_OPEN_DASHBOARD_PATH}"""
-            return subject, body
-
-        if purpose == 'winback':
-            subject = f"Ready to continue your {subject_area} journey? 🎯"
-            body = f"""{greet}
-
-Let’s ease back in: 10 minutes, one concept, one quick win. Open the app to continue: {settings.APP_BASE_URL.rstrip('/')}{settings.CTA_OPEN_DASHBOARD_PATH}"""
-            return subject, body
-
-        if purpose == 'performance_praise':
-            subject = f"Excellent {subject_area} performance! 📈"
-            body = f"""{greet}
-
-You’re crushing {subject_area}. Want an advanced challenge set to push further?"""
-            return subject, body
-
-        # Generic encouragement
-        subject = f"Your {subject_area} learning continues! 💪"
-        body = f"""{greet}
-
-Small, consistent steps compound. Start a 10-minute set now: {settings.APP_BASE_URL.rstrip('/')}{settings.CTA_MINI_QUIZ_PATH}?{urlencode({'subject': subject_area})}"""
-        return subject, body
+            slots['title'] = title
+            slots['when'] = f"{days} days ago" if isinstance(days, int) else "a while ago"
+            if purpose == 'resume_icp':
+                slots['resume_url'] = _build_url(settings.CTA_RESUME_COURSE_PATH, {'title': title})
+            else:
+                slots['cur'] = det.get('current_position', 0)
+                slots['total'] = det.get('total_questions', 0)
+                slots['resume_url'] = _build_url(settings.CTA_RESUME_TEST_PATH, {'title': title})
+        elif purpose == 'completion_celebration':
+            completed_titles = ctx.get('completed_course_titles') or []
+            slots['course_name'] = completed_titles[0] if completed_titles else subject_area
+            slots['next_subject'] = ctx.get('subject_area') or 'your subject'
+        elif purpose not in ('engagement_reward', 'performance_praise'):
+            # Generic encouragement
+            purpose = 'learning_encouragement'
+            slots['quiz_url'] = _build_url(settings.CTA_MINI_QUIZ_PATH, {'subject': subject_area})
+
+        subject_tpl, body_tpl = _PURPOSE_TEMPLATES[purpose]
+        return subject_tpl.format_map(slots), body_tpl.format_map(slots)
 
     # ---- Alignment guard ----------------------------------------------------
     def _is_alignment_ok(self, purpose: str, subject: str, body: str, ctx: Dict[str, Any]) -> bool:
         s = f"{subject} {body}".lower()
 
-        def has_any(*words) -> bool:
-            return any(w in s for w in words)
-
         chosen_subject = (ctx.get('subject_area') or '').lower().strip()
         day_hint = (ctx.get('day_hint') or '').lower().strip()
 
         # NEW: fail if another known subject is mentioned
-        primary_subjects = ctx.get("user_profile", {}).get("primary_subjects", []) or []
+        primary_subjects = ctx.get("primary_subjects") or []
         forbidden_subjects = [x for x in primary_subjects if x and x.lower() != chosen_subject]
         if forbidden_subjects:
             for forb in forbidden_subjects:
                 if forb.lower() in s:
                     return False
 
-        DAY_SYNONYMS = {
-            'tonight': ['tonight', 'this evening', 'evening', 'later this evening'],
-            'today':   ['today', 'this afternoon', 'this morning', 'later today', 'in a few hours'],
-            'tomorrow':['tomorrow', 'tmrw'],
-            'soon':    ['soon', 'coming up', 'upcoming'],
-        }
-
-        if chosen_subject and chosen_subject not in s:
-            return False
-
-        if day_hint:
-            synonyms = DAY_SYNONYMS.get(day_hint, [day_hint])
-            if not any(word in s for word in synonyms):
-                return False
-
-        if purpose == 'exam_last_minute_prep':
-            return has_any('exam', 'test', 'quiz', 'assessment', 'prep', 'plan', 'crash', 'review')
-        if purpose == 'exam_followup':
-            return has_any('exam', 'test', 'quiz', 'assessment', 'how did', 'went', 'score', 'debrief')
-        if purpose == 'appointment_reminder':
-            return has_any('appointment', 'reminder', 'tomorrow', 'today', 'tonight')
-        if purpose == 'appointment_followup':
-            return has_any('appointment', 'session', 'follow-up', 'follow up', 'went')
-        if purpose == 'completion_celebration':
-            return has_any('congrats', 'congratulations', 'completed', 'finish', 'finished')
-        return True
+        # Chosen subject, day hint and purpose keywords must all appear
+        pat = _alignment_pattern(purpose, chosen_subject, day_hint)
+        return pat is None or pat.match(s) is not None
 
 
     # ---- Utility helpers ----------------------------------------------------
@@ -686,55 +1015,32 @@ Small, consistent steps compound. Start a 10-minute set now: {settings.APP_BASE_
 
 
     def _determine_learning_level(self, features: Dict[str, Any]) -> str:
-        topics = features.get('top_topics', [])
-        advanced_indicators = ['USMLE', 'Medicine', 'Pharmacology', 'Immunology', 'Pathology', 'IELTS']
-        if any(ind in ' '.join(topics) for ind in advanced_indicators):
-            return 'graduate_medical'
-        intermediate_indicators = ['Biology', 'Chemistry', 'Physics', 'History', 'Algebra']
-        if any(ind in ' '.join(topics) for ind in intermediate_indicators):
-            return 'high_school_college'
-        return 'middle_school'
-
-    def _extract_subjects_from_topics_ordered(self, topics: list) -> list:
+        return _learning_level_for_topics(tuple(features.get('top_topics') or ()))
+
+    def _extract_subjects_from_topics_ordered(self, topics: list) -> Tuple[str, ...]:
         """
         Preserve order from top_topics while de-duplicating subjects.
         Avoids the set() ordering bug that caused random subject selection.
         """
-        seen = set()
-        ordered = []
-        for t in topics or []:
-            subj = t.split('>')[0] if '>' in t else t
-            if subj and subj not in seen:
-                seen.add(subj)
-                ordered.append(subj)
-        return ordered
+        return _ordered_subjects(tuple(topics or ()))
 
     def _guess_subject_from_topics(self, topics: list) -> str:
         # Best-effort fallback — first token before '>' or whole topic
         if not topics:
             return 'your studies'
-        t0 = topics[0]
-        return t0.split('>')[0] if '>' in t0 else t0
+        return topics[0].partition('>')[0]
 
     def _assess_engagement_level(self, features: Dict[str, Any]) -> str:
-        conversations = features.get('conversations_7d', 0)
-        frequency = features.get('frequency_7d', 0)
-        if conversations > 50 and frequency > 100:
-            return 'very_high'
-        elif conversations > 20 and frequency > 50:
-            return 'high'
-        elif conversations > 5 and frequency > 10:
-            return 'moderate'
-        else:
-            return 'low'
+        return _engagement_level_for(features.get('conversations_7d', 0), features.get('frequency_7d', 0))
 
     # ---- Trigger prioritization --------------------------------------------
     def _choose_primary_subject_area(
         self,
         purpose: str,
-        triggers: List[Dict[str, Any]],
+        triggers: Tuple[Dict[str, Any], ...],
         topics: List[str],
-        conversation_insights: Dict[str, Any]
+        upcoming_events: List[Dict[str, Any]],
+        primary_subjects: Optional[Tuple[str, ...]] = None
     ) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, Any]]]:
         """
         Choose subject + day hint using most-urgent relevant signal.
@@ -747,108 +1053,41 @@ Small, consistent steps compound. Start a 10-minute set now: {settings.APP_BASE_
 
         Returns (subject_area, day_hint, chosen_trigger_or_event_dict)
         """
-        if not isinstance(triggers, list):
-            triggers = []
-        insights = conversation_insights or {}
-        upcoming = insights.get('upcoming_events', []) or []
-
-        def extract_subject_from_topics(topics_list: List[str]) -> Optional[str]:
-            if not topics_list:
-                return None
-            t0 = topics_list[0]
-            return t0.split('>')[0] if '>' in t0 else t0
-
-        def normalize_time_hint_from_str(s: str) -> Tuple[str, int, int]:
-            """
-            Map free-text timeframes to (hint, days, hours).
-            'minutes' is treated as ultra-urgent: today with negative hours to boost score.
-            """
-            txt = (s or '').lower()
-            # minutes: "in 5 minutes", "in 30 min", "in 15m"
-            m = re.search(r'in\s+(\d+)\s*(?:minutes|min|m)\b', txt)
-            if m:
-                return ('today', 0, -10)  # negative hours => higher urgency in scoring
-
-            # hours: "in 2 hours", "in 5h"
-            m = re.search(r'in\s+(\d+)\s*(?:hours|hour|h)\b', txt)
-            if m:
-                hours = int(m.group(1))
-                return ('today', 0, max(0, hours))
-
-            if any(k in txt for k in ['tonight', 'this evening', 'evening']):
-                return ('tonight', 0, 6)
-            if any(k in txt for k in ['today', 'this afternoon', 'this morning', 'later today']):
-                return ('today', 0, 12)
-            if 'tomorrow' in txt or 'tmrw' in txt:
-                return ('tomorrow', 1, 24)
-            if 'next week' in txt:
-                return ('soon', 7, 0)
-            return ('soon', 3, 0)
-
-        def normalize_time_hint_from_trigger(t: Dict[str, Any]) -> Tuple[str, int, int]:
-            tf = str(t.get('timeframe', '') or '').lower()
-            days_before = t.get('days_before')
-            if days_before is not None:
-                try:
-                    d = int(days_before)
-                except Exception:
-                    d = 3
-                if d <= 0:
-                    # If 0 and we can infer evening, call it 'tonight'
-                    return ('tonight', 0, 6) if 'night' in tf or 'evening' in tf else ('today', 0, 6)
-                if d == 1:
-                    return ('tomorrow', 1, 24)
-                return ('soon', d, d * 24)
-            # Fall back to parsing the timeframe string
-            return normalize_time_hint_from_str(tf)
-
-        def urgency_score(days: int, hours: int, hint: str, subject: Optional[str]) -> int:
-            # Lower days/hours = higher urgency
-            score = 10_000 - (days * 300 + hours * 5)
-            if hint == 'tonight':
-                score += 50
-            elif hint == 'today':
-                score += 40
-            elif hint == 'tomorrow':
-                score += 20
-            # Tiny tie-breaker if this subject is also first in topics
-            first_topic_subject = extract_subject_from_topics(topics)
-            if subject and first_topic_subject and subject.lower() == first_topic_subject.lower():
-                score += 3
-            return score
-
-        # Build a unified list of candidates (exam/test/quiz/assessment)
-        candidates: List[Tuple[int, str, str, Dict[str, Any]]] = []
+        first_topic_subject = topics[0].partition('>')[0] if topics else None
+
+        # Track the most urgent candidate (exam/test/quiz/assessment) in one pass;
+        # ties keep the first candidate seen.
+        best_score: Optional[int] = None
+        best: Optional[Tuple[str, str, Dict[str, Any]]] = None
 
         def push_candidate(subject: Optional[str], hint: str, days: int, hours: int, src: Dict[str, Any]):
-            subj = subject or extract_subject_from_topics(topics) or 'General'
-            candidates.append((urgency_score(days, hours, hint, subj), subj, hint, src))
+            nonlocal best_score, best
+            subj = subject or first_topic_subject or 'General'
+            score = _urgency_score(days, hours, hint, subj, first_topic_subject)
+            if best_score is None or score > best_score:
+                best_score, best = score, (subj, hint, src)
 
         if purpose == 'exam_last_minute_prep':
             # From explicit triggers
             for t in triggers:
-                if not isinstance(t, dict):
-                    continue
-                t_type = (t.get('trigger') or t.get('trigger_type') or '').lower()
-                stage = (t.get('message_type') or '').lower()
-                if stage == 'last_minute_prep' or t_type in ('exam_prep', 'pre_exam'):
-                    hint, d, h = normalize_time_hint_from_trigger(t)
+                g = t.get
+                t_type = (g('trigger') or g('trigger_type') or '').casefold()
+                stage = (g('message_type') or '').casefold()
+                if stage == 'last_minute_prep' or t_type in _EXAM_PREP_TRIGGER_TYPES:
+                    hint, d, h = _normalize_time_hint_from_trigger(t)
                     push_candidate(t.get('subject'), hint, d, h, t)
 
             # From insights.upcoming_events (exam-like types)
-            for ev in upcoming:
-                if not isinstance(ev, dict):
-                    continue
-                ev_type = (ev.get('type') or '').lower()
-                if ev_type in ('exam', 'test', 'quiz', 'assessment'):
-                    hint, d, h = normalize_time_hint_from_str(ev.get('timeframe', ''))
+            for ev in upcoming_events:
+                ev_type = (ev.get('type') or '').casefold()
+                if ev_type in _EXAM_EVENT_TYPES:
+                    hint, d, h = _normalize_time_hint_from_lower(str(ev.get('timeframe') or '').lower())
                     push_candidate(ev.get('subject'), hint, d, h, ev)
 
-            if candidates:
-                candidates.sort(key=lambda x: x[0], reverse=True)
-                _, subj, hint, chosen = candidates[0]
-                return subj, hint, chosen
+            if best is not None:
+                return best
 
         # Fallback: use topics order
-        ordered_subjects = self._extract_subjects_from_topics_ordered(topics)
-        return (ordered_subjects[0] if ordered_subjects else None), None, None
+        if primary_subjects is None:
+            primary_subjects = self._extract_subjects_from_topics_ordered(topics)
+        return (primary_subjects[0] if primary_subjects else None), None, None
@@ -1,5 +1,6 @@
 import logging
-from typing import Any, Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from datetime import datetime, timedelta
 from uuid import UUID
 
@@ -7,6 +8,11 @@ from database import postgres as pg
 
 logger = logging.getLogger(__name__)
 
+# EventBatch flushes once it holds this many events. There is no age limit: callers
+# spend seconds per step (LLM, DynamoDB), so one would flush nearly every event;
+# flush() explicitly where events must be visible (e.g. before finish_run)
+_BATCH_MAX_EVENTS = 100
+
 
 class EventLogger:
     """
@@ -39,20 +45,48 @@ class EventLogger:
               dedupe_key: Optional[str] = None) -> Optional[UUID]:
         return pg.log_event(event_type=event_type, payload=payload or {}, user_id=user_id, run_id=run_id, dedupe_key=dedupe_key)
 
+    def event_batch(self, events: List[Dict[str, Any]]) -> None:
+        """
+        Insert many events in one statement. Items take the keyword arguments of event();
+        ids are not returned, and duplicate dedupe_keys are skipped.
+        """
+        pg.insert_events_many(events)
+
+    @contextmanager
+    def batch(self) -> Iterator["EventBatch"]:
+        """
+        Buffer events and write them in bulk:
+
+            with event_logger.batch() as b:
+                b.event("email_queued", {...}, user_id=user_id, run_id=run_id)
+
+        Flushes every _BATCH_MAX_EVENTS events, on flush(), and on exit.
+        """
+        buffer = EventBatch(self)
+        try:
+            yield buffer
+        finally:
+            buffer.flush()
+
     def save_features(self, user_id: UUID, run_id: Optional[UUID], features: Dict[str, Any]) -> None:
-        # Convert non-JSON-serializable values if needed
-        safe_features: Dict[str, Any] = {}
-        for k, v in (features or {}).items():
-            try:
-                _ = (v if isinstance(v, (dict, list, str, int, float, bool)) or v is None else str(v))
-                safe_features[k] = v if isinstance(v, (dict, list, str, int, float, bool)) or v is None else str(v)
-            except Exception:
-                safe_features[k] = str(v)
-        pg.insert_features(user_id=user_id, run_id=run_id, features=safe_features)
+        # Values the JSON encoder cannot represent natively are stored as str(value)
+        pg.insert_features(user_id=user_id, run_id=run_id, features=features or {})
+
+    def save_features_many(self, items: List[Tuple[UUID, Optional[UUID], Dict[str, Any]]]) -> None:
+        """Bulk save_features: items are (user_id, run_id, features) tuples."""
+        pg.insert_features_many(items)
+
+    def latest_features(self, user_id: UUID, include_extra: bool = True) -> Optional[Dict[str, Any]]:
+        """Latest saved features for the user (see pg.fetch_latest_daily_features)."""
+        return pg.fetch_latest_daily_features(user_id, include_extra=include_extra)
 
     def save_decisions(self, user_id: UUID, run_id: Optional[UUID], decisions: List[Dict[str, Any]]) -> None:
         pg.insert_decisions(user_id=user_id, run_id=run_id, decisions=decisions or [])
 
+    def save_decisions_many(self, items: List[Tuple[UUID, Optional[UUID], List[Dict[str, Any]]]]) -> None:
+        """Bulk save_decisions: items are (user_id, run_id, decisions) tuples."""
+        pg.insert_decisions_many(items)
+
     def ensure_template(self, key: str, subject: str, body_html: str) -> None:
         pg.ensure_email_template(key=key, subject=subject, body_html=body_html)
 
@@ -75,6 +109,13 @@ class EventLogger:
             sent_at=None,
         )
 
+    def queue_emails_many(self, items: List[Tuple[str, str, str, Dict[str, Any]]]) -> List[Optional[str]]:
+        """
+        Bulk ensure_user + ensure_template + queue_email: items are (email, template_key,
+        stage, metadata) tuples. Returns each item's unique_key, or None if already queued.
+        """
+        return pg.queue_email_attempts_many(items)
+
     def mark_email_sent(self, unique_key: Optional[str] = None, attempt_id: Optional[UUID] = None):
         pg.update_email_attempt_status(unique_key=unique_key, attempt_id=attempt_id, status="sent")
 
@@ -83,3 +124,36 @@ class EventLogger:
 
     def mark_email_skipped(self, reason: str, unique_key: Optional[str] = None, attempt_id: Optional[UUID] = None):
         pg.update_email_attempt_status(unique_key=unique_key, attempt_id=attempt_id, status="skipped", reason=reason)
+
+
+class EventBatch:
+    """
+    Event buffer handed out by EventLogger.batch(); event() mirrors EventLogger.event()
+    but defers the insert until the next flush.
+    """
+
+    def __init__(self, event_logger: EventLogger):
+        self._event_logger = event_logger
+        self._events: List[Dict[str, Any]] = []
+
+    def event(self,
+              event_type: str,
+              payload: Optional[Dict[str, Any]] = None,
+              user_id: Optional[UUID] = None,
+              run_id: Optional[UUID] = None,
+              dedupe_key: Optional[str] = None) -> None:
+        self._events.append({
+            "event_type": event_type,
+            "payload": payload or {},
+            "user_id": user_id,
+            "run_id": run_id,
+            "dedupe_key": dedupe_key,
+        })
+        if len(self._events) >= _BATCH_MAX_EVENTS:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._events:
+            return
+        events, self._events = self._events, []
+        self._event_logger.event_batch(events)
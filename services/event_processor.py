@@ -1,32 +1,46 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import func, lambda_stmt, select, text, update
+from sqlalchemy.engine import Row
+from config.settings import settings
 from database.connection import SessionLocal
 from database.models import Event, ConvoSummary, UserDailyFeatures
-from services.llm_service import LLMService
+from services.llm_service import get_llm_service
 from services.feature_engine import FeatureEngine
+import asyncio
 import logging
-from typing import List
-from datetime import datetime, timedelta
+from typing import List, Optional
+from datetime import datetime, timedelta, timezone
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# Re-summarize a session only once this many new messages arrived or this much time passed
+_RESUMMARIZE_MIN_NEW_MESSAGES = 5
+_RESUMMARIZE_MIN_INTERVAL = timedelta(minutes=5)
+# Messages sent verbatim per summarization call; older context comes from the prior summary
+_SUMMARY_MAX_MESSAGES = 50
+
 class EventProcessor:
     """
     Service for processing events and triggering downstream workflows
     """
     
     def __init__(self):
-        self.llm_service = LLMService()
+        self.llm_service = get_llm_service()
         self.feature_engine = FeatureEngine()
     
     async def process_events_async(self, event_ids: List[str]):
-        """Process multiple events asynchronously"""
-        db = SessionLocal()
-        try:
-            for event_id in event_ids:
-                await self.process_single_event(event_id, db)
-        finally:
-            db.close()
+        """
+        Process multiple events concurrently, at most settings.EVENT_PROCESSING_CONCURRENCY
+        at a time. Each task opens its own session; sessions must not be shared across tasks.
+        """
+        sem = asyncio.Semaphore(settings.EVENT_PROCESSING_CONCURRENCY)
+
+        async def _bounded(event_id: str):
+            async with sem:
+                await self.process_single_event(event_id)
+
+        await asyncio.gather(*(_bounded(event_id) for event_id in event_ids), return_exceptions=True)
     
     async def process_single_event(self, event_id: str, db: Session = None):
         """Process a single event"""
@@ -37,7 +51,11 @@ class EventProcessor:
             close_db = False
         
         try:
-            event = db.query(Event).filter(Event.event_id == event_id).first()
+            # Per-event statements are lambda_stmt()s: built and compiled once, cached by
+            # call site, with the ids/timestamps bound as parameters on every later call
+            event = db.execute(
+                lambda_stmt(lambda: select(Event).where(Event.event_id == event_id))
+            ).scalars().first()
             if not event:
                 logger.warning(f"Event {event_id} not found")
                 return
@@ -63,15 +81,28 @@ class EventProcessor:
         if not event.session_id:
             return
         
-        # Check if we need to summarize this session
-        session_events = db.query(Event).filter(
-            Event.session_id == event.session_id,
+        session_id = event.session_id
+        # Check if we need to summarize this session (aggregate only; no rows transferred)
+        message_count, last_event_time = db.execute(lambda_stmt(lambda: select(
+            func.count(Event.event_id), func.max(Event.ts)
+        ).where(
+            Event.session_id == session_id,
             Event.name == 'convo_msg'
-        ).order_by(Event.ts).all()
+        ))).one()
         
-        # Trigger summarization if session has enough messages or is old enough
-        if len(session_events) >= 10 or self._is_session_old(session_events):
-            await self._summarize_conversation_session(event.session_id, session_events, db)
+        # Trigger summarization if session has enough messages or is old enough;
+        # only then load the message history, projecting role/text out of props in SQL
+        if message_count >= 10 or self._is_session_old(last_event_time):
+            messages = db.execute(lambda_stmt(lambda: select(
+                Event.ts,
+                Event.user_id,
+                Event.props['role'].astext.label('role'),
+                Event.props['text'].astext.label('text')
+            ).where(
+                Event.session_id == session_id,
+                Event.name == 'convo_msg'
+            ).order_by(Event.ts))).all()
+            await self._summarize_conversation_session(event.session_id, messages, db)
     
     async def _process_learning_event(self, event: Event, db: Session):
         """Process learning-related events (tests, presentations)"""
@@ -81,52 +112,79 @@ class EventProcessor:
     
     async def _process_login_event(self, event: Event, db: Session):
         """Process login events"""
-        # Update user's last login time
+        # Update user's last login time in one statement (no SELECT / identity-map load);
+        # GREATEST keeps out-of-order events from moving it backwards
         from database.models import AppUser
         
-        user = db.query(AppUser).filter(AppUser.user_id == event.user_id).first()
-        if user:
-            user.last_login_at = event.ts
-            db.commit()
+        user_id, ts = event.user_id, event.ts
+        db.execute(lambda_stmt(lambda:
+            update(AppUser)
+            .where(AppUser.user_id == user_id)
+            .values(last_login_at=func.greatest(AppUser.last_login_at, ts))
+        ))
+        db.commit()
     
-    async def _summarize_conversation_session(self, session_id: str, events: List[Event], db: Session):
-        """Summarize a conversation session using LLM"""
+    async def _summarize_conversation_session(self, session_id: str, messages: List[Row], db: Session):
+        """
+        Summarize a conversation session using LLM.
+        `messages` are (ts, user_id, role, text) rows ordered by ts.
+        """
         try:
-            # Build conversation text
-            conversation_text = []
-            for event in events:
-                role = event.props.get('role', 'user')
-                text = event.props.get('text', '')
-                conversation_text.append(f"{role}: {text}")
-            
-            full_conversation = "\n".join(conversation_text)
+            # Single-flight across workers: whoever holds the session's lock summarizes
+            if not self._try_session_lock(session_id, db):
+                logger.info(f"Session {session_id} is being summarized elsewhere; skipping")
+                return
+
+            # Debounce: skip unless enough new messages arrived or the last summary is stale
+            summary = db.query(ConvoSummary).filter(ConvoSummary.session_id == session_id).first()
+            now = datetime.now(timezone.utc)
+            if summary and summary.last_message_count is not None and summary.last_summarized_at:
+                few_new = len(messages) - summary.last_message_count < _RESUMMARIZE_MIN_NEW_MESSAGES
+                if few_new and now - summary.last_summarized_at < _RESUMMARIZE_MIN_INTERVAL:
+                    db.rollback()  # end the transaction to release the lock
+                    return
+
+            # Build conversation text incrementally: the prior summary stands in for messages it
+            # already covers, and at most the latest _SUMMARY_MAX_MESSAGES are sent verbatim
+            prior = summary.summary if summary else None
+            unsummarized = messages[summary.last_message_count or 0:] if prior else messages
+            new_messages = "\n".join(
+                f"{m.role or 'user'}: {m.text or ''}"
+                for m in unsummarized[-_SUMMARY_MAX_MESSAGES:]
+            )
+            if prior:
+                full_conversation = f"Prior summary:\n{prior}\n\nNew messages:\n{new_messages}"
+            else:
+                full_conversation = new_messages
             
             # Get LLM analysis
             analysis = await self.llm_service.analyze_conversation(full_conversation)
             
             # Create or update conversation summary
-            summary = db.query(ConvoSummary).filter(ConvoSummary.session_id == session_id).first()
-            
             if not summary:
                 summary = ConvoSummary(
                     session_id=session_id,
-                    user_id=events[0].user_id,
-                    started_at=events[0].ts,
-                    ended_at=events[-1].ts,
+                    user_id=messages[0].user_id,
+                    started_at=messages[0].ts,
+                    ended_at=messages[-1].ts,
                     summary=analysis['summary'],
                     topics=analysis['topics'],
                     sentiment=analysis['sentiment'],
                     needs=analysis['needs'],
-                    embedding=analysis['embedding']
+                    embedding=analysis['embedding'],
+                    last_message_count=len(messages),
+                    last_summarized_at=now
                 )
                 db.add(summary)
             else:
-                summary.ended_at = events[-1].ts
+                summary.ended_at = messages[-1].ts
                 summary.summary = analysis['summary']
                 summary.topics = analysis['topics']
                 summary.sentiment = analysis['sentiment']
                 summary.needs = analysis['needs']
                 summary.embedding = analysis['embedding']
+                summary.last_message_count = len(messages)
+                summary.last_summarized_at = now
             
             db.commit()
             logger.info(f"Summarized conversation session {session_id}")
@@ -134,10 +192,21 @@ class EventProcessor:
         except Exception as e:
             logger.error(f"Failed to summarize session {session_id}: {str(e)}")
     
-    def _is_session_old(self, events: List[Event]) -> bool:
+    def _try_session_lock(self, session_id: str, db: Session) -> bool:
+        """Transaction-scoped Postgres advisory lock on the session; released on commit/rollback."""
+        try:
+            return bool(db.execute(
+                text("SELECT pg_try_advisory_xact_lock(hashtext(:session_id))"),
+                {"session_id": session_id}
+            ).scalar())
+        except Exception as e:
+            # Non-Postgres backends have no advisory locks; fall back to the debounce alone
+            logger.debug(f"Advisory lock unavailable for session {session_id}: {e}")
+            return True
+    
+    def _is_session_old(self, last_event_time: Optional[datetime]) -> bool:
         """Check if conversation session is old enough to summarize"""
-        if not events:
+        if last_event_time is None:
             return False
         
-        last_event_time = max(event.ts for event in events)
-        return datetime.utcnow() - last_event_time > timedelta(hours=1)
+        return datetime.now(timezone.utc) - last_event_time > timedelta(hours=1)
@@ -1,28 +1,131 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import func, and_, case, cast, column, literal, select, table, Date, Float
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+from sqlalchemy.dialects.postgresql import JSONB, aggregate_order_by, array_agg, insert as pg_insert
 from database.models import Event, UserDailyFeatures, AppUser, ConvoSummary, EmailSend, Unsubscribe
 from datetime import datetime, date, timedelta, timezone
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import logging
+import os
+import sys
+import threading
 from typing import Optional, List, Any
 import typing as t
+from config.settings import settings
+from services import _async_runtime
 from services.itp_icp_analyzer import ItpIcpAnalyzer
 from database.dynamodb_models import UserInfiniteTestSeriesModel
 
 
 logger = logging.getLogger(__name__)
 
+# Events that count towards frequency_7d
+_ACTIVITY_EVENT_NAMES = ('login', 'convo_msg', 'test_attempt', 'presentation_progress')
+_LOGIN_EVENT_NAMES = ('login_session', 'login')
+# compute_user_features (normalized event dicts): per-name buckets for the analyzers,
+# and the event names that may carry a subject
+_EVENT_BUCKET_NAMES = ('test_attempt', 'icp_progress', 'login_session', 'convo_msg')
+_AFFINITY_EVENT_NAMES = ('test_attempt', 'presentation_progress', 'convo_msg')
+# props keys extracted (in SQL) for the 7-day raw event reads: _calculate_login_minutes reads
+# the login keys (as jsonb, keeping JSON types), the conversation analyzers the convo keys (text)
+_LOGIN_PROPS_KEYS = ('Session', 'login_time', 'logout_time', 'session_duration_minutes', 'duration_minutes')
+_CONVO_PROPS_KEYS = ('role', 'content', 'message')
+_UPSERT_PAGE_SIZE = 1000  # user_daily_features rows per INSERT ... ON CONFLICT statement
+_USER_STREAM_PAGE = 1000  # AppUser rows per server-side cursor fetch (and per in-process batch)
+_EVENT_STREAM_PAGE = 1000  # raw 7-day event rows per server-side cursor fetch
+_TOP_TOPICS_LIMIT = 5
+_PRESENTATION_MAX_MINUTES = 120  # cap per presentation (start -> end)
+_SESSION_MAX_MINUTES = 180  # cap per login session
+# ITP Response keys: 'YYYY-MM-DD,HH:MM:SS'. Zero-padded and fixed-width, so string order is time order
+_ITP_TS_FORMAT = '%Y-%m-%d,%H:%M:%S'
+_ITP_TS_LEN = 19
+# datetime.fromisoformat() parses a trailing 'Z' itself from Python 3.11
+_ISO_Z_NATIVE = sys.version_info >= (3, 11)
+# AI email trigger values behind the has_* rule flags (_trigger_flags)
+_PREP_TRIGGERS = frozenset({'exam_prep', 'pre_exam'})
+_POST_TRIGGERS = frozenset({'post_exam', 'exam_followup'})
+# Churn risk: each threshold crossed adds a point; points // 2 indexes _CHURN_LEVELS
+_CHURN_RECENCY_DAYS = (3, 7)  # recency_days above each
+_CHURN_FREQUENCY_7D = (5, 2)  # frequency_7d below each
+_CHURN_SENTIMENT = (0.0, -0.3)  # convo sentiment below each
+_CHURN_LEVELS = ('low', 'medium', 'high')
+# Conversation keyword fallbacks (_analyze_conversations_with_ai): topics when the LLM call
+# fails, heuristic triggers when it returns none. All are matched as lowercase substrings
+_FALLBACK_TOPIC_KEYWORDS = {
+    'Biology>Cells': ('cell', 'cellular', 'mitochondria', 'nucleus', 'membrane', 'organelle'),
+    'Biology>Photosynthesis': ('photosynthesis', 'chloroplast', 'light reaction', 'calvin cycle'),
+    'Biology>Cellular Mechanisms': ('cellular', 'mechanism', 'biology', 'molecular'),
+    'Pharmacology>Antibiotics': ('antibiotic', 'antimicrobial', 'penicillin', 'vancomycin', 'resistance', 'bacteria'),
+    'History>Stone Age': ('stone age', 'neolithic', 'paleolithic'),
+}
+_SOON_KEYWORDS = frozenset({'tomorrow', 'tmrw', 'next day'})
+_SUPPORT_KEYWORDS = frozenset({'difficult', 'hard', 'struggling', 'confused', 'help'})
+# Every distinct keyword above: each is searched for once per text (_keyword_hits)
+_CONVO_KEYWORDS = frozenset(
+    {'exam', 'appointment'} | _SOON_KEYWORDS | _SUPPORT_KEYWORDS
+    | {k for keywords in _FALLBACK_TOPIC_KEYWORDS.values() for k in keywords}
+)
+# No events for this many days (and no recent emails/summaries): skip the per-user queries
+_INACTIVE_AFTER_DAYS = 30
+
+# Materialized per-(user, day, event name) rollup of Event; recency/frequency read this
+# instead of rescanning the raw log. Created by database/event_rollups.sql, refreshed at
+# the start of compute_daily_features.
+_EVENT_ROLLUP = table(
+    'mv_user_day_event_stats',
+    column('user_id'), column('day'), column('name'),
+    column('cnt'), column('first_ts'), column('last_ts'),
+    schema='analytics',
+)
+
+# Per-(user, day) intermediate aggregates behind the 30-day features (created by
+# database/event_rollups.sql). Each day is folded in once by rollup_daily_ir, except the
+# trailing _IR_REFOLD_DAYS, which are refolded every run so late-arriving events count;
+# windows then combine at most _IR_WINDOW_DAYS rows per user.
+_DAILY_IR = Table(
+    'daily_user_ir', MetaData(),
+    Column('user_id', String, primary_key=True),
+    Column('day', Date, primary_key=True),
+    Column('tests_correct_cnt', Integer, nullable=False),
+    Column('tests_total_cnt', Integer, nullable=False),
+    Column('subject_counts', JSONB, nullable=False),  # {subject: events that day}
+    Column('computed_at', DateTime, nullable=False, server_default=func.now()),
+    schema='analytics',
+)
+_IR_EVENT_NAMES = ('test_attempt', 'presentation_progress', 'convo_msg')
+_IR_WINDOW_DAYS = 30
+_IR_REFOLD_DAYS = 2
+_SCORE_TREND_MIN_TESTS = 5  # fewer test attempts in the window: avg_score_change_30d = 0
+
+
 class FeatureEngine:
     """
     Service for computing user features and analytics
     """
     
     def __init__(self):
-        from services.llm_service import LLMService
-        self.llm_service = LLMService()
-        from services.itp_icp_analyzer import ItpIcpAnalyzer
-        self.itp_icp = ItpIcpAnalyzer()
-        self.itp_series = UserInfiniteTestSeriesModel()
+        from services.llm_service import get_llm_service
+        self.llm_service = get_llm_service()
+        # DynamoDB-backed helpers are per thread (see _compute_users)
+        self._local = threading.local()
+    
+    @property
+    def itp_icp(self) -> ItpIcpAnalyzer:
+        """This thread's ITP/ICP analyzer."""
+        analyzer = getattr(self._local, 'itp_icp', None)
+        if analyzer is None:
+            analyzer = self._local.itp_icp = ItpIcpAnalyzer()
+        return analyzer
+    
+    @property
+    def itp_series(self) -> UserInfiniteTestSeriesModel:
+        """This thread's User_Infinite_TestSeries model."""
+        model = getattr(self._local, 'itp_series', None)
+        if model is None:
+            model = self._local.itp_series = UserInfiniteTestSeriesModel()
+        return model
     
     def compute_user_features(self, email: str, events: List[Dict]) -> Dict[str, Any]:
         """
@@ -35,54 +138,49 @@ class FeatureEngine:
         # Convert events to feature calculations
         features = {}
         
+        now = datetime.now(timezone.utc)
+        week_ago = now - timedelta(days=7)
+        
+        # One pass over the events: parse each timestamp once (cached as '_ts' on shallow
+        # copies, so the caller's dicts are left untouched), track recency and 7-day
+        # frequency, and bucket what the helpers below need by event name
+        buckets: Dict[str, List[Dict]] = {name: [] for name in _EVENT_BUCKET_NAMES}
+        affinity_events: List[Dict] = []
+        latest_ts = None
+        frequency_7d = 0
+        for raw in events:
+            ts = _parse_event_ts(raw['ts'])
+            event = dict(raw, _ts=ts)
+            if latest_ts is None or ts > latest_ts:
+                latest_ts = ts
+            if ts >= week_ago:
+                frequency_7d += 1
+            bucket = buckets.get(event['name'])
+            if bucket is not None:
+                bucket.append(event)
+            if event['name'] in _AFFINITY_EVENT_NAMES:
+                affinity_events.append(event)
+        
         # Calculate recency (days since last activity)
-        latest_event = max(events, key=lambda x: x['ts'])
-        latest_ts = datetime.fromisoformat(latest_event['ts'].replace('Z', '+00:00'))
-        recency_days = (datetime.now(timezone.utc) - latest_ts).days
+        recency_days = (now - latest_ts).days
         features['recency_days'] = recency_days
         
         # Calculate frequency (activity count in last 7 days)
-        week_ago = datetime.now(timezone.utc) - timedelta(days=7)
-        recent_events = [e for e in events if datetime.fromisoformat(e['ts'].replace('Z', '+00:00')) >= week_ago]
-        features['frequency_7d'] = len(recent_events)
+        features['frequency_7d'] = frequency_7d
         
-        test_events = [e for e in events if e['name'] == 'test_attempt']
-        features.update(self._analyze_itp_performance(test_events, week_ago))
+        features.update(self._analyze_itp_performance(buckets['test_attempt'], week_ago))
         
-        icp_events = [e for e in events if e['name'] == 'icp_progress']
-        features.update(self._analyze_icp_completion(icp_events))
+        features.update(self._analyze_icp_completion(buckets['icp_progress']))
         
-        login_events = [e for e in events if e['name'] == 'login_session']
-        features['minutes_7d'] = self._calculate_login_minutes_from_events(login_events, week_ago)
+        features['minutes_7d'] = self._calculate_login_minutes_from_events(buckets['login_session'], week_ago)
         
-        convo_events = [e for e in events if e['name'] == 'convo_msg']
-        features.update(self._analyze_conversations_with_ai(convo_events, week_ago))
+        features.update(self._analyze_conversations_with_ai(buckets['convo_msg'], week_ago))
 
         # === Trigger convenience booleans for rules engine ===
-        trigs = features.get('ai_email_triggers', []) or []
-        def _is_dict(d): return isinstance(d, dict)
-
-        features['has_exam_last_minute_prep'] = any(
-            _is_dict(t) and (
-                t.get('message_type') == 'last_minute_prep' or
-                (t.get('trigger') in ('exam_prep', 'pre_exam'))
-            ) for t in trigs
-        )
-        features['has_exam_post_checkin'] = any(
-            _is_dict(t) and (
-                t.get('message_type') == 'how_did_it_go' or
-                (t.get('trigger') in ('post_exam', 'exam_followup'))
-            ) for t in trigs
-        )
-        features['has_learning_support'] = any(
-            _is_dict(t) and (
-                t.get('trigger') == 'learning_support' or
-                t.get('trigger_type') == 'learning_support'
-            ) for t in trigs
-        )
+        features.update(_trigger_flags(features.get('ai_email_triggers', []) or []))
         
         # Calculate subject affinity
-        features['subject_affinity'] = self._calculate_subject_affinity_from_events(events)
+        features['subject_affinity'] = self._calculate_subject_affinity_from_events(affinity_events)
         
         # Calculate churn risk
         features['churn_risk'] = self._assess_churn_risk(
@@ -143,12 +241,12 @@ class FeatureEngine:
                 # Allow 'YYYY-MM-DD,HH:MM:SS'
                 if ',' in s and len(s.split(',')) == 2:
                     try:
-                        return datetime.strptime(s, '%Y-%m-%d,%H:%M:%S').replace(tzinfo=timezone.utc)
+                        return datetime.strptime(s, _ITP_TS_FORMAT).replace(tzinfo=timezone.utc)
                     except Exception:
                         pass
                 # Generic ISO 8601
                 try:
-                    return datetime.fromisoformat(s.replace('Z', '+00:00'))
+                    return _parse_event_ts(s)
                 except Exception:
                     pass
                 return None
@@ -211,33 +309,6 @@ class FeatureEngine:
             'has_learning_support': False,
         }
 
-    def _calculate_presentation_minutes_from_events(self, events: List[Dict], since_date: datetime) -> int:
-        """Calculate presentation minutes from normalized events"""
-        recent_events = [e for e in events if datetime.fromisoformat(e['ts'].replace('Z', '+00:00')) >= since_date]
-        
-        # Group by presentation and session
-        sessions = {}
-        for event in recent_events:
-            presentation_id = event['props'].get('presentation_id', 'unknown')
-            trigger = event['props'].get('trigger')
-            
-            if presentation_id not in sessions:
-                sessions[presentation_id] = {'start': None, 'end': None}
-            
-            if trigger == 'start':
-                sessions[presentation_id]['start'] = datetime.fromisoformat(event['ts'].replace('Z', '+00:00'))
-            elif trigger == 'end':
-                sessions[presentation_id]['end'] = datetime.fromisoformat(event['ts'].replace('Z', '+00:00'))
-        
-        # Calculate total minutes
-        total_minutes = 0
-        for session in sessions.values():
-            if session['start'] and session['end']:
-                duration = (session['end'] - session['start']).total_seconds() / 60
-                total_minutes += max(0, min(duration, 120))  # Cap at 2 hours
-        
-        return int(total_minutes)
-    
     def _calculate_subject_affinity_from_events(self, events: List[Dict]) -> Dict[str, float]:
         """
         Calculate subject affinity from events with comprehensive subject extraction
@@ -245,22 +316,21 @@ class FeatureEngine:
         """
         from datetime import datetime
         
-        subject_time: Dict[str, float] = {}
-        total_time = 0.0
+        subject_time: Dict[str, float] = defaultdict(float)
 
         def bump(subj: Optional[str], weight: float):
-            nonlocal total_time
             if not subj:
                 return
             s = subj.strip()
-            if not s:
-                return
-            subject_time[s] = subject_time.get(s, 0.0) + weight
-            total_time += weight
+            if s:
+                subject_time[s] += weight
 
         # Filter to relevant event types that may have subject information
-        relevant_events = [e for e in events if e['name'] in ['test_attempt', 'presentation_progress', 'convo_msg']]
+        relevant_events = [e for e in events if e['name'] in _AFFINITY_EVENT_NAMES]
         
+        # The recency weight depends only on (subject, days_ago): count events per pair
+        # here and weight each distinct pair once below
+        pair_counts: Counter = Counter()
         now = datetime.utcnow()
         for event in relevant_events:
             props = event.get('props', {}) or {}
@@ -283,15 +353,21 @@ class FeatureEngine:
             if not subj:
                 subj = props.get('subject_tag')
             
-            # Apply recency weight: up to ~30 days decay
             try:
-                ts = datetime.fromisoformat(event['ts'].replace('Z', '+00:00'))
+                ts = _event_ts(event)
                 days_ago = (now - ts).days if isinstance(ts, datetime) else 0
-                weight = max(0.1, 1.0 - (days_ago / 30.0))
             except:
-                weight = 0.5  # Default weight if timestamp parsing fails
+                days_ago = None  # timestamp parsing failed
 
-            bump(subj, weight)
+            pair_counts[(subj, days_ago)] += 1
+
+        for (subj, days_ago), count in pair_counts.items():
+            # Apply recency weight: up to ~30 days decay
+            if days_ago is None:
+                weight = 0.5  # Default weight if timestamp parsing fails
+            else:
+                weight = max(0.1, 1.0 - (days_ago / 30.0))
+            bump(subj, weight * count)
 
         # Also extract from top_topics if available (from conversation analysis)
         # This is a fallback when direct subject extraction is sparse
@@ -306,161 +382,456 @@ class FeatureEngine:
                     # lighter weight than explicit event-subject, but still counts
                     bump(subj, 0.3)
 
+        # Normalize to probabilities
+        total_time = sum(subject_time.values())
         if total_time <= 0:
             return {}
-
-        # Normalize to probabilities
         return {k: min(v / total_time, 1.0) for k, v in subject_time.items()}
     
-    def compute_daily_features(self, db: Session, target_date: date = None) -> int:
+    def compute_daily_features(self, db: Session, target_date: date = None, workers: Optional[int] = None) -> int:
         """
         Compute daily features for all users
         Returns number of users processed
+        `workers` processes split the users (default settings.FEATURE_COMPUTE_WORKERS;
+        0 = os.cpu_count(), 1 = in this process with `db`).
         """
         if target_date is None:
             target_date = date.today()
         
-        users = db.query(AppUser).all()
-        processed_count = 0
+        self.refresh_event_rollup(db)
+        self.rollup_daily_ir(db, target_date)
+        # Plain (user_id, email) rows off a server-side cursor, not a fully buffered ORM list
+        user_rows = db.execute(
+            select(AppUser.user_id, AppUser.email)
+            .execution_options(stream_results=True, yield_per=_USER_STREAM_PAGE)
+        )
         
-        for user in users:
-            try:
-                features = self._compute_user_features(user.user_id, target_date, db)
-                self._upsert_user_features(user.user_id, target_date, features, db)
-                processed_count += 1
-            except Exception as e:
-                logger.error(f"Failed to compute features for user {user.user_id}: {str(e)}")
+        if workers is None:
+            workers = settings.FEATURE_COMPUTE_WORKERS
+        workers = workers or os.cpu_count() or 1
+        if workers > 1:
+            # Partitioning needs every user up front
+            users = [(user_id, email) for user_id, email in user_rows]
+            workers = min(workers, len(users))
+            if workers > 1:
+                chunks = _partition_by_density(users, self._event_volumes(db, target_date), workers)
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    processed_count = sum(pool.map(_compute_features_chunk, chunks, [target_date] * workers))
+            else:
+                processed_count = self._compute_users(
+                    users, target_date, db, user_ids=[user_id for user_id, _ in users]
+                )
+                db.commit()
+        else:
+            # In-process: one page of users (and its cohort aggregates) in memory at a time
+            processed_count = 0
+            for page in user_rows.partitions():
+                processed_count += self._compute_users(
+                    page, target_date, db, user_ids=[user_id for user_id, _ in page]
+                )
+            db.commit()
         
-        db.commit()
         logger.info(f"Computed features for {processed_count} users on {target_date}")
         return processed_count
     
-    def _compute_user_features(self, user_id: str, as_of_date: date, db: Session) -> Dict[str, Any]:
-        """Compute features for a specific user"""
+    def _event_volumes(self, db: Session, as_of_date: date) -> Dict[str, int]:
+        """Events per user over the last 30 days (from the rollup view), the per-user work proxy."""
+        rollup = _EVENT_ROLLUP.c
+        return {
+            uid: int(count or 0)
+            for uid, count in db.query(rollup.user_id, func.sum(rollup.cnt)).filter(
+                rollup.day >= as_of_date - timedelta(days=30),
+                rollup.day < as_of_date
+            ).group_by(rollup.user_id).all()
+        }
+    
+    def _compute_users(self, users: List[Tuple[str, Optional[str]]], as_of_date: date, db: Session,
+                       user_ids: Optional[List[str]] = None) -> int:
+        """
+        Compute and upsert features for (user_id, email) pairs; the caller commits. Returns users processed.
+        What is left per user after the cohort load is network-bound (DynamoDB test counts, LLM
+        conversation analysis, ITP/ICP analyzer), so users run on settings.FEATURE_USER_THREADS
+        threads. They read the prefetched cohort and share no connections: `db` stays on this
+        thread, and each thread gets its own DynamoDB model/analyzer (boto3 resources are not
+        thread-safe).
+        """
+        # Scalar metrics for every user in a handful of GROUP BY queries, not ~8 per user
+        cohort = self._load_cohort_aggregates(as_of_date, db, user_ids=user_ids)
+        
+        def compute(user: Tuple[str, Optional[str]]) -> Tuple[str, Optional[Dict[str, Any]]]:
+            user_id, email = user
+            try:
+                return user_id, self._compute_user_features(user_id, as_of_date, db, cohort=cohort, email=email)
+            except Exception as e:
+                logger.error(f"Failed to compute features for user {user_id}: {str(e)}")
+                return user_id, None
+        
+        threads = min(settings.FEATURE_USER_THREADS, len(users))
+        if threads > 1:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                results = list(pool.map(compute, users))
+        else:
+            results = [compute(user) for user in users]
+        computed = {user_id: features for user_id, features in results if features is not None}
+        
+        self._upsert_user_features(as_of_date, computed, db)
+        return len(computed)
+    
+    def refresh_event_rollup(self, db: Session) -> None:
+        """
+        Bring mv_user_day_event_stats (database/event_rollups.sql) up to date with
+        REFRESH ... CONCURRENTLY, so readers keep the old rows until it commits.
+        """
+        db.connection().exec_driver_sql(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {_EVENT_ROLLUP.fullname}")
+        db.commit()
+
+    def rollup_daily_ir(self, db: Session, as_of_date: date) -> int:
+        """
+        Fold every not-yet-processed day of the window before `as_of_date` into
+        daily_user_ir (the whole window on the first run), and refold the last
+        _IR_REFOLD_DAYS days, which may have gained late events since their last fold.
+        Returns the number of days processed.
+        """
+        start = as_of_date - timedelta(days=_IR_WINDOW_DAYS)
+        rollup, ir = _EVENT_ROLLUP.c, _DAILY_IR.c
+        pending = db.query(rollup.day).filter(
+            rollup.day >= start,
+            rollup.day < as_of_date,
+            rollup.name.in_(_IR_EVENT_NAMES)
+        ).except_(
+            db.query(ir.day).filter(ir.day >= start, ir.day < as_of_date)
+        ).all()
+
+        trailing = {as_of_date - timedelta(days=n) for n in range(1, _IR_REFOLD_DAYS + 1)}
+        days = sorted({day for (day,) in pending} | trailing)
+        for day in days:
+            self._rollup_ir_day(db, day)
+        db.commit()
+        if days:
+            logger.info(f"Rolled up daily IR for {len(days)} day(s) through {days[-1]}")
+        return len(days)
+
+    def _rollup_ir_day(self, db: Session, day: date) -> None:
+        """Aggregate one day's events into daily_user_ir rows, replacing that day's previous fold."""
+        start = datetime.combine(day, datetime.min.time())
+        is_test = Event.name == 'test_attempt'
+        per_user: Dict[str, Dict[str, Any]] = {}
+        # Counted per (user, subject) in SQL on the denormalized subject column
+        for user_id, subject, events, tests, correct in db.query(
+            Event.user_id,
+            Event.subject,
+            func.count(Event.event_id),
+            func.count(Event.event_id).filter(is_test),
+            func.count(Event.event_id).filter(and_(is_test, Event.props['is_correct'].astext == 'true'))
+        ).filter(
+            Event.ts >= start,
+            Event.ts < start + timedelta(days=1),
+            Event.name.in_(_IR_EVENT_NAMES)
+        ).group_by(Event.user_id, Event.subject).all():
+            ir = per_user.setdefault(user_id, {'tests_correct_cnt': 0, 'tests_total_cnt': 0, 'subject_counts': {}})
+            ir['tests_total_cnt'] += tests
+            ir['tests_correct_cnt'] += correct
+            if subject:
+                ir['subject_counts'][subject] = events
+
+        db.execute(_DAILY_IR.delete().where(_DAILY_IR.c.day == day))
+        if not per_user:
+            return
+        stmt = pg_insert(_DAILY_IR).values([
+            {'user_id': user_id, 'day': day, **ir} for user_id, ir in per_user.items()
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=['user_id', 'day'],
+            set_={
+                'tests_correct_cnt': stmt.excluded.tests_correct_cnt,
+                'tests_total_cnt': stmt.excluded.tests_total_cnt,
+                'subject_counts': stmt.excluded.subject_counts,
+                'computed_at': func.now(),
+            },
+        ))
+
+    def _load_cohort_aggregates(self, as_of_date: date, db: Session,
+                                user_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Per-user scalar metrics for the whole cohort (or just `user_ids`), one
+        GROUP BY query per source. Returns {metric: {user_id: value}}; users
+        without rows are simply absent.
+        """
+        today = datetime.combine(as_of_date, datetime.min.time())
+        week_ago = today - timedelta(days=7)
+
+        def _cohort(col):
+            return (col.in_(user_ids),) if user_ids is not None else ()
+
+        # Recency and frequency come from the daily rollup: whole days before the as-of date.
+        # Recency is the day part of (as-of midnight - last event), computed server-side
+        rollup = _EVENT_ROLLUP.c
+        recency_days = {
+            uid: int(days)
+            for uid, days in db.query(
+                rollup.user_id,
+                func.extract('day', literal(today, DateTime) - func.max(rollup.last_ts))
+            ).filter(
+                *_cohort(rollup.user_id),
+                rollup.day < as_of_date
+            ).group_by(rollup.user_id).all()
+            if days is not None
+        }
+
+        # Frequency and test attempts over the last 7 days in one pass
+        activity = {
+            uid: (int(count or 0), int(tests or 0))
+            for uid, count, tests in db.query(
+                rollup.user_id,
+                func.sum(rollup.cnt),
+                func.sum(case((rollup.name == 'test_attempt', rollup.cnt), else_=0))
+            ).filter(
+                *_cohort(rollup.user_id),
+                rollup.day >= week_ago.date(),
+                rollup.day < as_of_date,
+                rollup.name.in_(_ACTIVITY_EVENT_NAMES)
+            ).group_by(rollup.user_id).all()
+        }
+
+        week_summaries = (
+            *_cohort(ConvoSummary.user_id),
+            ConvoSummary.started_at >= week_ago,
+            ConvoSummary.started_at <= today
+        )
+        sentiment = {
+            uid: float(avg)
+            for uid, avg in db.query(ConvoSummary.user_id, func.avg(ConvoSummary.sentiment))
+            .filter(*week_summaries).group_by(ConvoSummary.user_id).all()
+            if avg is not None
+        }
+
+        # Top topics: count topic mentions per user in SQL, keep the most frequent
+        topic_rows = db.query(
+            ConvoSummary.user_id.label('user_id'),
+            func.jsonb_array_elements_text(ConvoSummary.topics).label('topic')
+        ).filter(*week_summaries).subquery()
+        mentions = func.count().label('mentions')
+        top_topics: Dict[str, List[str]] = {}
+        for uid, topic, _ in db.query(topic_rows.c.user_id, topic_rows.c.topic, mentions).group_by(
+            topic_rows.c.user_id, topic_rows.c.topic
+        ).order_by(topic_rows.c.user_id, mentions.desc()).all():
+            picked = top_topics.setdefault(uid, [])
+            if len(picked) < _TOP_TOPICS_LIMIT:
+                picked.append(topic)
+
+        # Subject affinity (event part): daily IR subject counts, each day weighted by its age
+        # relative to the as-of date (up to ~30 days decay), summed per (user, subject) in SQL
+        ir = _DAILY_IR.c
+        ir_window = (ir.day >= as_of_date - timedelta(days=_IR_WINDOW_DAYS), ir.day < as_of_date)
+        day_subjects = func.jsonb_each_text(ir.subject_counts).table_valued('key', 'value').render_derived(name='kv')
+        subject = func.btrim(day_subjects.c.key)
+        weighted = func.sum(
+            cast(day_subjects.c.value, Float) * func.greatest(0.1, 1.0 - (as_of_date - ir.day) / 30.0)
+        )
+        subject_weights: Dict[str, Dict[str, float]] = {}
+        for uid, subj, weight in db.query(ir.user_id, subject, weighted).select_from(
+            _DAILY_IR, day_subjects
+        ).filter(
+            *_cohort(ir.user_id), *ir_window,
+            subject != ''
+        ).group_by(ir.user_id, subject).order_by(ir.user_id, weighted.desc()).all():
+            subject_weights.setdefault(uid, {})[subj] = float(weight or 0.0)
+
+        # Score trend: weekly test accuracy from daily IR, latest week minus earliest week
+        week = func.date_trunc('week', ir.day)
+        weekly = db.query(
+            ir.user_id,
+            week.label('week'),
+            (cast(func.sum(ir.tests_correct_cnt), Float) / func.sum(ir.tests_total_cnt)).label('accuracy'),
+            func.sum(ir.tests_total_cnt).label('tests')
+        ).filter(
+            *_cohort(ir.user_id), *ir_window,
+            ir.tests_total_cnt > 0
+        ).group_by(ir.user_id, week).subquery()
+        score_trend = {
+            uid: float(trend)
+            for uid, trend in db.query(
+                weekly.c.user_id,
+                array_agg(aggregate_order_by(weekly.c.accuracy, weekly.c.week.desc()))[1]
+                - array_agg(aggregate_order_by(weekly.c.accuracy, weekly.c.week))[1]
+            ).group_by(weekly.c.user_id).having(
+                func.sum(weekly.c.tests) >= _SCORE_TREND_MIN_TESTS,
+                func.count() >= 2
+            ).all()
+        }
+
+        # Email fatigue: sends in the last 7 days and the latest send
+        emails = {
+            uid: (count or 0, last_ts)
+            for uid, count, last_ts in db.query(
+                EmailSend.user_id, func.count(EmailSend.send_id), func.max(EmailSend.ts)
+            ).filter(
+                *_cohort(EmailSend.user_id),
+                EmailSend.ts >= week_ago,
+                EmailSend.ts <= today
+            ).group_by(EmailSend.user_id).all()
+        }
+
+        unsubscribed = {
+            uid for (uid,) in db.query(Unsubscribe.user_id).filter(*_cohort(Unsubscribe.user_id)).distinct()
+        }
+
+        # Conversation summary topics over the last 30 days, one list per summary (affinity
+        # supplement); users with any summary here are never "inactive"
+        summary_topics: Dict[str, List[List[str]]] = {}
+        for uid, topics in db.query(ConvoSummary.user_id, ConvoSummary.topics).filter(
+            *_cohort(ConvoSummary.user_id),
+            ConvoSummary.started_at >= today - timedelta(days=30),
+            ConvoSummary.started_at <= today
+        ).all():
+            summary_topics.setdefault(uid, []).append(topics or [])
+
+        # Presentation minutes: start -> end span per presentation, capped, summed per user in SQL
+        trigger = Event.props['trigger'].astext
+        span = func.max(Event.ts).filter(trigger == 'end') - func.min(Event.ts).filter(trigger == 'start')
+        per_presentation = db.query(
+            Event.user_id.label('user_id'),
+            func.least(_PRESENTATION_MAX_MINUTES, func.greatest(0, func.extract('epoch', span) / 60)).label('minutes')
+        ).filter(
+            *_cohort(Event.user_id),
+            Event.ts >= week_ago,
+            Event.ts <= today,
+            Event.name == 'presentation_progress'
+        ).group_by(Event.user_id, Event.presentation_id).subquery()
+        presentation_minutes = {
+            uid: int(minutes or 0)
+            for uid, minutes in db.query(per_presentation.c.user_id, func.sum(per_presentation.c.minutes))
+            .group_by(per_presentation.c.user_id).all()
+        }
+
+        # Raw 7-day events for the per-user analyzers (login minutes, conversation analysis,
+        # ICP progress): one query for the cohort, bucketed by (user_id, kind). ICP events
+        # keep their whole props; the others carry only the keys their readers use. Rows
+        # are streamed so the driver never holds the cohort's whole result set at once
+        is_icp = Event.name == 'icp_progress'
+        recent_events: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for row in db.query(
+            Event.user_id, Event.name, Event.ts,
+            *(Event.props[k].label(k) for k in _LOGIN_PROPS_KEYS),
+            *(Event.props[k].astext.label(k) for k in _CONVO_PROPS_KEYS),
+            case((is_icp, Event.props)).label('icp_props')
+        ).filter(
+            *_cohort(Event.user_id),
+            Event.ts >= week_ago,
+            Event.ts <= today,
+            Event.name.in_(_LOGIN_EVENT_NAMES + ('convo_msg', 'icp_progress'))
+        ).yield_per(_EVENT_STREAM_PAGE):
+            if row.name == 'convo_msg':
+                recent_events.setdefault((row.user_id, 'convo'), []).append(
+                    {'ts': row.ts, 'props': _projected_props(row, _CONVO_PROPS_KEYS)}
+                )
+            elif row.name == 'icp_progress':
+                recent_events.setdefault((row.user_id, 'icp'), []).append(
+                    {'ts': row.ts, 'props': row.icp_props or {}}
+                )
+            else:
+                recent_events.setdefault((row.user_id, 'login'), []).append(
+                    {'props': _projected_props(row, _LOGIN_PROPS_KEYS)}
+                )
+
+        return {
+            'recency_days': recency_days,
+            'activity': activity,
+            'sentiment': sentiment,
+            'top_topics': top_topics,
+            'emails': emails,
+            'unsubscribed': unsubscribed,
+            'presentation_minutes': presentation_minutes,
+            'subject_weights': subject_weights,
+            'score_trend': score_trend,
+            'summary_topics': summary_topics,
+            'recent_events': recent_events,
+        }
+
+    def _compute_user_features(self, user_id: str, as_of_date: date, db: Session,
+                               cohort: Optional[Dict[str, Any]] = None,
+                               email: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Compute features for a specific user. `cohort` is the _load_cohort_aggregates()
+        result for a batch run; without it the aggregates are loaded for this user alone.
+        """
         
         # Date ranges
         today = datetime.combine(as_of_date, datetime.min.time())
         week_ago = today - timedelta(days=7)
-        month_ago = today - timedelta(days=30)
+        
+        if cohort is None:
+            cohort = self._load_cohort_aggregates(as_of_date, db, user_ids=[user_id])
+            try:
+                email = email or db.query(AppUser.email).filter(AppUser.user_id == user_id).scalar()
+            except Exception:
+                email = None
         
         # Recency: days since last activity
-        last_activity = db.query(func.max(Event.ts)).filter(
-            Event.user_id == user_id,
-            Event.ts <= today
-        ).scalar()
+        recency_days = cohort['recency_days'].get(user_id, 999)
         
-        recency_days = (today - last_activity).days if last_activity else 999
+        # Inactive users: every windowed input is empty, so skip straight to the defaults
+        if (recency_days > _INACTIVE_AFTER_DAYS
+                and user_id not in cohort['emails']
+                and user_id not in cohort['summary_topics']):
+            return self._inactive_user_features(user_id, recency_days, week_ago, cohort)
         
-        # Frequency: activity count in last 7 days
-        frequency_7d = db.query(func.count(Event.event_id)).filter(
-            Event.user_id == user_id,
-            Event.ts >= week_ago,
-            Event.ts <= today,
-            Event.name.in_(['login', 'convo_msg', 'test_attempt', 'presentation_progress'])
-        ).scalar() or 0
+        # Frequency: activity count in last 7 days (plus test attempts, the tests_7d fallback)
+        frequency_7d, test_attempts_7d = cohort['activity'].get(user_id, (0, 0))
         
+        # Raw 7-day events, prefetched for the cohort as lightweight {'ts', 'props'} dicts
+        recent_events = cohort['recent_events']
         # Minutes spent in last 7 days (from login session durations)
-        login_events = db.query(Event).filter(
-            Event.user_id == user_id,
-            Event.ts >= week_ago,
-            Event.ts <= today,
-            Event.name.in_(['login_session', 'login'])  # <-- include both
-        ).all()
-        
-        # Fallback data: recent convo messages (to estimate time if session times are missing)
-        convo_events_recent = db.query(Event).filter(
-            Event.user_id == user_id,
-            Event.ts >= week_ago,
-            Event.ts <= today,
-            Event.name == 'convo_msg'
-        ).all()
+        login_events = recent_events.get((user_id, 'login'), [])
+        # Recent convo messages: AI analysis below, and the minutes fallback when session times are missing
+        convo_events = recent_events.get((user_id, 'convo'), [])
 
-        minutes_7d = self._calculate_login_minutes(login_events, convo_events_recent) 
+        minutes_7d = self._calculate_login_minutes(login_events, convo_events) 
+        presentation_minutes_7d = cohort['presentation_minutes'].get(user_id, 0)
         
-        # Tests created in last 7 days from DynamoDB User_Infinite_TestSeries_Prod by created_on
-        tests_7d = 0
-        try:
-            user_row = db.query(AppUser).filter(AppUser.user_id == user_id).first()
-            user_email = getattr(user_row, "email", None) if user_row else None
-            if user_email:
-                tests_7d = self._count_tests_7d_dynamo(user_email)
-            else:
-                tests_7d = db.query(func.count(Event.event_id)).filter(
-                    Event.user_id == user_id,
-                    Event.ts >= week_ago,
-                    Event.ts <= today,
-                    Event.name == 'test_attempt'
-                ).scalar() or 0
-        except Exception:
-            tests_7d = db.query(func.count(Event.event_id)).filter(
-                Event.user_id == user_id,
-                Event.ts >= week_ago,
-                Event.ts <= today,
-                Event.name == 'test_attempt'
-            ).scalar() or 0
+        # Tests created in last 7 days from DynamoDB User_Infinite_TestSeries_Prod by created_on;
+        # without an email, fall back to test_attempt events
+        tests_7d = test_attempts_7d
+        if email:
+            try:
+                tests_7d = self._count_tests_7d_dynamo(email)
+            except Exception:
+                pass
         
         # Average score change over 30 days
-        avg_score_change_30d = self._calculate_score_trend(user_id, month_ago, today, db)
+        avg_score_change_30d = cohort['score_trend'].get(user_id, 0.0)
         
         # Top topics from recent conversations
-        top_topics = self._get_top_topics(user_id, week_ago, today, db)
+        top_topics = cohort['top_topics'].get(user_id, [])
         
         # Subject affinity
-        subject_affinity = self._calculate_subject_affinity(user_id, month_ago, today, db)
+        subject_affinity = self._calculate_subject_affinity(
+            cohort['subject_weights'].get(user_id, {}), cohort['summary_topics'].get(user_id, [])
+        )
         
         # Conversation sentiment (7-day average)
-        convo_sentiment_7d_avg = self._calculate_sentiment_avg(user_id, week_ago, today, db)
+        convo_sentiment_7d_avg = cohort['sentiment'].get(user_id, 0.0)
         
         # Email fatigue metrics
-        last_email_ts, emails_sent_7d = self._get_email_metrics(user_id, week_ago, today, db)
+        emails_sent_7d, last_email_ts = cohort['emails'].get(user_id, (0, None))
         
         # Check unsubscribe status
-        unsubscribed = self._check_unsubscribe_status(user_id, db)
+        unsubscribed = user_id in cohort['unsubscribed']
         
-        icp_events = db.query(Event).filter(
-            Event.user_id == user_id,
-            Event.ts >= week_ago,
-            Event.ts <= today,
-            Event.name == 'icp_progress'
-        ).all()
+        icp_events = recent_events.get((user_id, 'icp'), [])
         
         icp_features = self._analyze_icp_completion(icp_events)
         
-        convo_events = db.query(Event).filter(
-            Event.user_id == user_id,
-            Event.ts >= week_ago,
-            Event.ts <= today,
-            Event.name == 'convo_msg'
-        ).all()
-        
         convo_features = self._analyze_conversations_with_ai(convo_events, week_ago)
 
         # === Trigger convenience booleans for rules engine (DB path) ===
-        trigs = (convo_features or {}).get('ai_email_triggers', []) or []
-        def _is_dict(d): return isinstance(d, dict)
-        has_exam_last_minute_prep = any(
-            _is_dict(t) and (
-                t.get('message_type') == 'last_minute_prep' or
-                (t.get('trigger') in ('exam_prep', 'pre_exam'))
-            ) for t in trigs
-        )
-        has_exam_post_checkin = any(
-            _is_dict(t) and (
-                t.get('message_type') == 'how_did_it_go' or
-                (t.get('trigger') in ('post_exam', 'exam_followup'))
-            ) for t in trigs
-        )
-        has_learning_support = any(
-            _is_dict(t) and (
-                t.get('trigger') == 'learning_support' or
-                t.get('trigger_type') == 'learning_support'
-            ) for t in trigs
-        )
+        trigger_flags = _trigger_flags((convo_features or {}).get('ai_email_triggers', []) or [])
         
         features_db = {
             'recency_days': recency_days,
             'frequency_7d': frequency_7d,
             'minutes_7d': minutes_7d,
+            'presentation_minutes_7d': presentation_minutes_7d,
             'tests_7d': tests_7d,
             'avg_score_change_30d': avg_score_change_30d,
             'top_topics': top_topics,
@@ -472,9 +843,7 @@ class FeatureEngine:
             'unsubscribed': unsubscribed,
             **icp_features,
             **convo_features,
-            'has_exam_last_minute_prep': has_exam_last_minute_prep,
-            'has_exam_post_checkin': has_exam_post_checkin,
-            'has_learning_support': has_learning_support,
+            **trigger_flags,
         }
         # Merge ITP/ICP analyzer outputs for ORM path as well
         try:
@@ -485,7 +854,35 @@ class FeatureEngine:
             logger.error(f"ITP/ICP analyzer failed (ORM path) for {user_id}: {e}")
         return features_db
     
-    def _calculate_login_minutes(self, login_events: List[Any], convo_events_recent: Optional[List[Any]] = None) -> int:
+    def _inactive_user_features(self, user_id: str, recency_days: int, week_ago: datetime,
+                                cohort: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Minimal feature row for a user with no events, emails or summaries in the window:
+        what _compute_user_features yields from empty inputs, without its per-user queries,
+        DynamoDB test count or ITP/ICP analysis.
+        """
+        return {
+            'recency_days': recency_days,
+            'frequency_7d': 0,
+            'minutes_7d': 0,
+            'presentation_minutes_7d': 0,
+            'tests_7d': 0,
+            'avg_score_change_30d': 0.0,
+            'top_topics': [],
+            'subject_affinity': {},
+            'convo_sentiment_7d_avg': 0.0,
+            'churn_risk': self._assess_churn_risk(recency_days, 0, 0.0),
+            'last_email_ts': None,
+            'emails_sent_7d': 0,
+            'unsubscribed': user_id in cohort['unsubscribed'],
+            **self._analyze_icp_completion([]),
+            **self._analyze_conversations_with_ai([], week_ago),
+            'has_exam_last_minute_prep': False,
+            'has_exam_post_checkin': False,
+            'has_learning_support': False,
+        }
+    
+    def _calculate_login_minutes(self, login_events: List[Dict[str, Any]], convo_events_recent: Optional[List[Dict[str, Any]]] = None) -> int:
         """
         Calculate total minutes from login session durations (DB path).
         - Supports:
@@ -496,14 +893,9 @@ class FeatureEngine:
         Caps each session at 180 minutes.
         """
         total_minutes = 0
-        sessions = {}
 
         for event in login_events or []:
-            props = getattr(event, 'props', {}) or {}
-            session_id = props.get('session_id') or props.get('SessionID') or getattr(event, 'event_id', None)
-
-            if session_id and session_id not in sessions:
-                sessions[session_id] = {'start': None, 'end': None, 'added': False}
+            props = event.get('props') or {}
 
             # 1) Nested Session object
             sess = props.get('Session') or {}
@@ -511,38 +903,25 @@ class FeatureEngine:
                 start_time = sess.get('start_time') or sess.get('start') or sess.get('login_time')
                 end_time   = sess.get('end_time')   or sess.get('end')   or sess.get('logout_time')
                 if start_time and end_time:
-                    try:
-                        from datetime import datetime
-                        start_dt = datetime.fromisoformat(str(start_time).replace('Z', '+00:00'))
-                        end_dt   = datetime.fromisoformat(str(end_time).replace('Z', '+00:00'))
-                        duration = max(0.0, (end_dt - start_dt).total_seconds() / 60.0)
-                        total_minutes += min(duration, 180)
-                        if session_id: sessions[session_id]['added'] = True
+                    minutes = _session_minutes(start_time, end_time)
+                    if minutes is not None:
+                        total_minutes += minutes
                         continue
-                    except Exception:
-                        pass
 
             # 2) Explicit times on props
             login_time  = props.get('login_time')
             logout_time = props.get('logout_time')
             if login_time and logout_time:
-                try:
-                    from datetime import datetime
-                    start_dt = datetime.fromisoformat(str(login_time).replace('Z', '+00:00'))
-                    end_dt   = datetime.fromisoformat(str(logout_time).replace('Z', '+00:00'))
-                    duration = max(0.0, (end_dt - start_dt).total_seconds() / 60.0)
-                    total_minutes += min(duration, 180)
-                    if session_id: sessions[session_id]['added'] = True
+                minutes = _session_minutes(login_time, logout_time)
+                if minutes is not None:
+                    total_minutes += minutes
                     continue
-                except Exception:
-                    pass
 
             # 3) Precomputed duration
             dur = props.get('session_duration_minutes') or props.get('duration_minutes')
             if dur is not None:
                 try:
-                    total_minutes += min(float(dur), 180)
-                    if session_id: sessions[session_id]['added'] = True
+                    total_minutes += min(float(dur), _SESSION_MAX_MINUTES)
                     continue
                 except Exception:
                     pass
@@ -552,7 +931,7 @@ class FeatureEngine:
         if total_minutes == 0 and convo_events_recent:
             conv_msgs = 0
             for ev in convo_events_recent:
-                p = getattr(ev, 'props', {}) or {}
+                p = ev.get('props') or {}
                 # count only user messages if 'role' is available; otherwise count all
                 role = (p.get('role') or '').lower()
                 if not role or role == 'user':
@@ -562,215 +941,75 @@ class FeatureEngine:
 
         return int(total_minutes)
 
-    def _calculate_score_trend(self, user_id: str, start_date: datetime, end_date: datetime, db: Session) -> float:
-        """Calculate average score change trend"""
-        test_events = db.query(Event).filter(
-            Event.user_id == user_id,
-            Event.ts >= start_date,
-            Event.ts <= end_date,
-            Event.name == 'test_attempt'
-        ).order_by(Event.ts).all()
-        
-        if len(test_events) < 5:
-            return 0.0
-        
-        # Calculate weekly averages
-        weekly_scores = {}
-        for event in test_events:
-            week = event.ts.isocalendar()[1]
-            is_correct = event.props.get('is_correct', False)
-            
-            if week not in weekly_scores:
-                weekly_scores[week] = []
-            weekly_scores[week].append(1.0 if is_correct else 0.0)
-        
-        # Calculate trend
-        week_averages = []
-        for week in sorted(weekly_scores.keys()):
-            avg_score = sum(weekly_scores[week]) / len(weekly_scores[week])
-            week_averages.append(avg_score)
-        
-        if len(week_averages) < 2:
-            return 0.0
-        
-        # Simple linear trend
-        return week_averages[-1] - week_averages[0]
-    
-    def _get_top_topics(self, user_id: str, start_date: datetime, end_date: datetime, db: Session) -> List[str]:
-        """Get top topics from recent conversations"""
-        summaries = db.query(ConvoSummary).filter(
-            ConvoSummary.user_id == user_id,
-            ConvoSummary.started_at >= start_date,
-            ConvoSummary.started_at <= end_date
-        ).all()
-        
-        topic_counts = {}
-        for summary in summaries:
-            for topic in summary.topics or []:
-                topic_counts[topic] = topic_counts.get(topic, 0) + 1
-        
-        # Return top 5 topics
-        sorted_topics = sorted(topic_counts.items(), key=lambda x: x[1], reverse=True)
-        return [topic for topic, count in sorted_topics[:5]]
-    
-    def _calculate_subject_affinity(self, user_id: str, start_date: datetime, end_date: datetime, db: Session) -> Dict[str, float]:
+    def _calculate_subject_affinity(self, subject_weights: Dict[str, float],
+                                    summary_topics: List[List[str]]) -> Dict[str, float]:
         """
         Calculate subject affinity from a mix of signals:
-        - Event.props['subject'] | 'Subject' | 'course_subject' | 'course' | derived from 'topic' like "Biology>Cells"
+        - recency-weighted event subject counts (daily IR, summed in SQL by the cohort load)
         - ConvoSummary.topics (fallback / supplement)
-        Weighted by recency (last 30 days heavier).
         """
-        from datetime import datetime
-        events = db.query(Event).filter(
-            Event.user_id == user_id,
-            Event.ts >= start_date,
-            Event.ts <= end_date,
-            Event.name.in_(['test_attempt', 'presentation_progress', 'convo_msg'])
-        ).all()
-
-        subject_time: Dict[str, float] = {}
-        total_time = 0.0
+        subject_time: Dict[str, float] = defaultdict(float)
 
         def bump(subj: Optional[str], weight: float):
-            nonlocal total_time
             if not subj:
                 return
             s = subj.strip()
-            if not s:
-                return
-            subject_time[s] = subject_time.get(s, 0.0) + weight
-            total_time += weight
-
-        # --- From events
-        now = datetime.utcnow()
-        for ev in events:
-            props = getattr(ev, 'props', {}) or {}
-            # known fields
-            subj = (
-                props.get('subject')
-                or props.get('Subject')
-                or props.get('course_subject')
-                or props.get('course')
-            )
-            # derive from topic like "Biology>Cells"
-            if not subj:
-                topic = props.get('topic') or props.get('Topic')
-                if isinstance(topic, str) and '>' in topic:
-                    subj = topic.split('>')[0].strip()
-            # derive from convo content tag if you store something like props['subject_tag']
-            if not subj:
-                subj = props.get('subject_tag')
-
-            # recency weight: up to ~30 days decay
-            ts = getattr(ev, 'ts', None)
-            days_ago = (now - ts).days if isinstance(ts, datetime) else 0
-            weight = max(0.1, 1.0 - (days_ago / 30.0))
+            if s:
+                subject_time[s] += weight
 
+        # --- From events: already weighted by recency (last 30 days heavier)
+        for subj, weight in subject_weights.items():
             bump(subj, weight)
 
-        # --- Supplement with ConvoSummary.topics if sparse
-        summaries = db.query(ConvoSummary).filter(
-            ConvoSummary.user_id == user_id,
-            ConvoSummary.started_at >= start_date,
-            ConvoSummary.started_at <= end_date
-        ).all()
-
-        for s in summaries:
-            for t in (s.topics or []):
+        # --- Supplement with ConvoSummary.topics (prefetched for the cohort) if sparse
+        for topics in summary_topics:
+            for t in topics:
                 # t could be "Biology>Cells" or a bare subject word
                 subj = t.split('>')[0].strip() if isinstance(t, str) and '>' in t else t
                 # lighter weight than explicit event-subject, but still counts
                 bump(subj, 0.5)
 
+        # normalize
+        total_time = sum(subject_time.values())
         if total_time <= 0:
             return {}
-
-        # normalize
         return {k: v / total_time for k, v in subject_time.items()}
 
-    def _calculate_sentiment_avg(self, user_id: str, start_date: datetime, end_date: datetime, db: Session) -> float:
-        """Calculate average conversation sentiment"""
-        summaries = db.query(ConvoSummary).filter(
-            ConvoSummary.user_id == user_id,
-            ConvoSummary.started_at >= start_date,
-            ConvoSummary.started_at <= end_date
-        ).all()
-        
-        if not summaries:
-            return 0.0
-        
-        sentiments = [float(summary.sentiment) for summary in summaries if summary.sentiment is not None]
-        return sum(sentiments) / len(sentiments) if sentiments else 0.0
-    
     def _assess_churn_risk(self, recency_days: int, frequency_7d: int, sentiment: float) -> str:
-        """Assess churn risk based on engagement metrics"""
-        risk_score = 0
-        
-        # Recency factor
-        if recency_days > 7:
-            risk_score += 2
-        elif recency_days > 3:
-            risk_score += 1
-        
-        # Frequency factor
-        if frequency_7d < 2:
-            risk_score += 2
-        elif frequency_7d < 5:
-            risk_score += 1
-        
-        # Sentiment factor
-        if sentiment < -0.3:
-            risk_score += 2
-        elif sentiment < 0:
-            risk_score += 1
-        
-        if risk_score >= 4:
-            return 'high'
-        elif risk_score >= 2:
-            return 'medium'
-        else:
-            return 'low'
-    
-    def _get_email_metrics(self, user_id: str, start_date: datetime, end_date: datetime, db: Session) -> tuple:
-        """Get email sending metrics"""
-        emails = db.query(EmailSend).filter(
-            EmailSend.user_id == user_id,
-            EmailSend.ts >= start_date,
-            EmailSend.ts <= end_date
-        ).all()
-        
-        emails_sent_7d = len(emails)
-        last_email_ts = max([email.ts for email in emails]) if emails else None
-        
-        return last_email_ts, emails_sent_7d
-    
-    def _check_unsubscribe_status(self, user_id: str, db: Session) -> bool:
-        """Check if user has unsubscribed"""
-        unsubscribe = db.query(Unsubscribe).filter(Unsubscribe.user_id == user_id).first()
-        return unsubscribe is not None
+        """Assess churn risk based on engagement metrics (0-2 points per factor)"""
+        risk_score = (
+            sum(recency_days > t for t in _CHURN_RECENCY_DAYS)
+            + sum(frequency_7d < t for t in _CHURN_FREQUENCY_7D)
+            + sum(sentiment < t for t in _CHURN_SENTIMENT)
+        )
+        return _CHURN_LEVELS[min(2, risk_score // 2)]
     
-    def _upsert_user_features(self, user_id: str, as_of_date: date, features: Dict[str, Any], db: Session):
-        """Insert or update user daily features"""
-        existing = db.query(UserDailyFeatures).filter(
-            UserDailyFeatures.user_id == user_id,
-            UserDailyFeatures.as_of == as_of_date
-        ).first()
-        
-        if existing:
-            for key, value in features.items():
-                if hasattr(existing, key):
-                    setattr(existing, key, value)
-        else:
-            new_features = UserDailyFeatures(
-                user_id=user_id,
-                as_of=as_of_date,
-                **features
-            )
-            db.add(new_features)
+    def _upsert_user_features(self, as_of_date: date, features_by_user: Dict[str, Dict[str, Any]], db: Session):
+        """
+        Insert or update user daily features for many users with INSERT ... ON CONFLICT
+        (user_id, as_of) DO UPDATE, one statement per _UPSERT_PAGE_SIZE users.
+        Feature keys without a UserDailyFeatures column are ignored.
+        """
+        columns = [c for c in UserDailyFeatures.__table__.columns.keys() if c not in ('user_id', 'as_of')]
+        present = [c for c in columns if any(c in f for f in features_by_user.values())]
+        if not present:
+            return
+        rows = [
+            {'user_id': user_id, 'as_of': as_of_date, **{c: features.get(c) for c in present}}
+            for user_id, features in features_by_user.items()
+        ]
+        for start in range(0, len(rows), _UPSERT_PAGE_SIZE):
+            stmt = pg_insert(UserDailyFeatures).values(rows[start:start + _UPSERT_PAGE_SIZE])
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=['user_id', 'as_of'],
+                set_={c: stmt.excluded[c] for c in present}
+            ))
     
     def _analyze_itp_performance(self, test_events: List[Dict], week_ago: datetime) -> Dict[str, Any]:
         """
-        Analyze ITP (Infinite Test Series) performance with detailed scoring from real data structure
+        Analyze ITP (Infinite Test Series) performance with detailed scoring from real data structure.
+        Each event's props carry 'Subject' and 'Response': {timestamp: [{'Response', 'Correct_Response'}, ...]}
+        as written by DataProcessor; an event that does not fit that shape is skipped from where it breaks.
         """
         if not test_events:
             return {
@@ -782,50 +1021,46 @@ class FeatureEngine:
                 'strong_subjects': []
             }
         
-        all_responses = []
-        subject_performance = {}
+        # One flat 1/0 correctness list (response order) plus per-subject lists; the
+        # reductions below are plain sums over ints
+        correct: List[int] = []
+        subject_performance: Dict[str, List[int]] = defaultdict(list)
         recent_tests = 0
+        week_ago_naive = week_ago.replace(tzinfo=None)
+        # Whole-second keys compare against the cutoff rounded up to the next second
+        week_ago_key = (
+            week_ago_naive.replace(microsecond=0) + timedelta(seconds=1 if week_ago_naive.microsecond else 0)
+        ).strftime(_ITP_TS_FORMAT)
         
         for event in test_events:
             props = event['props']
+            subject = props.get('Subject', 'Unknown')
             
-            # Extract Response data (array of test attempts)
-            responses = props.get('Response', {})
-            if isinstance(responses, dict):
-                for timestamp, response_list in responses.items():
-                    if isinstance(response_list, list):
-                        for response in response_list:
-                            if isinstance(response, dict):
-                                correct_response = response.get('Correct_Response')
-                                user_response = response.get('Response')
-                                subject = props.get('Subject', 'Unknown')
-                                
-                                # Calculate if answer was correct
-                                is_correct = (correct_response == user_response) if correct_response is not None else False
-                                
-                                all_responses.append({
-                                    'is_correct': is_correct,
-                                    'subject': subject,
-                                    'timestamp': timestamp,
-                                    'question': response.get('Question', ''),
-                                    'correct_response': correct_response,
-                                    'user_response': user_response
-                                })
-                                
-                                # Track subject performance
-                                if subject not in subject_performance:
-                                    subject_performance[subject] = []
-                                subject_performance[subject].append(1 if is_correct else 0)
-                                
-                                # Count recent tests (last 7 days)
-                                try:
-                                    response_date = datetime.strptime(timestamp, '%Y-%m-%d,%H:%M:%S')
-                                    if response_date >= week_ago.replace(tzinfo=None):
-                                        recent_tests += 1
-                                except:
-                                    pass
-        
-        if not all_responses:
+            # Extract Response data (array of test attempts); shape is trusted, malformed
+            # payloads surface as AttributeError/TypeError and end this event
+            try:
+                for timestamp, response_list in (props.get('Response') or {}).items():
+                    # Responses under one timestamp key share it: check once per key, not per response.
+                    # Well-formed keys compare as strings; anything else goes through strptime
+                    if len(timestamp) == _ITP_TS_LEN and timestamp[10] == ',':
+                        is_recent = timestamp >= week_ago_key
+                    else:
+                        try:
+                            is_recent = datetime.strptime(timestamp, _ITP_TS_FORMAT) >= week_ago_naive
+                        except Exception:
+                            is_recent = False
+                    for response in response_list:
+                        correct_response = response.get('Correct_Response')
+                        hit = 1 if correct_response is not None and correct_response == response.get('Response') else 0
+                        correct.append(hit)
+                        subject_performance[subject].append(hit)
+                        # Count recent tests (last 7 days)
+                        if is_recent:
+                            recent_tests += 1
+            except (AttributeError, TypeError):
+                logger.debug("Skipping malformed ITP Response payload for subject %s", subject)
+        
+        if not correct:
             return {
                 'test_accuracy': 0.0,
                 'tests_7d': 0,
@@ -836,19 +1071,21 @@ class FeatureEngine:
             }
         
         # Calculate accuracy
-        correct_count = sum(1 for r in all_responses if r['is_correct'])
-        accuracy = correct_count / len(all_responses)
+        total = len(correct)
+        total_correct = sum(correct)
+        accuracy = total_correct / total
         
         # Calculate average score (percentage correct)
         avg_score = accuracy * 100
         
-        # Calculate improvement trend (recent vs older performance)
-        if len(all_responses) >= 10:
-            recent_half = all_responses[-len(all_responses)//2:]
-            older_half = all_responses[:len(all_responses)//2]
+        # Calculate improvement trend (recent vs older performance): the halves split at
+        # `mid` (the recent one takes the odd response), recent = total minus older
+        if total >= 10:
+            mid = total // 2
+            older_correct = sum(correct[:mid])
             
-            recent_accuracy = sum(1 for r in recent_half if r['is_correct']) / len(recent_half)
-            older_accuracy = sum(1 for r in older_half if r['is_correct']) / len(older_half)
+            recent_accuracy = (total_correct - older_correct) / (total - mid)
+            older_accuracy = older_correct / mid
             improvement_trend = (recent_accuracy - older_accuracy) * 100
         else:
             improvement_trend = 0.0
@@ -881,23 +1118,25 @@ class FeatureEngine:
           - id/title + ts
         Works with either dict events ({'props': ..., 'ts': ...}) or ORM Event objects (.props, .ts).
         """
-        def _get(ev, key, default=None):
-            return ev.get(key, default) if isinstance(ev, dict) else getattr(ev, key, default)
-
-        def _get_props(ev) -> Dict[str, Any]:
-            p = _get(ev, 'props')
-            return p or {}
+        # One clock read: the unparseable-ts fallback, the 7-day window and the stall check
+        now = datetime.now(timezone.utc)
+        week_ago = now - timedelta(days=7)
 
-        def _get_event_time(ev) -> datetime:
-            ts = _get(ev, 'ts')
+        def _parse_time(ts) -> datetime:
             if isinstance(ts, datetime):
                 return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
             if isinstance(ts, str):
                 try:
-                    return datetime.fromisoformat(ts.replace('Z', '+00:00'))
+                    return _parse_event_ts(ts)
                 except Exception:
-                    return datetime.now(timezone.utc)
-            return datetime.now(timezone.utc)
+                    return now
+            return now
+
+        def _aware_time(ts) -> datetime:
+            try:
+                return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+            except AttributeError:  # not a datetime after all
+                return _parse_time(ts)
 
         if not icp_events:
             return {
@@ -909,17 +1148,22 @@ class FeatureEngine:
                 'recent_progress': False
             }
 
-        week_ago = datetime.now(timezone.utc) - timedelta(days=7)
+        # One call gets one kind of event (all dicts or all ORM rows) and, in practice, one ts
+        # type: pick the accessor and the timestamp conversion once from the first event
+        first = icp_events[0]
+        _get = dict.get if isinstance(first, dict) else (lambda ev, key: getattr(ev, key, None))
+        _to_time = _aware_time if isinstance(_get(first, '_ts') or _get(first, 'ts'), datetime) else _parse_time
+
         course_progress: Dict[str, Dict[str, Any]] = {}
 
         # Use the latest event per course_id
         for ev in icp_events:
-            props = _get_props(ev)
+            props = _get(ev, 'props') or {}
             if not props:
                 continue
 
             course_id = props.get('id') or props.get('course_id') or 'unknown'
-            event_time = _get_event_time(ev)
+            event_time = _to_time(_get(ev, '_ts') or _get(ev, 'ts'))
 
             total_sections = int(props.get('total_sections') or 0)
             completed_sections = int(props.get('completed_sections') or 0)
@@ -963,7 +1207,6 @@ class FeatureEngine:
         stalled_courses: List[str] = []
         recent_progress = any(c['recent_activity'] for c in course_progress.values())
 
-        now = datetime.now(timezone.utc)
         for cid, c in course_progress.items():
             total = c['total_sections'] or 0
             comp = c['completed_sections'] or 0
@@ -997,7 +1240,7 @@ class FeatureEngine:
         """
         Calculate learning minutes from login session durations in InvestorLoginHistory_Prod
         """
-        recent_events = [e for e in login_events if datetime.fromisoformat(e['ts'].replace('Z', '+00:00')) >= since_date]
+        recent_events = [e for e in login_events if _event_ts(e) >= since_date]
         
         total_minutes = 0
         for event in recent_events:
@@ -1013,27 +1256,17 @@ class FeatureEngine:
                 start_time = session_start.get('start_time')
                 end_time = session_start.get('end_time')
                 if start_time and end_time:
-                    try:
-                        start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                        end_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                        duration_minutes = (end_dt - start_dt).total_seconds() / 60
-                        total_minutes += max(0, min(duration_minutes, 180))  # Cap at 3 hours
+                    minutes = _session_minutes(start_time, end_time)
+                    if minutes is not None:
+                        total_minutes += minutes
                         continue
-                    except:
-                        pass
             
             if session_duration:
                 # If duration is already calculated, use it
-                total_minutes += min(float(session_duration), 180)  # Cap at 3 hours per session
+                total_minutes += min(float(session_duration), _SESSION_MAX_MINUTES)
             elif login_time and logout_time:
                 # Calculate duration from timestamps
-                try:
-                    login_dt = datetime.fromisoformat(login_time.replace('Z', '+00:00'))
-                    logout_dt = datetime.fromisoformat(logout_time.replace('Z', '+00:00'))
-                    duration_minutes = (logout_dt - login_dt).total_seconds() / 60
-                    total_minutes += max(0, min(duration_minutes, 180))  # Cap at 3 hours
-                except:
-                    pass
+                total_minutes += _session_minutes(login_time, logout_time) or 0
             else:
                 conversation_count = len(props.get('data', []))  # Count conversation messages
                 device_info = props.get('device_info', {})
@@ -1062,11 +1295,15 @@ class FeatureEngine:
                 return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
             if isinstance(ts, str):
                 try:
-                    return datetime.fromisoformat(ts.replace('Z', '+00:00'))
+                    return _parse_event_ts(ts)
                 except Exception:
                     return datetime.now(timezone.utc)
             return datetime.now(timezone.utc)
 
+        # Message times are aware (timestamptz rows, parsed ISO strings); so is the cutoff
+        if week_ago.tzinfo is None:
+            week_ago = week_ago.replace(tzinfo=timezone.utc)
+
         if not convo_events:
             return {
                 'conversations_7d': 0,
@@ -1076,10 +1313,14 @@ class FeatureEngine:
                 'conversation_insights': {}
             }
 
-        # Keep only user messages within 7d, then sort by time
-        user_messages = [e for e in convo_events if e['props'].get('role') == 'user']
-        recent_messages = [e for e in user_messages if _parse_ts(e['ts']) >= week_ago]
-        if not recent_messages:
+        # Keep only user messages within 7d, then sort by time; each timestamp is parsed
+        # once and carried alongside its message for both the filter and the sort
+        timed = [
+            (_parse_ts(e.get('_ts') or e['ts']), e)
+            for e in convo_events if e['props'].get('role') == 'user'
+        ]
+        timed = [p for p in timed if p[0] >= week_ago]
+        if not timed:
             return {
                 'conversations_7d': 0,
                 'top_topics': [],
@@ -1087,7 +1328,8 @@ class FeatureEngine:
                 'ai_email_triggers': [],
                 'conversation_insights': {}
             }
-        recent_messages.sort(key=lambda m: _parse_ts(m['ts']))  # <<< important
+        timed.sort(key=lambda p: p[0])  # <<< important
+        recent_messages = [e for _, e in timed]
 
         # Prepare last N for LLM
         WINDOW = 50
@@ -1101,9 +1343,8 @@ class FeatureEngine:
                 'role': 'user'
             })
 
-        # Helper: heuristic backfill when LLM gives no triggers
-        def _heuristic_triggers(all_msgs_text: str, topics: list) -> list:
-            t = (all_msgs_text or '').lower()
+        # Helper: heuristic backfill when LLM gives no triggers (`hits` from _keyword_hits)
+        def _heuristic_triggers(hits: set, topics: list) -> list:
             inferred = []
             # crude subject guess from topics if available
             subj_guess = None
@@ -1111,8 +1352,9 @@ class FeatureEngine:
                 first = topics[0]
                 subj_guess = first.split('>')[0] if '>' in first else first
 
+            soon = not hits.isdisjoint(_SOON_KEYWORDS)
             # exam tomorrow?
-            if "exam" in t and any(k in t for k in ("tomorrow", "tmrw", "next day")):
+            if 'exam' in hits and soon:
                 inferred.append({
                     'trigger': 'exam_prep',
                     'subject': subj_guess or 'General',
@@ -1121,7 +1363,7 @@ class FeatureEngine:
                 })
 
             # appointment tomorrow?
-            if "appointment" in t and any(k in t for k in ("tomorrow", "tmrw", "next day")):
+            if 'appointment' in hits and soon:
                 inferred.append({
                     'trigger': 'appointment_reminder',
                     'days_before': 1,
@@ -1129,7 +1371,7 @@ class FeatureEngine:
                 })
 
             # learning support ask
-            if any(k in t for k in ("difficult", "hard", "struggling", "confused", "help")):
+            if not hits.isdisjoint(_SUPPORT_KEYWORDS):
                 inferred.append({
                     'trigger': 'learning_support',
                     'subject': subj_guess or 'General',
@@ -1142,16 +1384,14 @@ class FeatureEngine:
                             else m.get('message', '') for m in conversations_for_analysis])
 
         try:
-            import asyncio
+            # Run on the shared background loop; safe even when called from inside a running loop
             try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-
-            analysis = loop.run_until_complete(
-                self.llm_service.analyze_conversations_for_triggers(conversations_for_analysis)
-            )
+                analysis = _async_runtime.run(
+                    self.llm_service.analyze_conversations_for_triggers(conversations_for_analysis),
+                    timeout=settings.LLM_TIMEOUT_SECONDS
+                )
+            except TimeoutError:
+                raise TimeoutError(f"Conversation analysis exceeded {settings.LLM_TIMEOUT_SECONDS}s")
 
             topics = analysis.get('topics') or []
             sentiment = analysis.get('sentiment_avg', 0.0)
@@ -1160,7 +1400,7 @@ class FeatureEngine:
 
             # If LLM returned no triggers, use heuristics on the same text
             if not triggers:
-                triggers = _heuristic_triggers(all_text, topics)
+                triggers = _heuristic_triggers(_keyword_hits(all_text), topics)
 
             return {
                 'conversations_7d': len(recent_messages),
@@ -1173,21 +1413,14 @@ class FeatureEngine:
         except Exception as e:
             logger.error(f"Failed to analyze conversations with AI: {str(e)}")
 
-            # Fallback topics (simple keywording)
-            fallback_topics = []
-            text_lower = (all_text or "").lower()
-            topic_patterns = {
-                'Biology>Cells': ['cell', 'cellular', 'mitochondria', 'nucleus', 'membrane', 'organelle'],
-                'Biology>Photosynthesis': ['photosynthesis', 'chloroplast', 'light reaction', 'calvin cycle'],
-                'Biology>Cellular Mechanisms': ['cellular', 'mechanism', 'biology', 'molecular'],
-                'Pharmacology>Antibiotics': ['antibiotic', 'antimicrobial', 'penicillin', 'vancomycin', 'resistance', 'bacteria'],
-                'History>Stone Age': ['stone age', 'neolithic', 'paleolithic'],
-            }
-            for topic, keywords in topic_patterns.items():
-                if any(k in text_lower for k in keywords):
-                    fallback_topics.append(topic)
+            # Fallback topics (simple keywording); one keyword scan serves topics and triggers
+            hits = _keyword_hits(all_text)
+            fallback_topics = [
+                topic for topic, keywords in _FALLBACK_TOPIC_KEYWORDS.items()
+                if not hits.isdisjoint(keywords)
+            ]
 
-            fallback_triggers = _heuristic_triggers(all_text, fallback_topics)
+            fallback_triggers = _heuristic_triggers(hits, fallback_topics)
 
             return {
                 'conversations_7d': len(recent_messages),
@@ -1201,3 +1434,100 @@ class FeatureEngine:
                     'needs': [],
                 }
             }
+
+
+def _trigger_flags(trigs: List[Any]) -> Dict[str, bool]:
+    """
+    Rules-engine convenience booleans from the AI email triggers, in one pass over the
+    list (stops early once all three are set).
+    """
+    prep = post = support = False
+    for t in trigs:
+        if not isinstance(t, dict):
+            continue
+        message_type, trigger = t.get('message_type'), t.get('trigger')
+        if not isinstance(trigger, str):
+            trigger = None  # frozenset membership needs a hashable value
+        prep = prep or message_type == 'last_minute_prep' or trigger in _PREP_TRIGGERS
+        post = post or message_type == 'how_did_it_go' or trigger in _POST_TRIGGERS
+        support = support or trigger == 'learning_support' or t.get('trigger_type') == 'learning_support'
+        if prep and post and support:
+            break
+    return {
+        'has_exam_last_minute_prep': prep,
+        'has_exam_post_checkin': post,
+        'has_learning_support': support,
+    }
+
+
+def _keyword_hits(text: Optional[str]) -> set:
+    """The _CONVO_KEYWORDS occurring in `text` (case-insensitive), each searched for once."""
+    text_lower = (text or '').lower()
+    return {k for k in _CONVO_KEYWORDS if k in text_lower}
+
+
+def _parse_event_ts(ts: str) -> datetime:
+    """Parse a normalized event's ISO timestamp ('Z' suffix allowed)."""
+    if _ISO_Z_NATIVE or not ts.endswith('Z'):
+        return datetime.fromisoformat(ts)
+    return datetime.fromisoformat(ts[:-1] + '+00:00')
+
+
+def _event_ts(event: Dict[str, Any]) -> datetime:
+    """The event's parsed timestamp: the '_ts' cached by compute_user_features, else parsed now."""
+    ts = event.get('_ts')
+    return ts if ts is not None else _parse_event_ts(event['ts'])
+
+
+def _session_minutes(start: Any, end: Any) -> Optional[float]:
+    """Session length in minutes from two ISO timestamps, clipped to [0, _SESSION_MAX_MINUTES]; None if unparseable."""
+    try:
+        start_dt = _parse_event_ts(str(start))
+        end_dt = _parse_event_ts(str(end))
+        return min(max(0.0, (end_dt - start_dt).total_seconds() / 60.0), _SESSION_MAX_MINUTES)
+    except Exception:
+        return None
+
+
+def _projected_props(row: Any, keys: Tuple[str, ...]) -> Dict[str, Any]:
+    """Rebuild a props dict from the row's extracted props `keys`, dropping absent ones."""
+    props = {}
+    for k in keys:
+        v = getattr(row, k)
+        if v is not None:
+            props[k] = v
+    return props
+
+
+def _partition_by_density(users: List[Tuple[str, Optional[str]]], volumes: Dict[str, int],
+                          n_chunks: int) -> List[List[Tuple[str, Optional[str]]]]:
+    """
+    Split users into n_chunks of similar total event volume: sort by volume descending,
+    reverse the lighter half (descend-then-ascend) and deal round-robin, so heavy users
+    are spread out instead of leaving one worker straggling.
+    """
+    ordered = sorted(users, key=lambda u: volumes.get(u[0], 0), reverse=True)
+    half = len(ordered) // 2
+    ordered = ordered[:half] + ordered[half:][::-1]
+    chunks: List[List[Tuple[str, Optional[str]]]] = [[] for _ in range(n_chunks)]
+    for i, user in enumerate(ordered):
+        chunks[i % n_chunks].append(user)
+    return chunks
+
+
+def _compute_features_chunk(users: List[Tuple[str, Optional[str]]], as_of_date: date) -> int:
+    """
+    ProcessPoolExecutor worker for compute_daily_features: one chunk of (user_id, email)
+    pairs with its own session and FeatureEngine, committed by the worker.
+    """
+    from database import connection
+    if connection.engine is not None:
+        # Pooled connections inherited over fork belong to the parent; never reuse them here
+        connection.engine.dispose(close=False)
+    db = connection.SessionLocal()
+    try:
+        processed = FeatureEngine()._compute_users(users, as_of_date, db, user_ids=[user_id for user_id, _ in users])
+        db.commit()
+        return processed
+    finally:
+        db.close()
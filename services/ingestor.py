@@ -1,8 +1,14 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import func, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from database.models import Event, AppUser, ContentItem
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+import asyncio
+import hashlib
 import json
+import re
+import threading
 import uuid
 import logging
 from dateutil import parser
@@ -10,6 +16,17 @@ import pytz
 
 logger = logging.getLogger(__name__)
 
+# _clean_text: SSML/markup tags, then whitespace runs
+_SSML_TAG_RE = re.compile(r'<[^>]+>')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# events columns written by process_bulk_data; subject/presentation_id are generated from props
+_EVENT_ROW_DEFAULTS = {'source': None, 'session_id': None, 'props': None}
+
+# Exact formats tried (after datetime.fromisoformat) before the heuristic dateutil parser;
+# source timestamps like "2025-02-11,22:36:49" arrive here with the comma already replaced
+_TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
 class IngestorService:
     """
     Service for ingesting and normalizing data from 8 source tables
@@ -27,28 +44,70 @@ class IngestorService:
             'presentation_prod': self._process_presentation_prod,
             'ICP_Prod': self._process_icp_prod
         }
+        # Per-batch lookups, set only while process_bulk_data runs. Thread-local: each bulk
+        # call runs on its own worker thread, so concurrent batches keep separate caches
+        #   ts_cache: raw timestamp string -> parsed datetime
+        #   users: batch email -> existing AppUser (None: not in the table)
+        self._batch = threading.local()
+    
+    async def process_bulk_data(self, data: List[Dict[str, Any]], db: Session) -> List[Dict[str, Any]]:
+        """
+        Process bulk data from multiple sources. The per-source parsers build plain
+        events rows (_event_row), written in one executemany INSERT; returns those rows.
+        The whole batch commits once; each record runs in a SAVEPOINT so a failing one
+        rolls back alone.
+        
+        The parsing and the synchronous SQLAlchemy work run on a worker thread, keeping
+        the event loop free for other requests; `db` must not be used until this returns.
+        """
+        return await asyncio.to_thread(self._process_bulk_data_sync, data, db)
     
-    async def process_bulk_data(self, data: List[Dict[str, Any]], db: Session) -> List[Event]:
-        """Process bulk data from multiple sources"""
+    def _process_bulk_data_sync(self, data: List[Dict[str, Any]], db: Session) -> List[Dict[str, Any]]:
+        """process_bulk_data's body, run on a worker thread."""
         events = []
         
-        for record in data:
-            source_table = record.get('source_table')
-            if source_table in self.source_mappings:
-                try:
-                    processed_events = self.source_mappings[source_table](record, db)
-                    events.extend(processed_events)
-                except Exception as e:
-                    logger.error(f"Failed to process record from {source_table}: {str(e)}")
-                    continue
-        
-        # Bulk insert events
-        db.add_all(events)
+        # Per-batch lookups: each distinct timestamp string is parsed once, and the existing
+        # users behind the batch's emails are fetched in one query
+        batch = self._batch
+        batch.ts_cache = {}
+        try:
+            batch.users = self._prefetch_users(data, db)
+            for record in data:
+                source_table = record.get('source_table')
+                if source_table in self.source_mappings:
+                    try:
+                        with db.begin_nested():
+                            processed_events = self.source_mappings[source_table](record, db)
+                        events.extend(processed_events)
+                    except Exception as e:
+                        logger.error(f"Failed to process record from {source_table}: {str(e)}")
+                        continue
+        finally:
+            batch.ts_cache = batch.users = None
+        
+        # Bulk insert events: Core executemany, no ORM unit of work per event
+        if events:
+            db.execute(insert(Event.__table__), events)
         db.commit()
         
         logger.info(f"Processed {len(events)} events from bulk data")
         return events
     
+    def _prefetch_users(self, data: List[Dict[str, Any]], db: Session) -> Dict[str, Optional[AppUser]]:
+        """Existing users for every investor_prod email in the batch, in one IN query."""
+        emails = {
+            (record.get('data') or {}).get('email')
+            for record in data
+            if record.get('source_table') == 'investor_prod'
+        }
+        emails.discard(None)
+        if not emails:
+            return {}
+        users: Dict[str, Optional[AppUser]] = dict.fromkeys(emails)
+        for user in db.query(AppUser).filter(AppUser.email.in_(emails)):
+            users[user.email] = user
+        return users
+    
     async def process_single_event(self, event_data: Dict[str, Any], db: Session) -> Event:
         """Process a single event"""
         event = Event(
@@ -66,7 +125,7 @@ class IngestorService:
         
         return event
     
-    def _process_investor_prod(self, record: Dict[str, Any], db: Session) -> List[Event]:
+    def _process_investor_prod(self, record: Dict[str, Any], db: Session) -> List[Dict[str, Any]]:
         """Process investor_prod table records"""
         events = []
         
@@ -74,10 +133,13 @@ class IngestorService:
         user_data = record.get('data', {})
         user = self._upsert_user(user_data, db)
         
+        # Every event of the record carries the profile's created_at
+        ts = self._parse_timestamp(user_data.get('created_at'))
+        
         # Create user profile upsert event
-        events.append(Event(
+        events.append(_event_row(
             user_id=user.user_id,
-            ts=self._parse_timestamp(user_data.get('created_at')),
+            ts=ts,
             name='user_profile_upsert',
             source='batch',
             props={
@@ -98,9 +160,9 @@ class IngestorService:
         
         for i, message in enumerate(chat_history):
             if isinstance(message, dict):
-                events.append(Event(
+                events.append(_event_row(
                     user_id=user.user_id,
-                    ts=self._parse_timestamp(user_data.get('created_at')),
+                    ts=ts,
                     name='convo_msg',
                     source='web',
                     session_id=session_id,
@@ -113,7 +175,7 @@ class IngestorService:
         
         return events
     
-    def _process_conversation_history(self, record: Dict[str, Any], db: Session) -> List[Event]:
+    def _process_conversation_history(self, record: Dict[str, Any], db: Session) -> List[Dict[str, Any]]:
         """Process conversation_history table records"""
         events = []
         data = record.get('data', {})
@@ -124,11 +186,12 @@ class IngestorService:
         
         session_id = str(uuid.uuid4())
         chat_history = data.get('chat_history', [])
+        ts = self._parse_timestamp(data.get('timestamp'))
         
         for i, message in enumerate(chat_history):
-            events.append(Event(
+            events.append(_event_row(
                 user_id=user_id,
-                ts=self._parse_timestamp(data.get('timestamp')),
+                ts=ts,
                 name='convo_msg',
                 source='web',
                 session_id=session_id,
@@ -141,13 +204,13 @@ class IngestorService:
         
         return events
     
-    def _process_login_history(self, record: Dict[str, Any], db: Session) -> List[Event]:
+    def _process_login_history(self, record: Dict[str, Any], db: Session) -> List[Dict[str, Any]]:
         """Process InvestorLoginHistory_Prod table records"""
         events = []
         data = record.get('data', {})
         
         # Login event
-        events.append(Event(
+        events.append(_event_row(
             user_id=data.get('user_id'),
             ts=self._parse_timestamp(data.get('timestamp')),
             name='login',
@@ -161,7 +224,7 @@ class IngestorService:
         
         return events
     
-    def _process_test_series(self, record: Dict[str, Any], db: Session) -> List[Event]:
+    def _process_test_series(self, record: Dict[str, Any], db: Session) -> List[Dict[str, Any]]:
         """Process User_Infinite_TestSeries_Prod table records"""
         events = []
         data = record.get('data', {})
@@ -185,10 +248,11 @@ class IngestorService:
         responses = data.get('Response', {})
         for timestamp, response_data in responses.items():
             if isinstance(response_data, list):
+                ts = self._parse_timestamp(timestamp)
                 for i, response in enumerate(response_data):
-                    events.append(Event(
+                    events.append(_event_row(
                         user_id=user_id,
-                        ts=self._parse_timestamp(timestamp),
+                        ts=ts,
                         name='test_attempt',
                         source='web',
                         props={
@@ -206,7 +270,7 @@ class IngestorService:
         
         return events
     
-    def _process_test_record(self, record: Dict[str, Any], db: Session) -> List[Event]:
+    def _process_test_record(self, record: Dict[str, Any], db: Session) -> List[Dict[str, Any]]:
         """Process TestSereiesRecord_Prod table records"""
         events = []
         data = record.get('data', {})
@@ -215,7 +279,7 @@ class IngestorService:
         test_id = data.get('test_id', str(uuid.uuid4()))
         
         # Test session started
-        events.append(Event(
+        events.append(_event_row(
             user_id=user_id,
             ts=self._parse_timestamp(data.get('start_time')),
             name='test_session_started',
@@ -229,11 +293,12 @@ class IngestorService:
         
         # Process individual questions
         questions = data.get('questions', [])
+        ts = self._parse_timestamp(data.get('timestamp'))
         for i, question in enumerate(questions):
             if question.get('Answer_To_The_Question') is not False:  # Skip incomplete
-                events.append(Event(
+                events.append(_event_row(
                     user_id=user_id,
-                    ts=self._parse_timestamp(data.get('timestamp')),
+                    ts=ts,
                     name='test_attempt',
                     source='web',
                     props={
@@ -248,7 +313,7 @@ class IngestorService:
         
         return events
     
-    def _process_learning_record(self, record: Dict[str, Any], db: Session) -> List[Event]:
+    def _process_learning_record(self, record: Dict[str, Any], db: Session) -> List[Dict[str, Any]]:
         """Process LearningRecord_Prod table records"""
         events = []
         data = record.get('data', {})
@@ -272,10 +337,11 @@ class IngestorService:
         responses = data.get('Response', {})
         for timestamp, response_data in responses.items():
             if isinstance(response_data, list):
+                ts = self._parse_timestamp(timestamp)
                 for response in response_data:
-                    events.append(Event(
+                    events.append(_event_row(
                         user_id=user_id,
-                        ts=self._parse_timestamp(timestamp),
+                        ts=ts,
                         name='presentation_progress',
                         source='web',
                         props={
@@ -290,7 +356,7 @@ class IngestorService:
         
         return events
     
-    def _process_question_prod(self, record: Dict[str, Any], db: Session) -> List[Event]:
+    def _process_question_prod(self, record: Dict[str, Any], db: Session) -> List[Dict[str, Any]]:
         """Process Question_Prod table records"""
         events = []
         data = record.get('data', {})
@@ -314,7 +380,7 @@ class IngestorService:
             }, db)
             
             # Question created event
-            events.append(Event(
+            events.append(_event_row(
                 user_id=None,  # System generated
                 ts=datetime.utcnow(),
                 name='question_created',
@@ -329,7 +395,7 @@ class IngestorService:
         
         return events
     
-    def _process_presentation_prod(self, record: Dict[str, Any], db: Session) -> List[Event]:
+    def _process_presentation_prod(self, record: Dict[str, Any], db: Session) -> List[Dict[str, Any]]:
         """Process presentation_prod table records"""
         data = record.get('data', {})
         
@@ -348,7 +414,7 @@ class IngestorService:
         
         return []  # No events, just content metadata
     
-    def _process_icp_prod(self, record: Dict[str, Any], db: Session) -> List[Event]:
+    def _process_icp_prod(self, record: Dict[str, Any], db: Session) -> List[Dict[str, Any]]:
         """Process ICP_Prod table records"""
         data = record.get('data', {})
         
@@ -371,12 +437,18 @@ class IngestorService:
         return []  # No events, just content metadata
     
     def _upsert_user(self, user_data: Dict[str, Any], db: Session) -> AppUser:
-        """Create or update user record"""
+        """Create or update user record (flushed, not committed)"""
         email = user_data.get('email')
         if not email:
             raise ValueError("Email is required for user creation")
         
-        user = db.query(AppUser).filter(AppUser.email == email).first()
+        cache = getattr(self._batch, 'users', None)
+        if cache is not None and email in cache:
+            # Prefetched for the batch; used once, so a repeat of the email queries (and
+            # autoflush finds) the row written by its first record
+            user = cache.pop(email)
+        else:
+            user = db.query(AppUser).filter(AppUser.email == email).first()
         
         if not user:
             user = AppUser(
@@ -399,39 +471,58 @@ class IngestorService:
             user.plan = user_data.get('Subscription') or user.plan
             user.updated_at = datetime.utcnow()
         
-        db.commit()
-        db.refresh(user)
+        # Flush (not commit) for user.user_id; the caller's transaction commits
+        db.flush()
         return user
     
     def _upsert_content_item(self, content_data: Dict[str, Any], db: Session):
-        """Create or update content item"""
+        """
+        Create or update content item in one INSERT ... ON CONFLICT (content_id) statement
+        (no SELECT first); None values keep what is stored. The caller commits.
+        """
         content_id = content_data.get('content_id')
         if not content_id:
             return
         
-        content = db.query(ContentItem).filter(ContentItem.content_id == content_id).first()
-        
-        if not content:
-            content = ContentItem(**content_data)
-            db.add(content)
+        table = ContentItem.__table__
+        values = {k: v for k, v in content_data.items() if k in table.c}
+        stmt = pg_insert(table).values(**values)
+        updates = {k: func.coalesce(stmt.excluded[k], table.c[k]) for k in values if k != 'content_id'}
+        if updates:
+            stmt = stmt.on_conflict_do_update(index_elements=['content_id'], set_=updates)
         else:
-            for key, value in content_data.items():
-                if hasattr(content, key) and value is not None:
-                    setattr(content, key, value)
-        
-        db.commit()
+            stmt = stmt.on_conflict_do_nothing(index_elements=['content_id'])
+        db.execute(stmt)
     
     def _parse_timestamp(self, timestamp_str: Optional[str]) -> datetime:
-        """Parse various timestamp formats to UTC datetime"""
+        """
+        Parse various timestamp formats to UTC datetime: datetime.fromisoformat, then the
+        exact _TIMESTAMP_FORMATS, and dateutil's heuristic parser only as a last resort
+        """
         if not timestamp_str:
             return datetime.utcnow()
         
+        cache = getattr(self._batch, 'ts_cache', None)
+        if cache is not None and isinstance(timestamp_str, str):
+            dt = cache.get(timestamp_str)
+            if dt is None:
+                dt = cache[timestamp_str] = self._parse_timestamp_uncached(timestamp_str)
+            return dt
+        return self._parse_timestamp_uncached(timestamp_str)
+    
+    def _parse_timestamp_uncached(self, timestamp_str: Any) -> datetime:
+        """_parse_timestamp without the per-batch cache."""
         try:
-            # Handle "2025-02-11,22:36:49" format
-            if ',' in str(timestamp_str):
-                timestamp_str = str(timestamp_str).replace(',', ' ')
-            
-            dt = parser.parse(str(timestamp_str))
+            if isinstance(timestamp_str, datetime):
+                dt = timestamp_str
+            else:
+                s = str(timestamp_str)
+                # Handle "2025-02-11,22:36:49" format
+                if ',' in s:
+                    s = s.replace(',', ' ')
+                if s.endswith('Z'):
+                    s = s[:-1] + '+00:00'
+                dt = self._parse_timestamp_exact(s) or parser.parse(s)
             
             # Convert to UTC if timezone-aware
             if dt.tzinfo is not None:
@@ -442,25 +533,32 @@ class IngestorService:
             logger.warning(f"Failed to parse timestamp {timestamp_str}: {str(e)}")
             return datetime.utcnow()
     
+    def _parse_timestamp_exact(self, s: str) -> Optional[datetime]:
+        """ISO 8601 or one of _TIMESTAMP_FORMATS; None if `s` matches none of them."""
+        try:
+            return datetime.fromisoformat(s)
+        except ValueError:
+            pass
+        for fmt in _TIMESTAMP_FORMATS:
+            try:
+                return datetime.strptime(s, fmt)
+            except ValueError:
+                continue
+        return None
+    
     def _clean_text(self, text: str) -> str:
         """Clean text by removing SSML and other unwanted content"""
-        import re
-        
-        # Remove SSML tags
-        text = re.sub(r'<[^>]+>', '', text)
-        
-        # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text).strip()
-        
-        return text
+        # Remove SSML tags, then excessive whitespace
+        return _WHITESPACE_RE.sub(' ', _SSML_TAG_RE.sub('', text)).strip()
     
     def _hash_ip(self, ip_address: Optional[str]) -> Optional[str]:
         """Hash IP address for privacy"""
         if not ip_address:
             return None
         
-        import hashlib
-        return hashlib.sha256(ip_address.encode()).hexdigest()[:16]
+        # First 8 digest bytes: the same 16 hex chars as hexdigest()[:16], so existing
+        # ip_hash values still match
+        return hashlib.sha256(ip_address.encode()).digest()[:8].hex()
     
     def _sanitize_user_data(self, user_data: Dict[str, Any]) -> Dict[str, Any]:
         """Remove sensitive data from user record"""
@@ -472,3 +570,11 @@ class IngestorService:
                 sanitized[key] = value
         
         return sanitized
+
+
+def _event_row(**values: Any) -> Dict[str, Any]:
+    """
+    One events row for process_bulk_data, from Event's keyword arguments. Every row has
+    the same keys (executemany binds them per row) and its own event_id, like Event().
+    """
+    return {'event_id': str(uuid.uuid4()), **_EVENT_ROW_DEFAULTS, **values}
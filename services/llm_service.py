@@ -3,11 +3,15 @@ try:
     import openai  # type: ignore
 except Exception:
     openai = None  # type: ignore
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
+import asyncio
+import functools
 import logging
 import json
+import os
 import re
 from config.settings import settings
+from services.email_llm_cache import EmailLLMCache, make_key
 
 logger = logging.getLogger(__name__)
 
@@ -32,18 +36,145 @@ def _safe_json_extract(text: str) -> Dict[str, Any]:
             return {}
     return {}
 
+# Instructions shared by every email request. Kept byte-stable and first in the
+# conversation so the provider can serve it from its prompt cache.
+_EMAIL_SYSTEM_PROMPT = """
+Return ONLY valid JSON with keys "subject" and "content", nothing else.
+
+Requirements:
+- 2–3 sentences max in the email body, supportive, actionable.
+- If Rule is "exam_last_minute_prep" and hints are present, include the subject/day in BOTH subject and body.
+- Follow the Metrics rule given with the student details.
+- Avoid making up facts, scores, dates, or links.
+- Tone: encouraging, academic coach, concise.
+- Do not ask the reader to reply or respond; emails are sent from a no-reply address. Avoid the words "reply", "respond", "email back".
+
+Style nudges (use if they fit):
+- Subject should be short and actionable.
+- If day hint given (tonight/today/tomorrow), reflect immediacy.
+
+Examples of acceptable subjects (not literal):
+- "Tonight’s IELTS exam: 45-minute crash plan"
+- "Tomorrow’s Biology exam: quick last-minute checklist"
+""".strip()
+
+_EMAIL_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "educational_email",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"subject": {"type": "string"}, "content": {"type": "string"}},
+            "required": ["subject", "content"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# Deterministic fallback copy for generate_educational_email: rule_id -> (subject, content).
+# Slots are filled with str.format_map.
+_FALLBACK_TEMPLATES: Dict[str, Tuple[str, str]] = {
+    "exam_last_minute_prep": (
+        "{when_title}’s {subj_hint} exam: 45-minute crash plan ✅",
+        "Hello {first_name}!\n\n"
+        "Your {subj_hint} exam is {when}. Here’s a focused, high-yield plan:\n\n"
+        "• 15 min — quick review of your most-missed ideas\n"
+        "• 15 min — 10 mixed practice Qs (no notes)\n"
+        "• 10 min — check answers & fix 2 weak patterns\n"
+        "• 5  min — one-page cheat sheet (from memory, then fill gaps)\n\n"
+        "Start a 10-question mini-set now.",
+    ),
+    "exam_post_checkin": (
+        "How did the {subj_hint} exam go? 📚",
+        "Hi {first_name}! How did it go? Jot one solid concept, one surprise, and one target for next week. "
+        "Start a quick debrief quiz from your tricky areas.",
+    ),
+}
+_FALLBACK_DEFAULT = (
+    "Keep going, {first_name}! 🎓",
+    "Hi {first_name}! Let’s lock in a quick 10-minute study block today. "
+    "Start a focused set now.",
+)
+
+
+# Provider errors worth retrying: connection failures/timeouts, 429s and 5xx
+_TRANSIENT_LLM_ERRORS: Tuple[type, ...] = tuple(
+    getattr(openai, name)
+    for name in ("APIConnectionError", "RateLimitError", "InternalServerError")
+    if openai is not None and hasattr(openai, name)
+)
+
+
+def email_completion_request(prompt: str) -> Dict[str, Any]:
+    """Chat-completions params for one email prompt (online calls and Batch API lines)."""
+    request: Dict[str, Any] = {
+        "model": settings.LLM_EMAIL_MODEL,
+        "messages": [
+            {"role": "system", "content": _EMAIL_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ],
+        "temperature": 0.5,
+        "max_tokens": 220,
+    }
+    if settings.LLM_EMAIL_STRUCTURED_OUTPUT:
+        request["response_format"] = _EMAIL_RESPONSE_FORMAT
+    return request
+
+
+def parse_email_completion(raw: str) -> Dict[str, str]:
+    """
+    Parse an email completion into {"subject", "content"}.
+    Raises ValueError when either field is missing or empty.
+    """
+    raw = (raw or "").strip()
+    try:
+        result = json.loads(raw)
+    except Exception:
+        # Try to recover JSON object from text
+        m = re.search(r"\{.*\}", raw, flags=re.DOTALL)
+        result = json.loads(m.group(0)) if m else {}
+    subject = (result.get("subject") or "").strip()
+    content = (result.get("content") or "").strip()
+    if not subject or not content:
+        raise ValueError("LLM returned empty fields")
+    return {"subject": subject, "content": content}
+
+@functools.lru_cache(maxsize=1)
+def _shared_client():
+    """
+    One OpenAI client per process so its HTTP connection pool (and TLS sessions)
+    is reused by every LLMService instance instead of being rebuilt per service.
+    Returns None when no API key / SDK is available.
+    """
+    if not getattr(settings, "OPENAI_API_KEY", None) or openai is None:
+        return None
+    try:
+        return openai.Client(api_key=settings.OPENAI_API_KEY)
+    except Exception:
+        return None
+
+@functools.lru_cache(maxsize=1)
+def _shared_email_cache() -> EmailLLMCache:
+    """Process-wide cache of generated email copy (see services.email_llm_cache)."""
+    return EmailLLMCache()
+
+@functools.lru_cache(maxsize=1)
+def _shared_analysis_cache() -> EmailLLMCache:
+    """Process-wide cache of conversation analyses, keyed by the full completion request."""
+    return EmailLLMCache(
+        ttl_seconds=settings.CONVO_ANALYSIS_CACHE_TTL_SECONDS,
+        max_entries=settings.CONVO_ANALYSIS_CACHE_MAX_ENTRIES,
+        redis_prefix="convo_analysis:",
+    )
+
 class LLMService:
     """
     Service for LLM-based conversation understanding and content generation
     """
 
     def __init__(self):
-        self.client = None
-        if getattr(settings, "OPENAI_API_KEY", None) and openai is not None:
-            try:
-                self.client = openai.Client(api_key=settings.OPENAI_API_KEY)
-            except Exception:
-                self.client = None
+        self.client = _shared_client()
 
         # Embedding model (optional)
         try:
@@ -54,9 +185,10 @@ class LLMService:
 
     # --------- ANALYSIS (unchanged major logic) ------------------------------
 
-    async def analyze_conversation(self, conversation_text: str) -> Dict[str, Any]:
+    async def analyze_conversation(self, conversation_text: str, with_embedding: bool = True) -> Dict[str, Any]:
         """
-        Analyze conversation to extract summary, topics, sentiment, needs, and follow-up triggers
+        Analyze conversation to extract summary, topics, sentiment, needs, and follow-up triggers.
+        `with_embedding=False` skips the summary embedding (a second API round trip).
         """
         try:
             prompt = f"""
@@ -92,19 +224,30 @@ class LLMService:
             """
 
             if self.client:
-                response = self.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.2,
-                    max_tokens=800
-                )
-                analysis = _safe_json_extract(response.choices[0].message.content)
+                request = {
+                    "model": "gpt-4",
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": 0.2,
+                    "max_tokens": 800,
+                }
+                # Most users' recent messages are unchanged between daily runs: the same
+                # prompt reuses the earlier analysis instead of another completion
+                cache = _shared_analysis_cache()
+                cache_key = make_key(**request)
+                analysis = cache.get(cache_key)
+                if analysis is None:
+                    # Sync SDK call: run it off the event loop so concurrent analyses overlap
+                    response = await asyncio.to_thread(self.client.chat.completions.create, **request)
+                    analysis = _safe_json_extract(response.choices[0].message.content)
+                    if analysis:
+                        cache.put(cache_key, analysis)
             else:
                 analysis = self._enhanced_fallback_analysis(conversation_text)
 
             # Optional embedding
-            embedding = self._generate_embedding(analysis.get('summary', ''))
-            analysis['embedding'] = embedding
+            if with_embedding:
+                embedding = await asyncio.to_thread(self._generate_embedding, analysis.get('summary', ''))
+                analysis['embedding'] = embedding
             return analysis
 
         except Exception as e:
@@ -130,7 +273,8 @@ class LLMService:
                     all_text.append(conv['content'])
             combined_text = ' '.join(all_text)
 
-            analysis = await self.analyze_conversation(combined_text)
+            # Only topics/triggers/insights are kept: no embedding call
+            analysis = await self.analyze_conversation(combined_text, with_embedding=False)
             topics = analysis.get('topics', [])
             triggers = analysis.get('follow_up_triggers', [])
             sentiment_avg = analysis.get('sentiment', 0.0)
@@ -171,23 +315,91 @@ class LLMService:
           - day_hint: str | None             one of: tonight|today|tomorrow|soon
           - metrics_scope: "overall"|"subject" (default "overall")
           - instructions_extra: str          additional guardrails
+          - prompt_cache_key: str            provider prompt-cache routing key (default per rule)
 
         Returns {"subject": "...", "content": "..."}.
         Never invent per-subject percentages/accuracy unless explicitly provided.
         """
         preferred_subject: Optional[str] = kwargs.get("preferred_subject")
         day_hint: Optional[str] = kwargs.get("day_hint")
-        metrics_scope: str = kwargs.get("metrics_scope") or "overall"
-        instructions_extra: str = kwargs.get("instructions_extra") or ""
+        prompt = self.build_email_prompt(rule_id, user_features, user_email, **kwargs)
+
+        try:
+            if self.client:
+                request = email_completion_request(prompt)
+                # Identical prompts (same name, rule, hints, topics) reuse earlier copy
+                cache = _shared_email_cache()
+                cache_key = make_key(**request)
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    return cached
+
+                resp = await self._create_completion_with_retry(
+                    **request,
+                    # Route same-rule requests together so the provider's prompt cache can hit
+                    extra_body={"prompt_cache_key": kwargs.get("prompt_cache_key") or f"edu-email:{rule_id}"},
+                )
+                email = parse_email_completion(resp.choices[0].message.content)
+                cache.put(cache_key, email)
+                return email
+        except Exception as e:
+            logger.warning("LLM email generation failed in LLMService: %s", str(e))
+
+        first_name = self._student_first_name(user_features, user_email)
+
+        # Fallback: deterministic copy guided by hints
+        subj_hint = preferred_subject or "your"
+        when = (day_hint or "soon")
+        subject_tpl, content_tpl = _FALLBACK_TEMPLATES.get(rule_id, _FALLBACK_DEFAULT)
+        slots = {"first_name": first_name, "subj_hint": subj_hint, "when": when, "when_title": when.title()}
+        subject = subject_tpl.format_map(slots)
+        content = content_tpl.format_map(slots)
 
-        # Derive a friendly first name
+        return {"subject": subject, "content": content}
+
+    async def _create_completion_with_retry(self, **request) -> Any:
+        """
+        client.chat.completions.create off the event loop (the client is synchronous,
+        so concurrent calls must not serialize on it). Transient provider errors are
+        retried with exponential backoff, up to settings.LLM_MAX_RETRIES times.
+        """
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            try:
+                return await asyncio.to_thread(self.client.chat.completions.create, **request)
+            except _TRANSIENT_LLM_ERRORS as e:
+                if attempt >= settings.LLM_MAX_RETRIES:
+                    raise
+                delay = 0.5 * (2 ** attempt)
+                logger.debug("LLM call failed (%s); retrying in %.1fs", e, delay)
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _student_first_name(user_features: Dict[str, Any], user_email: str) -> str:
         first_name = user_features.get("first_name")
         if not first_name:
             try:
                 first_name = user_email.split("@")[0]
             except Exception:
                 first_name = "Student"
-        first_name = (first_name or "Student").title()
+        return (first_name or "Student").title()
+
+    def build_email_prompt(
+        self,
+        rule_id: str,
+        user_features: Dict[str, Any],
+        user_email: str,
+        **kwargs,
+    ) -> str:
+        """
+        Render the email-generation prompt for generate_educational_email (same
+        hints). Also used to serialize Batch API requests.
+        """
+        preferred_subject: Optional[str] = kwargs.get("preferred_subject")
+        day_hint: Optional[str] = kwargs.get("day_hint")
+        metrics_scope: str = kwargs.get("metrics_scope") or "overall"
+        instructions_extra: str = kwargs.get("instructions_extra") or ""
+
+        first_name = self._student_first_name(user_features, user_email)
 
         top_topics = user_features.get("top_topics", []) or []
         test_accuracy_overall = user_features.get("test_accuracy")
@@ -221,34 +433,18 @@ class LLMService:
                 "Never invent numbers."
             )
 
-        # Compose the prompt
-        prompt = f"""
-Return ONLY valid JSON with keys "subject" and "content", nothing else.
-
+        # Compose the per-student part; static instructions live in _EMAIL_SYSTEM_PROMPT
+        return f"""
 Student: {first_name}
 Rule: {rule_id}
 PreferredSubjectHint: {preferred_subject or "None"}
 DayHint: {day_hint or "None"}
 TopTopics (for context only): {top_topics}
 
-Requirements:
-- 2–3 sentences max in the email body, supportive, actionable.
-- If Rule is "exam_last_minute_prep" and hints are present, include the subject/day in BOTH subject and body.
-- {metrics_rules}
-- Avoid making up facts, scores, dates, or links.
-- Tone: encouraging, academic coach, concise.
-- Do not ask the reader to reply or respond; emails are sent from a no-reply address. Avoid the words "reply", "respond", "email back".
-
-Style nudges (use if they fit):
-- Subject should be short and actionable.
-- If day hint given (tonight/today/tomorrow), reflect immediacy.
+Metrics: {metrics_rules}
 
 {("Extra instructions: " + instructions_extra) if instructions_extra else ""}
 
-Examples of acceptable subjects (not literal):
-- "Tonight’s IELTS exam: 45-minute crash plan"
-- "Tomorrow’s Biology exam: quick last-minute checklist"
-
 Now produce JSON:
 {{
   "subject": "S concise subject line{(' — ' + subject_line_nudge) if subject_line_nudge else ''}",
@@ -256,58 +452,6 @@ Now produce JSON:
 }}
 """.strip()
 
-        try:
-            if self.client:
-                resp = self.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.5,
-                    max_tokens=220,
-                )
-                raw = resp.choices[0].message.content.strip()
-                try:
-                    result = json.loads(raw)
-                except Exception:
-                    # Try to recover JSON object from text
-                    import re
-                    m = re.search(r"\{.*\}", raw, flags=re.DOTALL)
-                    result = json.loads(m.group(0)) if m else {}
-                subject = (result.get("subject") or "").strip()
-                content = (result.get("content") or "").strip()
-                if not subject or not content:
-                    raise ValueError("LLM returned empty fields")
-                return {"subject": subject, "content": content}
-        except Exception as e:
-            logger.warning("LLM email generation failed in LLMService: %s", str(e))
-
-        # Fallback: deterministic copy guided by hints
-        subj_hint = preferred_subject or "your"
-        when = (day_hint or "soon")
-        if rule_id == "exam_last_minute_prep":
-            subject = f"{when.title()}’s {subj_hint} exam: 45-minute crash plan ✅"
-            content = (
-                f"Hello {first_name}!\n\n"
-                f"Your {subj_hint} exam is {when}. Here’s a focused, high-yield plan:\n\n"
-                "• 15 min — quick review of your most-missed ideas\n"
-                "• 15 min — 10 mixed practice Qs (no notes)\n"
-                "• 10 min — check answers & fix 2 weak patterns\n"
-                "• 5  min — one-page cheat sheet (from memory, then fill gaps)\n\n"
-                "Start a 10-question mini-set now."
-            )
-        elif rule_id == "exam_post_checkin":
-            subject = f"How did the {subj_hint} exam go? 📚"
-            content = (
-                f"Hi {first_name}! How did it go? Jot one solid concept, one surprise, and one target for next week. "
-                "Start a quick debrief quiz from your tricky areas."
-            )
-        else:
-            subject = f"Keep going, {first_name}! 🎓"
-            content = (
-                f"Hi {first_name}! Let’s lock in a quick 10-minute study block today. "
-                "Start a focused set now."
-            )
-
-        return {"subject": subject, "content": content}
     # --------- Other helpers (unchanged) ------------------------------------
 
     def _generate_embedding(self, text: str) -> List[float]:
@@ -375,3 +519,22 @@ Now produce JSON:
             'learning_gaps': ['needs more practice'] if sentiment < 0 else [],
             'engagement_level': 'high' if sentiment > 0 else 'medium' if sentiment == 0 else 'low'
         }
+
+
+@functools.lru_cache(maxsize=None)
+def get_llm_service() -> LLMService:
+    """Process-wide LLMService shared by the email, feature and event services."""
+    return LLMService()
+
+
+def _reset_after_fork() -> None:
+    # The OpenAI client's connection pool and the caches' Redis connections are the
+    # parent's sockets; a forked child (FeatureEngine workers) builds its own
+    get_llm_service.cache_clear()
+    _shared_client.cache_clear()
+    _shared_email_cache.cache_clear()
+    _shared_analysis_cache.cache_clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,19 @@
+from datetime import datetime, timedelta, timezone
+
+from services.decision_engine import DecisionEngine
+
+
+def test_cooldown_from_bulk_lookup_compares_aware_send_times():
+    engine = DecisionEngine()
+    rule = engine.rules[0]
+    cooldown = rule['action'].get('cooldown_days', 1)
+    now = datetime.now(timezone.utc)
+    # _load_last_rule_sends returns max(EmailSend.ts), a timestamptz
+    last_sent = {
+        ('recent', rule['id']): now - timedelta(hours=1),
+        ('stale', rule['id']): now - timedelta(days=cooldown + 1),
+    }
+
+    assert engine._is_rule_in_cooldown('recent', rule['id'], db=None, last_sent=last_sent)
+    assert not engine._is_rule_in_cooldown('stale', rule['id'], db=None, last_sent=last_sent)
+    assert not engine._is_rule_in_cooldown('never', rule['id'], db=None, last_sent=last_sent)
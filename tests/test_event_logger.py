@@ -0,0 +1,31 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from services import event_logger as event_logger_module
+from services.event_logger import EventLogger
+
+
+@pytest.fixture
+def inserts(monkeypatch):
+    calls = []
+    monkeypatch.setattr(event_logger_module.pg, "insert_events_many", lambda events: calls.append(list(events)))
+    return calls
+
+
+def test_batch_writes_buffered_events_in_one_insert(inserts):
+    with EventLogger().batch() as run_events:
+        for step in ("features_computed", "decisions_made", "email_generated"):
+            run_events.event(step, {"step": step}, user_id="u1", run_id="r1")
+        assert inserts == []
+
+    assert len(inserts) == 1
+    assert [e["event_type"] for e in inserts[0]] == ["features_computed", "decisions_made", "email_generated"]
+
+
+def test_batch_flushes_at_size_limit(inserts):
+    with EventLogger().batch() as run_events:
+        for i in range(event_logger_module._BATCH_MAX_EVENTS + 1):
+            run_events.event("tick", {"i": i})
+
+    assert [len(events) for events in inserts] == [event_logger_module._BATCH_MAX_EVENTS, 1]
@@ -0,0 +1,34 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("boto3")
+
+from services.feature_engine import FeatureEngine
+
+
+class _FakeLLM:
+    async def analyze_conversations_for_triggers(self, conversations):
+        return {'topics': ['Biology>Cells'], 'sentiment_avg': 0.5, 'triggers': [], 'insights': {}}
+
+
+def _engine() -> FeatureEngine:
+    engine = FeatureEngine.__new__(FeatureEngine)
+    engine.llm_service = _FakeLLM()
+    return engine
+
+
+def test_conversation_analysis_accepts_aware_timestamps_with_naive_cutoff():
+    # The DB path passes timestamptz values and a naive midnight cutoff
+    week_ago = datetime.combine(date.today(), datetime.min.time()) - timedelta(days=7)
+    now = datetime.now(timezone.utc)
+    events = [
+        {'ts': now - timedelta(days=1), 'props': {'role': 'user', 'content': 'cells'}},
+        {'ts': now - timedelta(hours=1), 'props': {'role': 'user', 'content': 'mitosis'}},
+        {'ts': now - timedelta(days=30), 'props': {'role': 'user', 'content': 'old'}},
+    ]
+
+    features = _engine()._analyze_conversations_with_ai(events, week_ago)
+
+    assert features['conversations_7d'] == 2
+    assert features['top_topics'] == ['Biology>Cells']